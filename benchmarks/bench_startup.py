@@ -0,0 +1,68 @@
+"""Startup benchmark for camera-transfer.
+
+Imports the command line module in fresh interpreters, the way every card
+insert does, and reports the median wall time and the slowest imports from
+``python -X importtime``. With ``--max-ms`` it exits non-zero when the median
+is slower, so it can guard against startup regressions.
+
+    python benchmarks/bench_startup.py --runs 20 --max-ms 400 --output startup.json
+"""
+import argparse
+import json
+import re
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Any
+
+IMPORT = "import camera_transfer.app"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def time_import() -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", IMPORT], check=True)
+    return time.perf_counter() - start
+
+
+def slowest_imports(limit: int) -> list[dict[str, Any]]:
+    """Top-level imports of camera_transfer.app by cumulative time."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", IMPORT], check=True, capture_output=True, text=True
+    )
+    imports = []
+    for match in IMPORTTIME_LINE.finditer(completed.stderr):
+        _, cumulative, indent, module = match.groups()
+        # importtime indents by two spaces per level; level 1 is what app imports.
+        if len(indent) <= 3:
+            imports.append({"module": module, "cumulative_ms": int(cumulative) / 1000})
+    return sorted(imports, key=lambda item: item["cumulative_ms"], reverse=True)[:limit]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ms", type=float, help="Fail when the median import time is slower than this")
+    parser.add_argument("--output", type=Path, default=Path("bench_startup.json"))
+    args = parser.parse_args()
+
+    time_import()  # warm the file system cache and the bytecode cache
+    times = [time_import() for _ in range(args.runs)]
+    result = {
+        "python": sys.version,
+        "runs": args.runs,
+        "median_ms": statistics.median(times) * 1000,
+        "min_ms": min(times) * 1000,
+        "slowest_imports": slowest_imports(10),
+    }
+    print(json.dumps(result, indent=2))
+    args.output.write_text(json.dumps(result, indent=2))
+
+    if args.max_ms is not None and result["median_ms"] > args.max_ms:
+        sys.exit(f"Median import time {result['median_ms']:.0f} ms is over the limit of {args.max_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
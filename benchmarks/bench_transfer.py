@@ -0,0 +1,181 @@
+"""Throughput benchmarks for camera-transfer.
+
+Builds synthetic cards (see synthetic_card.py) and imports them through
+app.get_camera_transfer_operation, the same way the command line does.
+Each scenario runs in its own process so peak RSS is measured per scenario.
+Results are written as JSON so runs of different versions can be compared.
+
+    python benchmarks/bench_transfer.py --images 2000 --videos 2 --output bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable
+
+from synthetic_card import CAMERA_MODELS, CardSpec, build_card
+
+import camera_transfer
+from camera_transfer import app
+from camera_transfer.camera_settings import CameraSettings
+
+MB = 1024 * 1024
+
+
+def folder_size(location: Path) -> int:
+    return sum(path.stat().st_size for path in location.rglob("*") if path.is_file())
+
+
+def settings_for(card: Path, library: Path, database: Path, jobs: int) -> CameraSettings:
+    library.mkdir(parents=True, exist_ok=True)
+    return CameraSettings(
+        camera_folder=card,
+        main_photos_folder=library,
+        main_videos_folder=library,
+        sqlite_database=database,
+        camera_model_short_names=CAMERA_MODELS,
+        dry_run=False,
+        log_level="WARNING",
+        jobs=jobs,
+    )
+
+
+def timed(function: Callable[[], Any]) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def stage_times(settings: CameraSettings) -> dict[str, float]:
+    """Time the read-only stages one at a time over the whole card."""
+    getter = app.file_getter(settings)
+    camera_files = app.camera_file_getter(settings)
+    stages = {"scan": timed(lambda: list(getter.get_next_file()))}
+
+    images = [f for f in camera_files.get_next_file() if f.file_category == "image"]
+    stages["exif"] = timed(lambda: [image.generate_new_file_name() for image in images])
+    stages["hash"] = timed(lambda: [f.file_hash() for f in camera_files.get_next_file()])
+    return stages
+
+
+def run_import(settings: CameraSettings) -> dict[str, Any]:
+    # Every FileGetter, including the archive ones, can list a card like this.
+    card_files = list(app.file_getter(settings).get_next_file())
+    card_bytes = sum(card_file.file_size for card_file in card_files)
+    operation = app.get_camera_transfer_operation(settings)
+    operation.metrics.timings = True
+    elapsed = timed(operation.run)
+    return {
+        "counters": operation.metrics.counters,
+        "import_stages": {name: histogram.total for name, histogram in operation.metrics.stages.items()},
+        "files": len(card_files),
+        "bytes": card_bytes,
+        "seconds": elapsed,
+        "files_per_second": len(card_files) / elapsed,
+        "mb_per_second": card_bytes / MB / elapsed,
+    }
+
+
+def scenario_process(name: str, work_dir: Path, spec: CardSpec, jobs: int, results: "multiprocessing.Queue[dict[str, Any]]") -> None:
+    scenario_dir = work_dir / name
+    library = scenario_dir / "library"
+    database = scenario_dir / "camera-transfer.db"
+
+    if name == "cold":
+        card = work_dir / "card"
+    elif name == "duplicate":
+        # Same card again: every file is recognised from its fingerprint.
+        card = work_dir / "card"
+        app.get_camera_transfer_operation(settings_for(card, library, database, jobs)).run()
+    elif name == "duplicate_touched":
+        # Same content with new modification times: every file is hashed.
+        card = work_dir / "card"
+        app.get_camera_transfer_operation(settings_for(card, library, database, jobs)).run()
+        card = scenario_dir / "card"
+        shutil.copytree(work_dir / "card", card)
+        for path in card.rglob("*.*"):
+            mtime = path.stat().st_mtime + 1
+            os.utime(path, (mtime, mtime))
+    elif name == "mixed":
+        # Half of the images were imported from an earlier visit of the card.
+        earlier = scenario_dir / "earlier_card"
+        build_card(earlier, CardSpec(images=spec.images // 2, image_size=spec.image_size, videos=0, seed=spec.seed))
+        app.get_camera_transfer_operation(settings_for(earlier, library, database, jobs)).run()
+        card = work_dir / "card"
+    else:
+        raise ValueError(f"Unknown scenario {name}")
+
+    settings = settings_for(card, library, database, jobs)
+    result: dict[str, Any] = {"scenario": name}
+    if name == "cold":
+        result["stages"] = stage_times(settings)
+    result.update(run_import(settings))
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put(result)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=2000)
+    parser.add_argument("--image-size-mb", type=float, default=4)
+    parser.add_argument("--videos", type=int, default=2)
+    parser.add_argument("--video-size-mb", type=float, default=2048)
+    parser.add_argument("--jobs", type=int, default=1)
+    parser.add_argument("--scenario", action="append", choices=["cold", "duplicate", "duplicate_touched", "mixed"])
+    parser.add_argument("--work-dir", type=Path, help="Where to build the cards and libraries (default: a temporary folder)")
+    parser.add_argument("--output", type=Path, default=Path("bench_results.json"))
+    args = parser.parse_args()
+
+    spec = CardSpec(
+        images=args.images,
+        image_size=int(args.image_size_mb * MB),
+        videos=args.videos,
+        video_size=int(args.video_size_mb * MB),
+    )
+    work_dir = args.work_dir or Path(tempfile.mkdtemp(prefix="camera-transfer-bench-"))
+    scenarios = args.scenario or ["cold", "duplicate", "duplicate_touched", "mixed"]
+
+    try:
+        print(f"Building synthetic card in {work_dir}")
+        build_card(work_dir / "card", spec)
+
+        context = multiprocessing.get_context("spawn")
+        results: "multiprocessing.Queue[dict[str, Any]]" = context.Queue()
+        runs = []
+        for name in scenarios:
+            process = context.Process(target=scenario_process, args=(name, work_dir, spec, args.jobs, results))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(f"Scenario {name} failed with exit code {process.exitcode}")
+            result = results.get()
+            print(json.dumps(result))
+            runs.append(result)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "version": camera_transfer.__version__,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "card": {**asdict(spec), "start": spec.start.isoformat()},
+        "jobs": args.jobs,
+        "runs": runs,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""Build synthetic camera cards for the benchmarks.
+
+Images are JPEG shells with a real EXIF APP1 segment (Model, DateTime and
+DateTimeOriginal) followed by random filler, so every stage that looks at
+the files sees something realistic. Videos are sparse MP4 files: a small
+header and a unique tail around a hole, so multi-GB clips cost no disk space.
+"""
+import os
+import random
+import struct
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+
+CAMERA_MODELS = {
+    "COOLPIX S9700": "S9700",
+    "TFY-LX1": "phone",
+    "Canon EOS R6": "R6",
+    "ILCE-7M3": "A7III",
+}
+
+
+def exif_segment(model: str, taken: datetime) -> bytes:
+    """A big-endian EXIF APP1 segment with the tags the importer reads."""
+    model_value = model.encode("ascii") + b"\x00"
+    datetime_value = taken.strftime("%Y:%m:%d %H:%M:%S").encode("ascii") + b"\x00"
+
+    ifd0_offset = 8
+    ifd0_size = 2 + 3 * 12 + 4
+    exif_ifd_offset = ifd0_offset + ifd0_size
+    exif_ifd_size = 2 + 1 * 12 + 4
+    data_offset = exif_ifd_offset + exif_ifd_size
+
+    model_offset = data_offset
+    datetime_offset = model_offset + len(model_value)
+    ifd0 = struct.pack(">H", 3)
+    ifd0 += struct.pack(">HHII", 0x0110, 2, len(model_value), model_offset)
+    ifd0 += struct.pack(">HHII", 0x0132, 2, len(datetime_value), datetime_offset)
+    ifd0 += struct.pack(">HHII", 0x8769, 4, 1, exif_ifd_offset)
+    ifd0 += struct.pack(">I", 0)
+    exif_ifd = struct.pack(">H", 1)
+    exif_ifd += struct.pack(">HHII", 0x9003, 2, len(datetime_value), datetime_offset)
+    exif_ifd += struct.pack(">I", 0)
+
+    tiff = b"MM" + struct.pack(">HI", 42, ifd0_offset) + ifd0 + exif_ifd + model_value + datetime_value
+    app1 = b"Exif\x00\x00" + tiff
+    return b"\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1
+
+
+def write_image(path: Path, model: str, taken: datetime, size: int, rng: random.Random) -> None:
+    header = b"\xff\xd8" + exif_segment(model, taken) + b"\xff\xda\x00\x02"
+    filler = rng.randbytes(max(size - len(header) - 2, 0))
+    path.write_bytes(header + filler + b"\xff\xd9")
+
+
+def write_sparse_video(path: Path, size: int, rng: random.Random) -> None:
+    ftyp = struct.pack(">I4s4sI8s", 24, b"ftyp", b"isom", 0x200, b"isomiso2")
+    with path.open("wb") as handle:
+        handle.write(ftyp + rng.randbytes(4096))
+        handle.truncate(size)
+        handle.seek(max(size - 4096, handle.tell()))
+        handle.write(rng.randbytes(4096))
+
+
+@dataclass
+class CardSpec:
+    images: int = 2000
+    image_size: int = 4 * 1024 * 1024
+    videos: int = 2
+    video_size: int = 2 * 1024 * 1024 * 1024
+    seed: int = 1
+    start: datetime = field(default_factory=lambda: datetime(2022, 7, 27, 11, 54, 9))
+
+
+def build_card(location: Path, spec: CardSpec) -> list[Path]:
+    """Write a DCIM tree like a camera would and return the files created."""
+    rng = random.Random(spec.seed)
+    files = []
+    models = list(CAMERA_MODELS)
+    for number in range(spec.images):
+        model = models[number % len(models)]
+        folder = location / "DCIM" / f"{100 + number // 999}{CAMERA_MODELS[model].upper()[:5]}"
+        folder.mkdir(parents=True, exist_ok=True)
+        taken = spec.start + timedelta(seconds=number)
+        path = folder / f"DSCN{number % 9999 + 1:04d}.JPG"
+        write_image(path, model, taken, spec.image_size, rng)
+        os.utime(path, (taken.timestamp(), taken.timestamp()))
+        files.append(path)
+
+    for number in range(spec.videos):
+        folder = location / "DCIM" / "100VIDEO"
+        folder.mkdir(parents=True, exist_ok=True)
+        taken = spec.start + timedelta(minutes=number)
+        path = folder / f"MOV{number + 1:04d}.MP4"
+        write_sparse_video(path, spec.video_size, rng)
+        os.utime(path, (taken.timestamp(), taken.timestamp()))
+        files.append(path)
+    return files
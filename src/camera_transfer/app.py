@@ -1,18 +1,27 @@
 import argparse
+import json
 import logging
+import sys
+import threading
+from datetime import datetime, timedelta
+from contextlib import nullcontext
 from pathlib import Path
-from pydantic import ValidationError
-import rich
+from typing import TYPE_CHECKING, ContextManager, Optional
 
-import platformdirs
+from camera_transfer.metrics import TransferMetrics
 
-
-from camera_transfer.camera_file_getter import CameraFileGetter
-from camera_transfer.camera_transfer import CameraTransfer
-from camera_transfer.camera_settings import CameraSettings
-from camera_transfer.hash_store import HashStore
-from camera_transfer.os_file_getter import OSFileGetter
-from camera_transfer.os_output_file_writer import OSOutputFileWriter
+# Everything else is imported by the function that needs it, so that
+# ``--help`` and the subcommands only pay for what they use.
+if TYPE_CHECKING:
+    from camera_transfer.camera_file_getter import CameraFileGetter, FileGetter
+    from camera_transfer.camera_transfer import CameraTransfer, OutputFileWriter
+    from camera_transfer.camera_settings import CameraSettings
+    from camera_transfer.hash_store import HashStore, LibraryFile
+    from camera_transfer.library_seed import SeedCounts
+    from camera_transfer.library_verify import VerifyReport
+    from camera_transfer.library_rehash import HashStore as RehashableHashStore, LibraryRehash
+    from camera_transfer.multi_camera_transfer import MultiCameraTransfer
+    from camera_transfer.transfer_plan import TransferPlan
 
 
 def set_up_logging(log_level: str) -> None:
@@ -35,6 +44,24 @@ def set_up_logging(log_level: str) -> None:
     logging.getLogger("urllib3").setLevel(logging.WARNING)
     logging.getLogger("s3transfer").setLevel(logging.WARNING)
 
+def date_range(text: str) -> tuple[datetime, datetime]:
+    """The start and end of the year, month, day or second that ``text`` names."""
+    try:
+        if len(text) == 4:
+            start = datetime(int(text), 1, 1)
+            return start, start.replace(year=start.year + 1)
+        if len(text) == 7:
+            start = datetime.strptime(text, "%Y-%m")
+            return start, (start + timedelta(days=31)).replace(day=1)
+        if len(text) == 10:
+            start = datetime.strptime(text, "%Y-%m-%d")
+            return start, start + timedelta(days=1)
+        start = datetime.fromisoformat(text)
+        return start, start + timedelta(seconds=1)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text!r} is not a date like 2022, 2022-07, 2022-07-14 or 2022-07-14T10:30:00")
+
+
 def parse_args() -> argparse.Namespace:
     """Parse command line arguments."""
     parser = argparse.ArgumentParser(
@@ -43,11 +70,108 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--dry-run",
         action="store_true",
-        help="Show what would be transferred without actually doing it.",
+        help="Show what would be transferred without reading or writing whole files (the same as plan).",
+    )
+    parser.add_argument(
+        "--camera-folder",
+        action="append",
+        type=Path,
+        help="Import from this folder, or zip or tar of a card, instead of CT_CAMERA_FOLDER. Repeat to import several cards at once.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of files to read, hash and write concurrently.",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Time each stage of the transfer and include the timings in the summary.",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        type=Path,
+        help="Write counters and stage timings to this JSON file at the end of the run.",
+    )
+    parser.add_argument(
+        "--no-progress",
+        action="store_true",
+        help="Do not show the live progress display.",
+    )
+    parser.add_argument(
+        "--rehash-library",
+        action="store_true",
+        help="Rehash files already in the library with CT_HASH_ALGORITHM while the transfer runs.",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+    seed_parser = subparsers.add_parser(
+        "seed",
+        aliases=["index"],
+        help="Add the files already in the photos and videos folders to the hash store.",
+    )
+    seed_parser.add_argument(
+        "--processes",
+        type=int,
+        help="Number of processes hashing files (default: one per CPU).",
+    )
+    seed_parser.set_defaults(command="seed")
+    verify_parser = subparsers.add_parser(
+        "verify",
+        help="Check the least recently verified part of the library against the hash store.",
+    )
+    verify_parser.add_argument(
+        "--cycle-days",
+        type=float,
+        help="Verify about 1/N of the library, so a daily run covers all of it every N days.",
+    )
+    verify_parser.add_argument(
+        "--max-mb-per-second",
+        type=float,
+        help="Limit how fast the library is read.",
+    )
+    plan_parser = subparsers.add_parser(
+        "plan",
+        help="Work out what a transfer would copy, from file names, sizes and EXIF headers only.",
     )
+    plan_parser.add_argument("--output", type=Path, help="Write the plan to this JSON file for execute.")
+    execute_parser = subparsers.add_parser(
+        "execute",
+        help="Run a plan written by plan --output, without scanning the cards again.",
+    )
+    execute_parser.add_argument("plan", type=Path, help="Plan file written by plan --output.")
+    query_parser = subparsers.add_parser(
+        "query",
+        help="List library files by capture date, camera model or content.",
+    )
+    query_parser.add_argument(
+        "--from",
+        dest="captured_from",
+        type=date_range,
+        help="Captured during or after this year, month, day or time, for example 2022-07.",
+    )
+    query_parser.add_argument(
+        "--to",
+        dest="captured_to",
+        type=date_range,
+        help="Captured during or before this year, month, day or time.",
+    )
+    query_parser.add_argument(
+        "--model",
+        help="Camera model, as its full EXIF name or its short name from CT_CAMERA_MODEL_SHORT_NAMES.",
+    )
+    query_parser.add_argument("--category", choices=["image", "video"])
+    query_parser.add_argument("--hash", help="Find where the content with this hex digest is in the library.")
+    query_parser.add_argument(
+        "--duplicates",
+        action="store_true",
+        help="Only list files whose content is in the library more than once.",
+    )
+    query_parser.add_argument("--json", action="store_true", help="Print the matches as JSON.")
     return parser.parse_args()
 
 def create_settings_file(settings_file: Path) -> None:
+    import platformdirs
+
     print(f"Creating settings file {settings_file}")
     settings_file.parent.mkdir(parents=True, exist_ok=True)
     settings_file.write_text(f"""
@@ -60,17 +184,28 @@ CT_IMAGE_FORMATS='[".jpg", ".jpeg", ".JPG", ".JPEG", ".png", ".PNG"]'
 CT_VIDEO_FORMATS='[".mov", ".MOV",  ".mp4", ".MP4"]'
 CT_DRY_RUN=False
 CT_LOG_LEVEL=INFO
+CT_JOBS=1
+CT_MAX_IN_FLIGHT_MB=1024
 """)
 
-def load_settings_from_file(settings_file: Path) -> CameraSettings:
+def load_settings_from_file(settings_file: Path, snapshot_file: Optional[Path] = None) -> "CameraSettings":
+    from pydantic import ValidationError
+
+    from camera_transfer.camera_settings import load_settings_snapshot, read_settings_file, save_settings_snapshot
+
     if not settings_file.exists():
        print(f"The settings file {settings_file} does not exist.")
        create_settings_file(settings_file)
 
+    if snapshot_file is not None:
+        snapshot = load_settings_snapshot(settings_file, snapshot_file)
+        if snapshot is not None:
+            return snapshot
+
     print(f"Loading settings from {settings_file}")
 
     try:
-        s = CameraSettings(_env_file=settings_file)
+        s = read_settings_file(settings_file)
     except ValidationError as e:
         # Check for camera_folder specific error
         for err in e.errors():
@@ -86,49 +221,447 @@ def load_settings_from_file(settings_file: Path) -> CameraSettings:
         traceback.print_exc()
         raise e
 
-    rich.print(s.model_dump())
+    if snapshot_file is not None:
+        save_settings_snapshot(s, settings_file, snapshot_file)
     return s
 
 
-def file_getter(settings: CameraSettings) -> OSFileGetter:
+def camera_folders(settings: "CameraSettings") -> list[Path]:
+    return list(settings.camera_folders) or [settings.camera_folder]
+
+
+def spool_folder(settings: "CameraSettings") -> Path:
+    # Video members of a compressed tar can be several GB, too big for a
+    # temporary folder in memory, so they are spooled next to the library.
+    return settings.spool_folder or settings.main_photos_folder
+
+
+def file_getter(settings: "CameraSettings", camera_folder: Optional[Path] = None) -> "FileGetter":
+    from camera_transfer.archive_file_getter import ArchiveFileGetter, is_archive
+    from camera_transfer.os_file_getter import OSFileGetter
+
+    location = camera_folder or settings.camera_folder
     all_formats = settings.image_formats | settings.video_formats
-    return OSFileGetter(location=settings.camera_folder, file_extensions=all_formats)
+    if is_archive(location):
+        return ArchiveFileGetter(location=location, file_extensions=all_formats, spool_folder=spool_folder(settings))
+    return OSFileGetter(
+        location=location,
+        file_extensions=all_formats,
+        fingerprint_inode=settings.fingerprint_inode,
+        read_order=settings.read_order,
+    )
+
 
+def camera_file_getter(
+    settings: "CameraSettings",
+    camera_folder: Optional[Path] = None,
+    hash_algorithms: Optional[tuple[str, ...]] = None,
+    plan: "Optional[TransferPlan]" = None,
+) -> "CameraFileGetter":
+    from camera_transfer.camera_file_getter import CameraFileGetter
+    from camera_transfer.transfer_plan import PlanFileGetter
 
-def camera_file_getter(settings: CameraSettings) -> CameraFileGetter:
+    source: "FileGetter"
+    if plan is not None:
+        assert camera_folder is not None
+        source = PlanFileGetter(
+            plan, str(camera_folder), fingerprint_inode=settings.fingerprint_inode, spool_folder=spool_folder(settings)
+        )
+    else:
+        source = file_getter(settings, camera_folder)
     return CameraFileGetter(
-        file_getter=file_getter(settings),
+        file_getter=source,
         camera_model_short_names=settings.camera_model_short_names,
         image_formats=settings.image_formats,
         video_formats=settings.video_formats,
+        hash_algorithms=hash_algorithms or (settings.hash_algorithm,),
     )
 
 
-def get_camera_transfer_operation(settings: CameraSettings) -> CameraTransfer:
-    return CameraTransfer(
-        camera_file_getter=camera_file_getter(settings),
-        output_file_writer=OSOutputFileWriter(
-            base_image_location=settings.main_photos_folder,
-            base_video_location=settings.main_photos_folder,
+def output_file_writer(settings: "CameraSettings") -> "OutputFileWriter":
+    if settings.s3_bucket:
+        # boto3 is an optional dependency and slow to import.
+        from camera_transfer.s3_output_file_writer import S3OutputFileWriter
+
+        part_size = settings.s3_part_size_mb * 1024 * 1024
+        return S3OutputFileWriter(
+            bucket=settings.s3_bucket,
+            image_prefix=settings.s3_image_prefix,
+            video_prefix=settings.s3_video_prefix,
             dry_run=settings.dry_run,
-        ),
-        hash_store=HashStore(database_file=settings.sqlite_database),
+            endpoint_url=settings.s3_endpoint_url,
+            max_concurrency=settings.s3_max_concurrency,
+            max_bandwidth=int(settings.s3_max_mb_per_second * 1024 * 1024) if settings.s3_max_mb_per_second else None,
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            spool_folder=settings.spool_folder,
+        )
+    from camera_transfer.os_output_file_writer import OSOutputFileWriter
+
+    return OSOutputFileWriter(
+        base_image_location=settings.main_photos_folder,
+        base_video_location=settings.main_photos_folder,
+        dry_run=settings.dry_run,
+        durability=settings.durability,
+        copy_strategy=settings.copy_strategy,
+        preallocate_min_size=settings.preallocate_min_mb * 1024 * 1024,
+    )
+
+
+def hash_store(settings: "CameraSettings") -> "HashStore":
+    from camera_transfer.hash_store import HashStore
+
+    return HashStore(
+        database_file=settings.sqlite_database,
+        dry_run=settings.dry_run,
+        batch_size=settings.hash_store_batch_size,
+        flush_interval=settings.hash_store_flush_seconds,
+        algorithm=settings.hash_algorithm,
+    )
+
+
+def transfer_metrics(settings: "CameraSettings") -> TransferMetrics:
+    return TransferMetrics(timings=settings.stage_timings or settings.metrics_json is not None)
+
+
+def library_rehash(settings: "CameraSettings", hash_store: "RehashableHashStore") -> "LibraryRehash":
+    from camera_transfer.library_rehash import LibraryRehash
+
+    return LibraryRehash(
+        hash_store=hash_store,
+        library_folders=[settings.main_photos_folder, settings.main_videos_folder],
     )
 
 
+def seed_library(settings: "CameraSettings", processes: Optional[int] = None) -> "SeedCounts":
+    from camera_transfer.library_seed import LibrarySeed
+
+    with hash_store(settings) as store:
+        return LibrarySeed(
+            hash_store=store,
+            library_folders=[settings.main_photos_folder, settings.main_videos_folder],
+            file_extensions=settings.image_formats | settings.video_formats,
+            jobs=processes,
+        ).run()
+
+
+def verify_library(settings: "CameraSettings") -> "VerifyReport":
+    from camera_transfer.library_verify import LibraryVerify
+
+    max_mb_per_second = settings.verify_max_mb_per_second
+    with hash_store(settings) as store:
+        return LibraryVerify(
+            hash_store=store,
+            cycle_days=settings.verify_cycle_days,
+            max_bytes_per_second=max_mb_per_second * 1024 * 1024 if max_mb_per_second else None,
+            jobs=settings.jobs,
+        ).run()
+
+
+def query_library(
+    settings: "CameraSettings",
+    captured_from: Optional[tuple[datetime, datetime]] = None,
+    captured_to: Optional[tuple[datetime, datetime]] = None,
+    camera_model: Optional[str] = None,
+    category: Optional[str] = None,
+    hash_hex: Optional[str] = None,
+    duplicates: bool = False,
+) -> "list[LibraryFile]":
+    camera_models = None
+    if camera_model is not None:
+        camera_models = [camera_model] + [
+            model for model, short_name in settings.camera_model_short_names.items() if short_name == camera_model
+        ]
+    with hash_store(settings) as store:
+        return store.query_library(
+            captured_from=captured_from[0] if captured_from else None,
+            captured_before=captured_to[1] if captured_to else None,
+            camera_models=camera_models,
+            category=category,
+            hash_value=bytes.fromhex(hash_hex) if hash_hex else None,
+            duplicates=duplicates,
+        )
+
+
+def print_library_files(library_files: "list[LibraryFile]", as_json: bool = False) -> None:
+    if as_json:
+        print(json.dumps([
+            {
+                "path": library_file.path,
+                "size": library_file.size,
+                "hash": library_file.hash.hex(),
+                "algorithm": library_file.algorithm,
+                "category": library_file.category,
+                "camera_model": library_file.camera_model,
+                "captured_at": library_file.captured_at.isoformat() if library_file.captured_at else None,
+                "source": library_file.source,
+                "import_run": library_file.import_run,
+            }
+            for library_file in library_files
+        ], indent=2))
+        return
+    for library_file in library_files:
+        captured_at = library_file.captured_at.isoformat() if library_file.captured_at else "-"
+        print(
+            f"{library_file.hash.hex()[:12]}  {captured_at:19}  {library_file.camera_model or '-':20}  "
+            f"{library_file.size:>12}  {library_file.path}"
+        )
+
+
+def plan_transfer(settings: "CameraSettings") -> "TransferPlan":
+    """Plan a transfer from every camera folder into one plan."""
+    from camera_transfer.camera_transfer import import_sub_folder
+    from camera_transfer.transfer_plan import TransferPlan, TransferPlanner
+
+    writer = output_file_writer(settings)
+    plan = TransferPlan(sub_folder=import_sub_folder().as_posix())
+    try:
+        with hash_store(settings) as store:
+            for camera_folder in camera_folders(settings):
+                plan.files.extend(TransferPlanner(
+                    camera_file_getter=camera_file_getter(settings, camera_folder),
+                    output_file_writer=writer,
+                    hash_store=store,
+                    card=str(camera_folder.resolve()),
+                    sub_folder=Path(plan.sub_folder),
+                    jobs=settings.jobs,
+                ).plan().files)
+    finally:
+        writer.close()
+    # Files from different cards can be the same or go to the same place too.
+    plan.mark_possible_duplicates()
+    plan.mark_collisions()
+    return plan
+
+
+def print_plan(plan: "TransferPlan", list_files: bool = True) -> None:
+    if list_files:
+        for planned_file in plan.files:
+            notes = [
+                note for note, flag in (("possible duplicate", planned_file.possible_duplicate), ("collides", planned_file.collides))
+                if flag
+            ]
+            source = planned_file.file_path or f"{planned_file.card}/{planned_file.member}"
+            target = planned_file.destination or planned_file.error or ""
+            print(f"{planned_file.action:20} {source} -> {target}{' (' + ', '.join(notes) + ')' if notes else ''}")
+    counts = plan.counts()
+    print(
+        f"{counts['copy']} to copy, {counts['previously_imported']} previously imported, "
+        f"{counts['error']} errors, {counts['possible_duplicate']} possible duplicates, {counts['collides']} collisions."
+    )
+
+
+def show_progress(settings: "CameraSettings") -> bool:
+    return settings.progress and sys.stderr.isatty()
+
+
+def scan_ahead(settings: "CameraSettings", camera_folder: Path) -> bool:
+    from camera_transfer.archive_file_getter import is_archive
+
+    # Listing a folder is quick, but the files in an archive are only found
+    # by reading it, so its totals grow as it is imported instead.
+    return show_progress(settings) and not is_archive(camera_folder)
+
+
+def transfer_progress(settings: "CameraSettings", metrics: TransferMetrics) -> ContextManager[object]:
+    if not show_progress(settings):
+        return nullcontext()
+    # rich is only imported once there is something to show.
+    from camera_transfer.progress import TransferProgress
+
+    return TransferProgress(metrics)
+
+
+def get_camera_transfer_operation(
+    settings: "CameraSettings", camera_folder: Optional[Path] = None, plan: "Optional[TransferPlan]" = None
+) -> "CameraTransfer":
+    from camera_transfer.camera_transfer import CameraTransfer, import_sub_folder
+
+    # Files are hashed with every algorithm in the store, so that content
+    # hashed by an older version is still recognised.
+    shared_hash_store = hash_store(settings)
+    camera_folder = camera_folder or settings.camera_folder
+    return CameraTransfer(
+        camera_file_getter=camera_file_getter(settings, camera_folder, shared_hash_store.algorithms(), plan),
+        output_file_writer=output_file_writer(settings),
+        hash_store=shared_hash_store,
+        jobs=settings.jobs,
+        max_in_flight_bytes=settings.max_in_flight_mb * 1024 * 1024,
+        metrics=transfer_metrics(settings),
+        verify_writes=settings.verify_after_write,
+        source=str(camera_folder.resolve()),
+        sub_folder=Path(plan.sub_folder) if plan is not None else import_sub_folder(),
+        scan_ahead=scan_ahead(settings, camera_folder),
+    )
+
+
+def get_multi_camera_transfer_operation(settings: "CameraSettings", plan: "Optional[TransferPlan]" = None) -> "MultiCameraTransfer":
+    from camera_transfer.camera_transfer import CameraTransfer, CommitLock, import_sub_folder
+    from camera_transfer.multi_camera_transfer import MultiCameraTransfer, group_by_device
+
+    shared_writer = output_file_writer(settings)
+    shared_hash_store = hash_store(settings)
+    shared_metrics = transfer_metrics(settings)
+    commit_lock = CommitLock()
+    return MultiCameraTransfer(device_transfers=[
+        [
+            CameraTransfer(
+                camera_file_getter=camera_file_getter(settings, camera_folder, shared_hash_store.algorithms(), plan),
+                output_file_writer=shared_writer,
+                hash_store=shared_hash_store,
+                jobs=settings.jobs,
+                max_in_flight_bytes=settings.max_in_flight_mb * 1024 * 1024,
+                metrics=shared_metrics,
+                commit_lock=commit_lock,
+                verify_writes=settings.verify_after_write,
+                source=str(camera_folder.resolve()),
+                sub_folder=Path(plan.sub_folder) if plan is not None else import_sub_folder(),
+                scan_ahead=scan_ahead(settings, camera_folder),
+            )
+            for camera_folder in device_folders
+        ]
+        for device_folders in group_by_device(camera_folders(settings))
+    ])
+
+
+def print_summary(metrics: TransferMetrics) -> None:
+    # rich is only imported once there is something to show.
+    import rich
+    from rich.table import Table
+
+    counters = metrics.counters
+    megabytes = counters["bytes_read"] / (1024 * 1024)
+    rich.print(
+        f"\n[bold]{counters['copied']}[/bold] copied, "
+        f"[bold]{counters['duplicate']}[/bold] duplicates, "
+        f"[bold]{counters['previously_imported']}[/bold] previously imported, "
+        f"[bold]{counters['failed']}[/bold] failed. "
+        f"Read {megabytes:.1f} MB in {metrics.elapsed:.1f} s "
+        f"({megabytes / max(metrics.elapsed, 1e-9):.1f} MB/s)."
+    )
+    if metrics.stages:
+        table = Table(title="Stage timings")
+        for column in ("stage", "count", "total s", "p50 ms", "p95 ms", "max ms"):
+            table.add_column(column, justify="left" if column == "stage" else "right")
+        for name, histogram in metrics.stages.items():
+            table.add_row(
+                name,
+                str(histogram.count),
+                f"{histogram.total:.2f}",
+                f"{histogram.quantile(0.5) * 1000:.1f}",
+                f"{histogram.quantile(0.95) * 1000:.1f}",
+                f"{histogram.maximum * 1000:.1f}",
+            )
+        rich.print(table)
+
+
 def main() -> None:
+    import platformdirs
+
+    from camera_transfer.transfer_plan import TransferPlan
+
     logger = logging.getLogger(__name__)
 
     args = parse_args()
 
     settings_file = Path(platformdirs.user_config_dir("camera-transfer")) / "settings.env"
-    settings = load_settings_from_file(settings_file=settings_file)
+    snapshot_file = Path(platformdirs.user_cache_dir("camera-transfer")) / "settings.json"
+    settings = load_settings_from_file(settings_file=settings_file, snapshot_file=snapshot_file)
     set_up_logging(settings.log_level)
+    logger.debug("Settings: %s", settings.model_dump())
     if args.dry_run:
         logger.info("Dry run mode")
         settings.dry_run = True
-    camera_transfer_operation = get_camera_transfer_operation(settings)
-    camera_transfer_operation.run()
+    if args.camera_folder:
+        settings.camera_folders = args.camera_folder
+    if args.jobs is not None:
+        settings.jobs = args.jobs
+    if args.stats:
+        settings.stage_timings = True
+    if args.metrics_json is not None:
+        settings.metrics_json = args.metrics_json
+    if args.no_progress:
+        settings.progress = False
+    if args.rehash_library:
+        settings.rehash_library = True
+    if args.command == "seed":
+        counts = seed_library(settings, args.processes)
+        print(
+            f"{counts.hashed} hashed, {counts.unchanged} unchanged, "
+            f"{counts.removed} removed, {counts.failed} failed."
+        )
+        return
+    if args.command == "verify":
+        if args.cycle_days is not None:
+            settings.verify_cycle_days = args.cycle_days
+        if args.max_mb_per_second is not None:
+            settings.verify_max_mb_per_second = args.max_mb_per_second
+        report = verify_library(settings)
+        print(
+            f"{report.verified} verified ({report.bytes_verified / (1024 * 1024):.1f} MB), "
+            f"{len(report.corrupt)} corrupt, {len(report.missing)} missing, {len(report.modified)} modified."
+        )
+        for label, paths in (("Corrupt", report.corrupt), ("Missing", report.missing), ("Modified", report.modified)):
+            for path in paths:
+                print(f"{label}: {path}")
+        if not report.ok:
+            sys.exit(1)
+        return
+    if args.command == "query":
+        try:
+            library_files = query_library(
+                settings,
+                captured_from=args.captured_from,
+                captured_to=args.captured_to,
+                camera_model=args.model,
+                category=args.category,
+                hash_hex=args.hash,
+                duplicates=args.duplicates,
+            )
+        except ValueError as error:
+            sys.exit(f"Invalid query: {error}")
+        print_library_files(library_files, as_json=args.json)
+        return
+
+    plan: "Optional[TransferPlan]" = None
+    if args.command == "plan" or (args.command is None and settings.dry_run):
+        plan = plan_transfer(settings)
+        if args.command == "plan" and args.output is not None:
+            plan.write(args.output)
+            print(f"Wrote plan to {args.output}")
+        print_plan(plan, list_files=args.command is None or args.output is None)
+        return
+    if args.command == "execute":
+        plan = TransferPlan.read(args.plan)
+        settings.camera_folders = [Path(card) for card in plan.cards]
+        if not plan.cards:
+            print("Nothing to execute.")
+            return
+
+    camera_transfer_operation: "CameraTransfer | MultiCameraTransfer"
+    if len(camera_folders(settings)) > 1:
+        camera_transfer_operation = get_multi_camera_transfer_operation(settings, plan)
+    else:
+        camera_transfer_operation = get_camera_transfer_operation(settings, camera_folders(settings)[0], plan)
+    rehash: "Optional[LibraryRehash]" = None
+    rehash_thread: Optional[threading.Thread] = None
+    if settings.rehash_library:
+        rehash = library_rehash(settings, camera_transfer_operation.hash_store)
+        rehash_thread = threading.Thread(target=rehash.run, name="ct-rehash")
+        rehash_thread.start()
+    try:
+        with transfer_progress(settings, camera_transfer_operation.metrics):
+            camera_transfer_operation.run()
+    finally:
+        # The import does not wait for the whole library to be rehashed; what
+        # is left is rehashed during the next run.
+        if rehash is not None and rehash_thread is not None:
+            rehash.stop.set()
+            rehash_thread.join()
+        camera_transfer_operation.output_file_writer.close()
+        print_summary(camera_transfer_operation.metrics)
+        if settings.metrics_json is not None:
+            camera_transfer_operation.metrics.write_json(settings.metrics_json)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,187 @@
+import io
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+from collections.abc import Buffer
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path, PurePosixPath
+from typing import IO, BinaryIO, Callable, Iterator, Optional, cast
+
+from camera_transfer.camera_file import CHUNK_SIZE, Fingerprint
+from camera_transfer.camera_file_getter import File
+from camera_transfer.os_file_getter import JUNK_FOLDERS
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def is_archive(path: Path) -> bool:
+    return path.name.lower().endswith(ARCHIVE_SUFFIXES) and path.is_file()
+
+
+def zip_member_opener(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> Callable[[], BinaryIO]:
+    def _() -> BinaryIO:
+        return cast(BinaryIO, archive.open(info))
+
+    return _
+
+
+def tar_member_opener(path: Path, member: tarfile.TarInfo) -> Callable[[], BinaryIO]:
+    def _() -> BinaryIO:
+        return io.BufferedReader(ArchiveMember(path, member.offset_data, member.size), CHUNK_SIZE)
+
+    return _
+
+
+class ArchiveMember(io.RawIOBase):
+    """A read-only, seekable view of ``size`` bytes at ``offset`` in ``path``.
+
+    Each view has its own handle on the archive, so members can be read by
+    several threads at once.
+    """
+
+    def __init__(self, path: Path, offset: int, size: int) -> None:
+        self._file = open(path, "rb", buffering=0)
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        self._position = max(offset, 0)
+        return self._position
+
+    def readinto(self, buffer: Buffer) -> int:
+        view = memoryview(buffer).cast("B")
+        wanted = min(len(view), self._size - self._position)
+        if wanted <= 0:
+            return 0
+        data = os.pread(self._file.fileno(), wanted, self._offset + self._position)
+        view[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def close(self) -> None:
+        self._file.close()
+        super().close()
+
+
+@dataclass
+class SpooledMember:
+    """A member of a compressed tar, copied to a temporary file.
+
+    A compressed tar can only be read from the start, so each member is
+    copied out as the archive is read past it. The copy is deleted when the
+    file it belongs to is no longer referenced.
+    """
+    spool: IO[bytes]
+
+    def __call__(self) -> BinaryIO:
+        return open(self.spool.name, "rb")
+
+
+@dataclass
+class ArchiveFileGetter:
+    """Reads camera files straight out of a zip or tar of a card.
+
+    Members are filtered like ``OSFileGetter`` filters a folder and keep the
+    modification time recorded in the archive. Zip members and members of
+    an uncompressed tar are read in place. A compressed tar is read once,
+    from start to end, and each wanted member is copied to a temporary file
+    in ``spool_folder`` as it goes past, so only the files still in flight
+    take up space.
+    """
+    location: Path
+    file_extensions: set[str]
+    junk_folders: frozenset[str] = field(default=JUNK_FOLDERS)
+    spool_folder: Optional[Path] = None
+
+    def __post_init__(self) -> None:
+        self._suffixes = {suffix.lower() for suffix in self.file_extensions}
+        self._junk_folders = {folder.lower() for folder in self.junk_folders}
+
+    def wanted(self, member_name: str) -> bool:
+        path = PurePosixPath(member_name)
+        return (
+            path.suffix.lower() in self._suffixes
+            # AppleDouble files that macOS writes next to every file
+            and not path.name.startswith("._")
+            and not any(part.lower() in self._junk_folders for part in path.parts[:-1])
+        )
+
+    def make_file(self, member_name: str, size: int, last_modified: datetime, open_file: Callable[[], BinaryIO]) -> File:
+        member_path = PurePosixPath(member_name.removeprefix("./"))
+        logger.debug("in get_next_file loop with member: %s", member_path)
+        return File(
+            member_path.name,
+            size,
+            last_modified,
+            open_file,
+            Fingerprint(path=member_path.as_posix(), size=size, mtime=last_modified.timestamp(), inode=0),
+        )
+
+    def zip_files(self) -> Iterator[File]:
+        # The archive is closed once the last opener that refers to it has
+        # gone, which can be after this generator has finished.
+        archive = zipfile.ZipFile(self.location)
+        members = [info for info in archive.infolist() if not info.is_dir() and self.wanted(info.filename)]
+        # Archive order keeps reads sequential.
+        members.sort(key=lambda info: info.header_offset)
+        for info in members:
+            yield self.make_file(
+                info.filename,
+                info.file_size,
+                datetime(*info.date_time),
+                zip_member_opener(archive, info),
+            )
+
+    def tar_files(self) -> Iterator[File]:
+        with tarfile.open(self.location, "r:") as archive:
+            for member in archive:
+                if member.isreg() and not member.issparse() and self.wanted(member.name):
+                    yield self.make_file(
+                        member.name,
+                        member.size,
+                        datetime.fromtimestamp(member.mtime),
+                        tar_member_opener(self.location, member),
+                    )
+
+    def compressed_tar_files(self) -> Iterator[File]:
+        with tarfile.open(self.location, "r|*") as archive:
+            for member in archive:
+                if not (member.isreg() and self.wanted(member.name)):
+                    continue
+                content = archive.extractfile(member)
+                assert content is not None
+                spool = tempfile.NamedTemporaryFile(dir=self.spool_folder, prefix=".camera-transfer-", suffix=".spool")
+                shutil.copyfileobj(content, spool, CHUNK_SIZE)
+                spool.flush()
+                yield self.make_file(member.name, member.size, datetime.fromtimestamp(member.mtime), SpooledMember(spool))
+
+    def get_next_file(self) -> Iterator[File]:
+        logger.info("Listing files in archive: %s", self.location)
+        if zipfile.is_zipfile(self.location):
+            return self.zip_files()
+        try:
+            # Only an uncompressed tar can be opened like this.
+            tarfile.open(self.location, "r:").close()
+        except tarfile.ReadError:
+            return self.compressed_tar_files()
+        return self.tar_files()
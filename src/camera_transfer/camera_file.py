@@ -1,20 +1,136 @@
+import hashlib
 import logging
+from collections import deque
 from dataclasses import dataclass
 from datetime import datetime
-from typing import Protocol
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional, Protocol, Sequence
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 1024 * 1024
+# Bytes taken from each end of a file for its partial hash.
+PARTIAL_HASH_SIZE = CHUNK_SIZE
+DEFAULT_HASH_ALGORITHM = "sha256"
+
+
+def read_chunks(open_file: Callable[[], BinaryIO], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    with open_file() as handle:
+        while chunk := handle.read(chunk_size):
+            yield chunk
+
+
+def _partial_digest(file_size: int, head: bytes, tail: bytes) -> bytes:
+    return hashlib.sha256(file_size.to_bytes(8, "little") + head + tail).digest()
+
+
+def partial_hash(open_file: Callable[[], BinaryIO], file_size: int) -> bytes:
+    """Hash of the size and the first and last ``PARTIAL_HASH_SIZE`` bytes of a file."""
+    with open_file() as handle:
+        head = handle.read(PARTIAL_HASH_SIZE)
+        handle.seek(max(file_size - PARTIAL_HASH_SIZE, 0))
+        tail = handle.read(PARTIAL_HASH_SIZE)
+    return _partial_digest(file_size, head, tail)
+
+
+def file_digests(open_file: Callable[[], BinaryIO], algorithms: Sequence[str]) -> dict[str, bytes]:
+    """Full hashes of a file with each of ``algorithms``, from a single read."""
+    hasher = ContentHasher(algorithms)
+    for chunk in read_chunks(open_file):
+        hasher.update(chunk)
+    return hasher.digests()
+
+
+class ContentHasher:
+    """Works out the full hashes and the partial hash of a stream in one pass.
+
+    A full hash is kept for each of ``algorithms``. The partial hash is always
+    SHA-256, since it only ever covers a few MB.
+    """
+    __slots__ = ("_hashers", "_size", "_head", "_tail", "_tail_size")
+
+    def __init__(self, algorithms: Sequence[str] = (DEFAULT_HASH_ALGORITHM,)) -> None:
+        self._hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self._size = 0
+        self._head = b""
+        self._tail: deque[bytes] = deque()
+        self._tail_size = 0
+
+    def update(self, chunk: bytes) -> None:
+        for hasher in self._hashers.values():
+            hasher.update(chunk)
+        self._size += len(chunk)
+        if len(self._head) < PARTIAL_HASH_SIZE:
+            self._head += chunk[:PARTIAL_HASH_SIZE - len(self._head)]
+        # Keep just enough of the most recent chunks to cover the tail.
+        self._tail.append(chunk)
+        self._tail_size += len(chunk)
+        while self._tail_size - len(self._tail[0]) >= PARTIAL_HASH_SIZE:
+            self._tail_size -= len(self._tail.popleft())
+
+    def digests(self) -> dict[str, bytes]:
+        return {algorithm: hasher.digest() for algorithm, hasher in self._hashers.items()}
+
+    def partial_digest(self) -> bytes:
+        tail = b"".join(self._tail)[-PARTIAL_HASH_SIZE:]
+        return _partial_digest(self._size, self._head, tail)
+
+
+def file_name_digits(file_name: str, datetime_digits: str) -> str:
+    """The number in a camera's file name, leaving out any capture date and time it contains."""
+    digits = "".join([n for n in file_name if n.isdigit()])
+    logger.debug(f"digits           : {digits}")
+    logger.debug(f"datetime_digits  : {datetime_digits}")
+    digits = digits.replace(datetime_digits, "")
+    digits = digits.replace(str(int(datetime_digits)+1), "")
+    digits = digits.replace(str(int(datetime_digits)-1), "")
+    digits = "0" if digits == "" else digits
+    logger.debug(f"digits           : {digits}")
+    return digits
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    """Cheap identity of a file on the camera, taken from the directory entry alone.
+
+    ``path`` is relative to the camera folder so the card can be mounted
+    somewhere else next time. ``inode`` is 0 when it is not being used.
+    """
+    path: str
+    size: int
+    mtime: float
+    inode: int = 0
+
+
 @dataclass
 class CameraFile(Protocol):
     file_name: str
-    file_content: bytes
+    file_size: int
     file_last_modified: datetime
     file_category: str
+    open_file: Callable[[], BinaryIO]
     extra_fields: dict[str, dict[str, str]]
+    fingerprint: Optional[Fingerprint]
+    file_path: Optional[Path]
+    hash_algorithms: tuple[str, ...]
+
+    def read_chunks(self) -> Iterator[bytes]:
+        ...
 
     def file_hash(self) -> bytes:
         ...
 
+    def file_hashes(self) -> dict[str, bytes]:
+        ...
+
+    def partial_hash(self) -> bytes:
+        ...
+
     def generate_new_file_name(self) -> str:
         ...
+
+    def camera_model(self) -> Optional[str]:
+        ...
+
+    def captured_at(self) -> Optional[datetime]:
+        ...
@@ -2,9 +2,9 @@ import logging
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Iterator, Protocol
+from typing import BinaryIO, Callable, Iterator, Optional, Protocol
 
-from camera_transfer.camera_file import CameraFile
+from camera_transfer.camera_file import DEFAULT_HASH_ALGORITHM, CameraFile, Fingerprint
 from camera_transfer.camera_image import CameraImage
 from camera_transfer.camera_video import CameraVideo
 
@@ -14,8 +14,11 @@ logger = logging.getLogger(__name__)
 @dataclass
 class File:
     file_name: str
-    file_content: bytes
+    file_size: int
     file_last_modified: datetime
+    open_file: Callable[[], BinaryIO]
+    fingerprint: Optional[Fingerprint] = None
+    file_path: Optional[Path] = None
 
 
 class FileGetter(Protocol):
@@ -36,17 +39,20 @@ class CameraFileGetter:
     camera_model_short_names: dict[str, str]
     image_formats: set[str]
     video_formats: set[str]
+    hash_algorithms: tuple[str, ...] = (DEFAULT_HASH_ALGORITHM,)
 
     def __post_init__(self) -> None:
-        image_category = { image_format: "image" for image_format in self.image_formats }
-        video_category = { video_format: "video" for video_format in self.video_formats }
+        image_category = { image_format.lower(): "image" for image_format in self.image_formats }
+        video_category = { video_format.lower(): "video" for video_format in self.video_formats }
         self.file_category_lookup = { **image_category, **video_category }
+        # Shared by every record rather than copied into each one.
+        self.extra_fields = {"camera_model_short_names": self.camera_model_short_names}
 
 
     def get_next_file(self) -> Iterator[CameraFile]:
         logger.debug("Getting next file from file_getter")
         for file in self.file_getter.get_next_file():
-            file_suffix = Path(file.file_name).suffix
+            file_suffix = Path(file.file_name).suffix.lower()
             logger.debug("File suffix: %s", file_suffix)
             file_category = self.file_category_lookup[file_suffix]
             logger.debug("File category: %s", file_category)
@@ -54,8 +60,12 @@ class CameraFileGetter:
 
             yield CameraFileClass(
                 file_name=file.file_name,
-                file_content=file.file_content,
+                file_size=file.file_size,
                 file_last_modified=file.file_last_modified,
                 file_category=file_category,
-                extra_fields={"camera_model_short_names": self.camera_model_short_names}
+                open_file=file.open_file,
+                extra_fields=self.extra_fields,
+                fingerprint=file.fingerprint,
+                file_path=file.file_path,
+                hash_algorithms=self.hash_algorithms,
             )
\ No newline at end of file
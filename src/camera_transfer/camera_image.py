@@ -1,55 +1,132 @@
-import exif # type: ignore
-import hashlib
 import logging
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Optional
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from camera_transfer.camera_file import CHUNK_SIZE, DEFAULT_HASH_ALGORITHM, PARTIAL_HASH_SIZE, ContentHasher, Fingerprint, file_name_digits, partial_hash, read_chunks
+from camera_transfer.exif_header import HEADER_SIZE, ExifTags, parse_exif_header
 
 logger = logging.getLogger(__name__)
 
-@dataclass
+@dataclass(slots=True)
 class CameraImage():
+    """An image on the camera.
+
+    Nothing is read from the file until it is needed. The hash, the EXIF tags
+    and the new file name are each worked out at most once, and once the tags
+    are known only a few small fields are kept, so many pending records can
+    be held in memory at once.
+    """
     file_name: str
-    file_content: bytes
+    file_size: int
     file_last_modified: datetime
     file_category: str
+    open_file: Callable[[], BinaryIO]
     extra_fields: dict[str, dict[str, str]]
-    
-    def __post_init__(self) -> None:
-        self._exif = exif.Image(self.file_content)
-        self._camera_model_short_names = self.extra_fields["camera_model_short_names"]
+    fingerprint: Optional[Fingerprint] = None
+    file_path: Optional[Path] = None
+    # The first algorithm names the file in the hash store; any others are
+    # only used to look up files hashed by older versions.
+    hash_algorithms: tuple[str, ...] = (DEFAULT_HASH_ALGORITHM,)
+    _header: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+    _exif_tags: Optional[ExifTags] = field(default=None, init=False, repr=False, compare=False)
+    _file_hashes: Optional[dict[str, bytes]] = field(default=None, init=False, repr=False, compare=False)
+    _partial_hash: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+    _new_file_name: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def _read_header(self, size: int) -> bytes:
+        if self._header is None or len(self._header) < min(size, self.file_size):
+            with self.open_file() as handle:
+                self._header = handle.read(size)
+        return self._header
+
+    @property
+    def _exif(self) -> ExifTags:
+        # Only the start of the file is needed for the tags used in the name,
+        # so the name can be worked out before the whole file has been read.
+        # The exif library is the fallback for anything the fast path rejects.
+        if self._exif_tags is None:
+            tags = parse_exif_header(self._read_header(HEADER_SIZE))
+            if tags is None:
+                tags = parse_exif_header(self._read_header(CHUNK_SIZE))
+            if tags is None or tags.model is None or tags.datetime is None:
+                logger.debug("Falling back to the exif library for %s", self.file_name)
+                import exif  # type: ignore
+                with self.open_file() as handle:
+                    image = exif.Image(handle.read())
+                tags = ExifTags(
+                    model=image.get("model"),
+                    datetime=image.get("datetime"),
+                    datetime_original=image.get("datetime_original"),
+                )
+            self._exif_tags = tags
+            self._header = None
+        return self._exif_tags
 
+    def read_chunks(self) -> Iterator[bytes]:
+        hasher = ContentHasher(self.hash_algorithms)
+        for chunk in read_chunks(self.open_file):
+            if self._header is None and self._exif_tags is None:
+                self._header = chunk[:HEADER_SIZE]
+            hasher.update(chunk)
+            yield chunk
+        self._file_hashes = hasher.digests()
+        self._partial_hash = hasher.partial_digest()
 
     def generate_new_file_name(self) -> str:
-        filename, file_extension = os.path.splitext(self.file_name)
-        return (
-            f"{self.condensed_date_string}_"
-            f"{self.model_short_name()}_"
-            f"{self.get_image_file_name_digits()}"
-            f"{file_extension}"
-        )
+        if self._new_file_name is None:
+            filename, file_extension = os.path.splitext(self.file_name)
+            self._new_file_name = (
+                f"{self.condensed_date_string}_"
+                f"{self.model_short_name()}_"
+                f"{self.get_image_file_name_digits()}"
+                f"{file_extension}"
+            )
+        return self._new_file_name
+
+    def file_hashes(self) -> dict[str, bytes]:
+        if self._file_hashes is None:
+            for _ in self.read_chunks():
+                pass
+        assert self._file_hashes is not None
+        return self._file_hashes
 
     def file_hash(self) -> bytes:
-        return hashlib.sha256(self.file_content).digest()
+        return self.file_hashes()[self.hash_algorithms[0]]
+
+    def partial_hash(self) -> bytes:
+        if self._partial_hash is None:
+            if self.file_size <= 2 * PARTIAL_HASH_SIZE:
+                # The ends cover the whole file, so get the full hash from the same read.
+                self.file_hash()
+            else:
+                self._partial_hash = partial_hash(self.open_file, self.file_size)
+        assert self._partial_hash is not None
+        return self._partial_hash
 
     def get_image_file_name_digits(self) -> str:
-        digits = "".join([n for n in self.file_name if n.isdigit()])
-        logger.debug(f"digits           : {digits}")
-        logger.debug(f"datetime_digits  : {self.datetime_digits}")
-        digits = digits.replace(self.datetime_digits, "")
-        digits = digits.replace(str(int(self.datetime_digits)+1), "")
-        digits = digits.replace(str(int(self.datetime_digits)-1), "")
-        digits = "0" if digits == "" else digits
-        logger.debug(f"digits           : {digits}")
-        return digits
+        return file_name_digits(self.file_name, self.datetime_digits)
 
     def model(self) -> str:
-        return self._exif.get("model").strip()
+        model = self._exif.model
+        if model is None:
+            raise KeyError(f"No camera model in the EXIF data of {self.file_name}")
+        return model.strip()
+
+
+    def camera_model(self) -> Optional[str]:
+        return self._exif.model.strip() if self._exif.model else None
 
+    def captured_at(self) -> Optional[datetime]:
+        try:
+            return datetime.strptime(self.datetime_string, "%Y:%m:%d %H:%M:%S")
+        except (KeyError, ValueError):
+            return None
 
     def model_short_name(self) -> str:
-        return self._camera_model_short_names[self.model()]
+        return self.extra_fields["camera_model_short_names"][self.model()]
 
     @property
     def condensed_date_string(self) -> str:
@@ -62,5 +139,8 @@ class CameraImage():
 
     @property
     def datetime_string(self) -> str:
-        return self._exif.get("datetime")
+        datetime_string = self._exif.datetime or self._exif.datetime_original
+        if datetime_string is None:
+            raise KeyError(f"No date and time in the EXIF data of {self.file_name}")
+        return datetime_string
 
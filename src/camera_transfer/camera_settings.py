@@ -1,9 +1,20 @@
+import functools
+import json
+import logging
+import os
 from pathlib import Path
-from pydantic import DirectoryPath, Field
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Any, Literal, Optional
+from pydantic import BaseModel, ConfigDict, DirectoryPath, Field, FilePath, ValidationError
 
-class CameraSettings(BaseSettings, validate_assignment=True):
+from camera_transfer import __version__
+
+logger = logging.getLogger(__name__)
+
+
+class CameraSettings(BaseModel):
     camera_folder: DirectoryPath
+    # Cards to import from, each a folder or a zip or tar of one.
+    camera_folders: list[DirectoryPath | FilePath] = Field(default_factory=list)
     main_photos_folder: DirectoryPath
     main_videos_folder: DirectoryPath
     sqlite_database: Path | None = None
@@ -12,6 +23,88 @@ class CameraSettings(BaseSettings, validate_assignment=True):
     video_formats: set[str] = Field(default_factory=lambda: {".mov", ".MOV", ".mp4", ".MP4"})
     dry_run: bool
     log_level: str
+    jobs: int = Field(default=1, ge=1)
+    max_in_flight_mb: int = Field(default=1024, ge=1)
+    fingerprint_inode: bool = False
+    read_order: Literal["scan", "name", "inode"] = "name"
+    durability: Literal["none", "file", "directory"] = "directory"
+    preallocate_min_mb: int = Field(default=64, ge=0)
+    copy_strategy: Literal["stream", "copy_file_range", "reflink", "hardlink"] = "stream"
+    # Where members of compressed tars and files waiting to be uploaded are
+    # copied to; the photos folder for archives when not set.
+    spool_folder: DirectoryPath | None = None
+    s3_bucket: str | None = None
+    s3_endpoint_url: str | None = None
+    s3_image_prefix: str = "photos/"
+    s3_video_prefix: str = "videos/"
+    s3_max_concurrency: int = Field(default=10, ge=1)
+    s3_max_mb_per_second: float | None = Field(default=None, gt=0)
+    s3_part_size_mb: int = Field(default=16, ge=5)
+    hash_algorithm: Literal["sha256", "blake2b", "sha512"] = "sha256"
+    rehash_library: bool = False
+    verify_after_write: bool = False
+    verify_cycle_days: float = Field(default=7, gt=0)
+    verify_max_mb_per_second: float | None = Field(default=None, gt=0)
+    hash_store_batch_size: int = Field(default=100, ge=1)
+    hash_store_flush_seconds: float = Field(default=5.0, ge=0)
+    stage_timings: bool = False
+    metrics_json: Path | None = None
+    progress: bool = True
+
+    model_config = ConfigDict(extra="forbid", validate_assignment=True)
+
+
+@functools.cache
+def _env_settings_class() -> type[CameraSettings]:
+    # pydantic_settings is slow to import and is only needed when the
+    # settings snapshot is missing or out of date.
+    from pydantic_settings import BaseSettings, SettingsConfigDict
+
+    class EnvCameraSettings(BaseSettings, CameraSettings):
+        model_config = SettingsConfigDict(env_prefix="CT_", extra="forbid", validate_assignment=True, title="CameraSettings")
+
+    return EnvCameraSettings
+
+
+def read_settings_file(settings_file: Path) -> CameraSettings:
+    """Settings from ``settings_file``, overridden by any CT_ environment variables."""
+    return _env_settings_class()(_env_file=settings_file)  # type: ignore[call-arg]
+
+
+def _snapshot_key(settings_file: Path) -> dict[str, Any]:
+    stat = settings_file.stat()
+    return {
+        "version": __version__,
+        "settings_file": str(settings_file.resolve()),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "environment": {name: value for name, value in os.environ.items() if name.upper().startswith("CT_")},
+    }
+
+
+def load_settings_snapshot(settings_file: Path, snapshot_file: Path) -> Optional[CameraSettings]:
+    """Settings saved by ``save_settings_snapshot``, if ``settings_file`` and the environment have not changed.
+
+    The saved values are validated again, so folders that have gone missing
+    since are still reported. Returns None when there is no usable snapshot.
+    """
+    try:
+        snapshot = json.loads(snapshot_file.read_text())
+        if snapshot["key"] != _snapshot_key(settings_file):
+            return None
+        return CameraSettings.model_validate(snapshot["settings"])
+    except (OSError, ValueError, KeyError, TypeError, ValidationError) as error:
+        logger.debug("Not using settings snapshot %s: %s", snapshot_file, error)
+        return None
+
 
-    model_config = SettingsConfigDict(env_prefix="CT_", extra="forbid")
+def save_settings_snapshot(settings: CameraSettings, settings_file: Path, snapshot_file: Path) -> None:
+    snapshot = {"key": _snapshot_key(settings_file), "settings": settings.model_dump(mode="json")}
+    try:
+        snapshot_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = snapshot_file.with_suffix(".tmp")
+        temp_file.write_text(json.dumps(snapshot))
+        os.replace(temp_file, snapshot_file)
+    except OSError as error:
+        logger.warning("Could not save settings snapshot %s: %s", snapshot_file, error)
 
@@ -1,8 +1,13 @@
-from typing import Protocol, Iterator
+from typing import BinaryIO, Callable, Iterable, Optional, Protocol, Iterator
 from datetime import datetime
-from dataclasses import dataclass
-from camera_transfer.camera_file import CameraFile
+from dataclasses import dataclass, field
+from camera_transfer.camera_file import PARTIAL_HASH_SIZE, CameraFile, Fingerprint, file_digests
+from camera_transfer.hash_store import JournalEntry, LibraryFile
+from camera_transfer.concurrent_transfer import ConcurrentTransfer
+from camera_transfer.metrics import TransferMetrics
 import logging
+import threading
+import time
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -11,45 +16,551 @@ class CameraFileGetter(Protocol):
     def get_next_file(self) -> Iterator[CameraFile]:
         ...
 
+class StagedFile(Protocol):
+    @property
+    def temp_location(self) -> Optional[str]:
+        ...
+
+    def destination(self, file_name: str) -> str:
+        ...
+
+    def library_path(self, file_name: str) -> str:
+        ...
+
+    def claim_name(self, file_name: str) -> str:
+        ...
+
+    def write(self, chunk: bytes) -> None:
+        ...
+
+    def copy_from(self, source: Path, size: int) -> bool:
+        ...
+
+    def preallocate(self, size: int) -> None:
+        ...
+
+    def open_written(self) -> BinaryIO:
+        ...
+
+    def commit(self, file_name: str, file_last_modified: datetime) -> None:
+        ...
+
+    def discard(self) -> None:
+        ...
+
+    def __enter__(self) -> "StagedFile":
+        ...
+
+    def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback: Optional[object]) -> None:
+        ...
+
 class OutputFileWriter(Protocol):
-    def write_file(self, file_name: str, file_last_modified: datetime, file_content: bytes, file_category: str, sub_folder: Path) -> None:
+    def destination(self, file_category: str, sub_folder: Path, file_name: str) -> str:
+        ...
+
+    def destination_exists(self, destination: str) -> bool:
+        ...
+
+    def stage_file(self, file_category: str, sub_folder: Path) -> StagedFile:
+        ...
+
+    def write_file(self, file_name: str, file_last_modified: datetime, file_content: Iterable[bytes], file_category: str, sub_folder: Path) -> None:
+        ...
+
+    def recover_staged(self, temp_location: str, destination: Optional[str], size: Optional[int]) -> bool:
+        ...
+
+    def flush(self) -> None:
+        ...
+
+    def close(self) -> None:
         ...
 
 
 class HashStore(Protocol):
+    algorithm: str
+    before_flush: Optional[Callable[[], None]]
+
     def __setitem__(self, hash: bytes, file_item: str) -> None:
         ...
 
     def __contains__(self, hash: bytes) -> bool:
         ...
 
+    def add_hash(self, hash: bytes, file_item: str, algorithm: str) -> None:
+        ...
+
+    def rehash(self, old_hash: bytes, new_hash: bytes) -> None:
+        ...
+
+    def algorithms(self) -> tuple[str, ...]:
+        ...
+
+    def legacy_hashes(self) -> list[tuple[bytes, str, str]]:
+        ...
+
+    def add_library_file(
+        self,
+        path: str,
+        size: int,
+        mtime: float,
+        hash: bytes,
+        verified_at: Optional[float] = None,
+        category: Optional[str] = None,
+        camera_model: Optional[str] = None,
+        captured_at: Optional[datetime] = None,
+        source: Optional[str] = None,
+        import_run: Optional[int] = None,
+    ) -> None:
+        ...
+
+    def start_import_run(self, source: str) -> Optional[int]:
+        ...
+
+    def add_fingerprint(self, fingerprint: Fingerprint, hash: bytes) -> None:
+        ...
+
+    def has_fingerprint(self, fingerprint: Fingerprint) -> bool:
+        ...
+
+    def add_partial_hash(self, file_size: int, partial_hash: bytes, hash: bytes) -> None:
+        ...
+
+    def has_size(self, file_size: int) -> bool:
+        ...
+
+    def has_partial_hash(self, file_size: int, partial_hash: bytes) -> bool:
+        ...
+
+    def flush(self) -> None:
+        ...
+
+    def journal_staging(self, temp_location: str, source: str) -> None:
+        ...
+
+    def journal_committing(
+        self,
+        temp_location: str,
+        destination: str,
+        image_file: str,
+        fingerprint: Optional[Fingerprint],
+        partial_hash: bytes,
+        library_file: LibraryFile,
+    ) -> None:
+        ...
+
+    def journal_finished(self, temp_location: str) -> None:
+        ...
+
+    def abandoned_journal_entries(self) -> list[JournalEntry]:
+        ...
+
+@dataclass
+class CommitLock:
+    """Shared by transfers that write to the same library at the same time.
+
+    Checking for a duplicate and recording a new file each happen while the
+    lock is held. In between, while the file is renamed, synced or
+    uploaded, its hash is held in flight, so the same content arriving from
+    another card waits to see whether the first copy makes it instead of
+    being copied twice.
+    """
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    _in_flight: dict[bytes, threading.Event] = field(default_factory=dict, init=False, repr=False)
+
+    def __enter__(self) -> None:
+        self.lock.acquire()
+
+    def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback: Optional[object]) -> None:
+        self.lock.release()
+
+    def hold(self, hash: bytes) -> Optional[threading.Event]:
+        """Mark ``hash`` as in flight, or return the event set once whoever holds it is done."""
+        if hash in self._in_flight:
+            return self._in_flight[hash]
+        self._in_flight[hash] = threading.Event()
+        return None
+
+    def release_hold(self, hash: bytes) -> None:
+        in_flight = self._in_flight.pop(hash, None)
+        if in_flight is not None:
+            in_flight.set()
+
+
+def import_sub_folder() -> Path:
+    """The library sub folder for files imported now."""
+    return Path(datetime.now().strftime("%Y/%m - %B"))
+
+
 @dataclass
 class CameraTransfer:
     camera_file_getter: CameraFileGetter
     output_file_writer: OutputFileWriter
     hash_store: HashStore
+    jobs: int = 1
+    max_in_flight_bytes: int = 1024 * 1024 * 1024
+    metrics: TransferMetrics = field(default_factory=TransferMetrics)
+    # Shared between transfers that write to the same library at the same time.
+    commit_lock: CommitLock = field(default_factory=CommitLock)
+    # Read every file back from the destination before it is renamed into place.
+    verify_writes: bool = False
+    # The card being imported, as recorded in the catalog.
+    source: Optional[str] = None
+    # Where below the library folders this run's files go.
+    sub_folder: Path = field(default_factory=import_sub_folder)
+    # List the whole card before the first file is read, so that the totals
+    # shown by the progress display are known from the start.
+    scan_ahead: bool = False
+    import_run: Optional[int] = field(default=None, init=False)
 
-    def process_camera_file(self, camera_file: CameraFile) -> None:
-        logger.info("Processing camera file %s", camera_file.file_name)
+    def __post_init__(self) -> None:
+        # A batch that records a file as imported and drops its journal entry
+        # must not reach the database before the file itself reaches the disk.
+        self.hash_store.before_flush = self.output_file_writer.flush
 
-        if camera_file.file_hash() in self.hash_store:
-            logger.info("Skipping duplicate camera file")
+    def found_files(self) -> Iterator[CameraFile]:
+        for camera_file in self.camera_file_getter.get_next_file():
+            self.metrics.found(camera_file.file_size)
+            yield camera_file
+
+    def camera_files(self) -> Iterator[CameraFile]:
+        camera_files = self.found_files()
+        if self.scan_ahead:
+            with self.metrics.stage("scan"):
+                listed = list(camera_files)
+            logger.info("Found %d files in %s", len(listed), self.source)
+            camera_files = iter(listed)
+        if not self.metrics.timings or self.scan_ahead:
+            yield from camera_files
             return
+        while True:
+            with self.metrics.stage("scan"):
+                camera_file = next(camera_files, None)
+            if camera_file is None:
+                return
+            yield camera_file
+
+    def already_imported(self, camera_file: CameraFile) -> bool:
+        # Re-inserted cards are recognised from the directory entry alone, so
+        # nothing has to be read from the card for files imported before.
+        if camera_file.fingerprint is None:
+            return False
+        with self.metrics.stage("lookup"):
+            imported = self.hash_store.has_fingerprint(camera_file.fingerprint)
+        if imported:
+            logger.debug("Skipping previously imported camera file %s", camera_file.file_name)
+            self.metrics.done("previously_imported", camera_file.file_size, camera_file)
+        return imported
+
+    def known_duplicate(self, camera_file: CameraFile) -> bool:
+        """Check whether the content is already in the library, reading as little as possible.
 
-        new_file_name = camera_file.generate_new_file_name()
-        sub_folder = Path(datetime.now().strftime("%Y/%m - %B"))
-        logger.debug(new_file_name)
-        self.output_file_writer.write_file(
-            camera_file.generate_new_file_name(),
-            camera_file.file_last_modified,
-            camera_file.file_content,
-            file_category=camera_file.file_category,
-            sub_folder=sub_folder
+        A file whose size matches nothing imported is new without reading
+        anything, and one whose partial hash matches nothing is new after
+        reading both ends. Only when both match is the whole file hashed, and
+        then without writing it anywhere. New files get their full hash while
+        being copied and are checked against it again before the commit.
+        """
+        with self.metrics.stage("lookup"):
+            if not self.hash_store.has_size(camera_file.file_size):
+                return False
+        with self.metrics.stage("read+hash"):
+            partial_hash = camera_file.partial_hash()
+        self.metrics.count("bytes_read", min(camera_file.file_size, 2 * PARTIAL_HASH_SIZE))
+        with self.metrics.stage("lookup"):
+            if not self.hash_store.has_partial_hash(camera_file.file_size, partial_hash):
+                return False
+        if camera_file.file_size > 2 * PARTIAL_HASH_SIZE:
+            with self.metrics.stage("read+hash"):
+                camera_file.file_hash()
+            self.metrics.count("bytes_read", camera_file.file_size)
+        with self.metrics.stage("lookup"):
+            duplicate = self.in_hash_store(camera_file)
+        if duplicate:
+            logger.debug("Skipping duplicate camera file %s", camera_file.file_name)
+            self.metrics.done("duplicate", camera_file.file_size, camera_file)
+            self.record_fingerprint(camera_file)
+        return duplicate
+
+    def in_hash_store(self, camera_file: CameraFile) -> bool:
+        """True when the content is in the hash store under any of the file's hash algorithms.
+
+        A match made with an older algorithm is moved over to the current one,
+        so the library is rehashed bit by bit as its files turn up again.
+        """
+        file_hash = camera_file.file_hash()
+        if file_hash in self.hash_store:
+            return True
+        for other_hash in camera_file.file_hashes().values():
+            if other_hash != file_hash and other_hash in self.hash_store:
+                self.hash_store.rehash(other_hash, file_hash)
+                return True
+        return False
+
+    def skip_camera_file(self, camera_file: CameraFile) -> bool:
+        return self.already_imported(camera_file) or self.known_duplicate(camera_file)
+
+    def copy_chunks(self, camera_file: CameraFile, write: Callable[[bytes], None]) -> None:
+        """Stream ``camera_file`` into ``write``, timing the two sides separately."""
+        if not self.metrics.timings:
+            for chunk in camera_file.read_chunks():
+                write(chunk)
+                self.metrics.advance(camera_file, len(chunk))
+        else:
+            read_time = write_time = 0.0
+            start = time.perf_counter()
+            for chunk in camera_file.read_chunks():
+                written = time.perf_counter()
+                read_time += written - start
+                write(chunk)
+                self.metrics.advance(camera_file, len(chunk))
+                start = time.perf_counter()
+                write_time += start - written
+            read_time += time.perf_counter() - start
+            self.metrics.record("read+hash", read_time)
+            self.metrics.record("write", write_time)
+        self.metrics.count("bytes_read", camera_file.file_size)
+
+    def fill_staged_file(self, camera_file: CameraFile, staged_file: StagedFile, write: Optional[Callable[[bytes], None]] = None) -> None:
+        """Copy ``camera_file`` into ``staged_file`` and work out its hash.
+
+        Files on a local disk may be copied by the kernel, in which case the
+        hash is taken from a separate read of the source. Otherwise the
+        content is streamed into ``write``, hashing it on the way.
+        """
+        if camera_file.file_path is not None:
+            with self.metrics.stage("write"):
+                copied = staged_file.copy_from(camera_file.file_path, camera_file.file_size)
+            if copied:
+                with self.metrics.stage("read+hash"):
+                    camera_file.file_hash()
+                self.metrics.count("bytes_read", camera_file.file_size)
+                return
+        staged_file.preallocate(camera_file.file_size)
+        self.copy_chunks(camera_file, write or staged_file.write)
+
+    def read_back(self, camera_file: CameraFile, staged_file: StagedFile) -> None:
+        """Check that what reached the disk is what was read from the camera."""
+        algorithm = camera_file.hash_algorithms[0]
+        written_hash = file_digests(staged_file.open_written, (algorithm,))[algorithm]
+        if written_hash != camera_file.file_hash():
+            raise IOError(f"{staged_file.temp_location} does not match {camera_file.file_name} when read back")
+
+    def record_partial_hash(self, camera_file: CameraFile) -> None:
+        self.hash_store.add_partial_hash(camera_file.file_size, camera_file.partial_hash(), camera_file.file_hash())
+
+    def record_fingerprint(self, camera_file: CameraFile) -> None:
+        if camera_file.fingerprint is not None:
+            self.hash_store.add_fingerprint(camera_file.fingerprint, camera_file.file_hash())
+
+    def source_path(self, camera_file: CameraFile) -> str:
+        """Where ``camera_file`` is on the card, as precisely as is known."""
+        if camera_file.file_path is not None:
+            return str(camera_file.file_path)
+        if self.source is not None and camera_file.fingerprint is not None:
+            return f"{self.source}/{camera_file.fingerprint.path}"
+        return camera_file.file_name
+
+    def staging_area(self, camera_file: CameraFile) -> StagedFile:
+        staged_file = self.output_file_writer.stage_file(camera_file.file_category, self.sub_folder)
+        if staged_file.temp_location is not None:
+            self.hash_store.journal_staging(staged_file.temp_location, self.source_path(camera_file))
+        return staged_file
+
+    def finish_staging(self, staged_file: StagedFile) -> None:
+        if staged_file.temp_location is not None:
+            self.hash_store.journal_finished(staged_file.temp_location)
+
+    def recover(self) -> None:
+        """Finish off whatever an interrupted run left in the journal.
+
+        Only entries of runs that have ended are looked at, so another
+        process importing into the same library keeps its copies. Leftover
+        temporary files are removed. Files that had already been renamed
+        into place are recorded in the hash store and the catalog, as
+        ``finish_commit`` would have, so they are neither copied nor read
+        from the card again.
+        """
+        for entry in self.hash_store.abandoned_journal_entries():
+            completed = self.output_file_writer.recover_staged(entry.temp_location, entry.destination, entry.size)
+            if entry.state == "committing" and completed:
+                assert entry.hash is not None and entry.image_file is not None and entry.size is not None
+                logger.info("Recovered %s from an interrupted run", entry.destination)
+                self.hash_store.add_hash(entry.hash, entry.image_file, entry.algorithm)
+                if entry.fingerprint is not None:
+                    self.hash_store.add_fingerprint(entry.fingerprint, entry.hash)
+                if entry.partial_hash is not None:
+                    self.hash_store.add_partial_hash(entry.size, entry.partial_hash, entry.hash)
+                # The catalog only holds hashes made with the current algorithm.
+                library_file = entry.library_file
+                if library_file is not None and library_file.algorithm == self.hash_store.algorithm:
+                    self.hash_store.add_library_file(
+                        library_file.path,
+                        library_file.size,
+                        library_file.mtime,
+                        library_file.hash,
+                        category=library_file.category,
+                        camera_model=library_file.camera_model,
+                        captured_at=library_file.captured_at,
+                        source=library_file.source,
+                        import_run=library_file.import_run,
+                    )
+            else:
+                logger.info("Removed partial copy of %s from an interrupted run", entry.source)
+            self.hash_store.journal_finished(entry.temp_location)
+        self.hash_store.flush()
+
+    def stage_camera_file(self, camera_file: CameraFile) -> StagedFile:
+        # One pass over the source both hashes the content and streams it into a
+        # temporary file at the destination, so each byte is read only once.
+        staged_file = self.staging_area(camera_file)
+        try:
+            self.fill_staged_file(camera_file, staged_file)
+            self.check_written(camera_file, staged_file)
+        except BaseException:
+            self.abandon_staged_file(staged_file)
+            raise
+        return staged_file
+
+    def check_written(self, camera_file: CameraFile, staged_file: StagedFile) -> None:
+        """Read the staged file back when ``verify_writes`` is set, before anything is committed."""
+        if self.verify_writes and staged_file.temp_location is not None:
+            with self.metrics.stage("write"):
+                self.read_back(camera_file, staged_file)
+
+    def abandon_staged_file(self, staged_file: StagedFile) -> None:
+        staged_file.discard()
+        self.finish_staging(staged_file)
+
+    def claim_commit(self, camera_file: CameraFile, staged_file: StagedFile) -> Optional[str]:
+        """The name to commit ``camera_file`` under, or None when its content is already in the library.
+
+        The duplicate check and the name are settled under the commit lock,
+        and the content is held as in flight until ``finish_commit``. The
+        same content being committed by another thread is waited for, and
+        is only copied again if that commit fails. A staged file that is
+        not going to be committed is thrown away.
+        """
+        try:
+            with self.metrics.stage("exif"):
+                new_file_name = camera_file.generate_new_file_name()
+            while True:
+                with self.commit_lock:
+                    with self.metrics.stage("lookup"):
+                        duplicate = self.in_hash_store(camera_file)
+                    if duplicate:
+                        break
+                    in_flight = self.commit_lock.hold(camera_file.file_hash())
+                    if in_flight is None:
+                        # Burst shots and files from different cards can map to the
+                        # same name; later ones are numbered rather than refused.
+                        return staged_file.claim_name(new_file_name)
+                in_flight.wait()
+        except BaseException:
+            self.abandon_staged_file(staged_file)
+            raise
+        logger.debug("Skipping duplicate camera file %s", camera_file.file_name)
+        self.metrics.done("duplicate", camera_file.file_size, camera_file)
+        self.record_fingerprint(camera_file)
+        # Fills in partial hashes for files imported by older versions.
+        self.record_partial_hash(camera_file)
+        self.abandon_staged_file(staged_file)
+        return None
+
+    def finish_commit(self, camera_file: CameraFile, staged_file: StagedFile, new_file_name: str) -> None:
+        """Rename or upload a staged file claimed by ``claim_commit`` and record it.
+
+        Nothing here holds the commit lock except the hash store insert, so
+        the rename, fsync or upload runs alongside other commits.
+        """
+        try:
+            library_file = LibraryFile(
+                path=staged_file.library_path(new_file_name),
+                size=camera_file.file_size,
+                mtime=camera_file.file_last_modified.timestamp(),
+                hash=camera_file.file_hash(),
+                algorithm=self.hash_store.algorithm,
+                # All known already from naming the file, so nothing more is read.
+                category=camera_file.file_category,
+                camera_model=camera_file.camera_model(),
+                captured_at=camera_file.captured_at(),
+                source=self.source_path(camera_file),
+                import_run=self.import_run,
             )
-        logger.info("Wrote file %s", new_file_name)
-        self.hash_store[camera_file.file_hash()] = camera_file.generate_new_file_name()
+            with staged_file:
+                logger.debug(new_file_name)
+                with self.metrics.stage("write"):
+                    # Recorded before the rename so that a restart can tell a
+                    # finished copy from a partial one, and record it in full.
+                    if staged_file.temp_location is not None:
+                        self.hash_store.journal_committing(
+                            staged_file.temp_location,
+                            staged_file.destination(new_file_name),
+                            new_file_name,
+                            camera_file.fingerprint,
+                            camera_file.partial_hash(),
+                            library_file,
+                        )
+                    staged_file.commit(new_file_name, camera_file.file_last_modified)
+            logger.debug("Wrote file %s", new_file_name)
+            self.metrics.done("copied", camera_file.file_size, camera_file)
+            self.metrics.count("bytes_written", camera_file.file_size)
+            with self.commit_lock, self.metrics.stage("insert"):
+                self.hash_store[camera_file.file_hash()] = new_file_name
+                self.record_fingerprint(camera_file)
+                self.record_partial_hash(camera_file)
+                self.hash_store.add_library_file(
+                    library_file.path,
+                    library_file.size,
+                    library_file.mtime,
+                    library_file.hash,
+                    verified_at=time.time() if self.verify_writes and staged_file.temp_location is not None else None,
+                    category=library_file.category,
+                    camera_model=library_file.camera_model,
+                    captured_at=library_file.captured_at,
+                    source=library_file.source,
+                    import_run=library_file.import_run,
+                )
+        finally:
+            with self.commit_lock:
+                self.commit_lock.release_hold(camera_file.file_hash())
+            # Queued after the hash so both land in the same or a later batch.
+            self.finish_staging(staged_file)
+
+    def commit_camera_file(self, camera_file: CameraFile, staged_file: StagedFile) -> None:
+        new_file_name = self.claim_commit(camera_file, staged_file)
+        if new_file_name is not None:
+            self.finish_commit(camera_file, staged_file, new_file_name)
+
+    def process_camera_file(self, camera_file: CameraFile) -> None:
+        logger.debug("Processing camera file %s", camera_file.file_name)
+        if self.skip_camera_file(camera_file):
+            return
+        try:
+            self.commit_camera_file(camera_file, self.stage_camera_file(camera_file))
+        except Exception:
+            self.metrics.done("failed", camera_file.file_size, camera_file)
+            raise
 
     def run(self) -> None:
+        self.recover()
+        self.transfer()
+
+    def transfer(self) -> None:
         logger.debug("Running Camera Transfer")
-        for camera_file in self.camera_file_getter.get_next_file():
-            self.process_camera_file(camera_file)
+        self.import_run = self.hash_store.start_import_run(self.source or "")
+        try:
+            if self.jobs > 1:
+                ConcurrentTransfer(self, jobs=self.jobs, max_in_flight_bytes=self.max_in_flight_bytes).run()
+                return
+
+            for camera_file in self.camera_files():
+                self.process_camera_file(camera_file)
+        finally:
+            # Files already written must be recorded even when the run fails,
+            # and only once their content has reached the disk.
+            with self.metrics.stage("write"):
+                self.output_file_writer.flush()
+            with self.metrics.stage("insert"):
+                self.hash_store.flush()
+            self.metrics.finish()
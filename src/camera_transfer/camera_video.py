@@ -1,26 +1,95 @@
 from datetime import datetime
 import logging
-import hashlib
-from dataclasses import dataclass
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from camera_transfer.camera_file import DEFAULT_HASH_ALGORITHM, PARTIAL_HASH_SIZE, ContentHasher, Fingerprint, file_name_digits, partial_hash, read_chunks
+from camera_transfer.video_metadata import VideoTags, read_video_tags
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
+@dataclass(slots=True)
 class CameraVideo:
+    """A video on the camera.
+
+    The creation time and camera model come from the moov box, which is
+    found by walking box headers, so naming a video reads a few KB of it.
+    Videos without a creation time are named by their modification time.
+    """
     file_name: str
-    file_content: bytes
+    file_size: int
     file_last_modified: datetime
     file_category: str
+    open_file: Callable[[], BinaryIO]
     extra_fields: dict[str, dict[str, str]]
+    fingerprint: Optional[Fingerprint] = None
+    file_path: Optional[Path] = None
+    # The first algorithm names the file in the hash store; any others are
+    # only used to look up files hashed by older versions.
+    hash_algorithms: tuple[str, ...] = (DEFAULT_HASH_ALGORITHM,)
+    _video_tags: Optional[VideoTags] = field(default=None, init=False, repr=False, compare=False)
+    _file_hashes: Optional[dict[str, bytes]] = field(default=None, init=False, repr=False, compare=False)
+    _partial_hash: Optional[bytes] = field(default=None, init=False, repr=False, compare=False)
+    _new_file_name: Optional[str] = field(default=None, init=False, repr=False, compare=False)
+
+    def read_chunks(self) -> Iterator[bytes]:
+        hasher = ContentHasher(self.hash_algorithms)
+        for chunk in read_chunks(self.open_file):
+            hasher.update(chunk)
+            yield chunk
+        self._file_hashes = hasher.digests()
+        self._partial_hash = hasher.partial_digest()
+
+    @property
+    def _tags(self) -> VideoTags:
+        if self._video_tags is None:
+            with self.open_file() as handle:
+                tags = read_video_tags(handle, self.file_size)
+            self._video_tags = tags or VideoTags(creation_time=None)
+        return self._video_tags
 
     def generate_new_file_name(self) -> str:
-        logger.debug(self.file_name)
-        logger.debug(self.file_last_modified)
-        video_modification_time_string = self.file_last_modified.strftime(
-            "%Y-%m-%dT%H%M%S"
-        )
-        return f"{video_modification_time_string}_video.mp4"
+        if self._new_file_name is None:
+            logger.debug(self.file_name)
+            captured_at = self.captured_at()
+            logger.debug(captured_at)
+            time_string = captured_at.strftime("%Y-%m-%dT%H%M%S")
+            short_name = self.extra_fields["camera_model_short_names"].get(self.camera_model() or "")
+            stem, file_extension = os.path.splitext(self.file_name)
+            if short_name is None:
+                self._new_file_name = f"{time_string}_video{file_extension}"
+            else:
+                # Named like the images from the same camera.
+                # The stem, as MP4 would add a 4 to the number.
+                digits = file_name_digits(stem, captured_at.strftime("%Y%m%d%H%M%S"))
+                self._new_file_name = f"{time_string}_{short_name}_{digits}{file_extension}"
+        return self._new_file_name
+
+    def camera_model(self) -> Optional[str]:
+        return self._tags.model
+
+    def captured_at(self) -> datetime:
+        return self._tags.creation_time or self.file_last_modified
+
+    def file_hashes(self) -> dict[str, bytes]:
+        if self._file_hashes is None:
+            for _ in self.read_chunks():
+                pass
+        assert self._file_hashes is not None
+        return self._file_hashes
 
     def file_hash(self) -> bytes:
-        return hashlib.sha256(self.file_content).digest()
+        return self.file_hashes()[self.hash_algorithms[0]]
+
+    def partial_hash(self) -> bytes:
+        if self._partial_hash is None:
+            if self.file_size <= 2 * PARTIAL_HASH_SIZE:
+                # The ends cover the whole file, so get the full hash from the same read.
+                self.file_hash()
+            else:
+                self._partial_hash = partial_hash(self.open_file, self.file_size)
+        assert self._partial_hash is not None
+        return self._partial_hash
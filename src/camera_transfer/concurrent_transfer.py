@@ -0,0 +1,161 @@
+import logging
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from camera_transfer.camera_file import CameraFile
+
+if TYPE_CHECKING:
+    from camera_transfer.camera_transfer import CameraTransfer, StagedFile
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class InFlight:
+    camera_file: CameraFile
+    # The filled staged file, or None when the file turned out to be a duplicate.
+    prepared: "Future[Optional[StagedFile]]"
+    reserved_bytes: int
+
+
+@dataclass
+class ConcurrentTransfer:
+    """Pipelined version of ``CameraTransfer.run``.
+
+    Reader workers check each file for a known duplicate, then read and hash
+    it from the camera while a separate pool of writer workers streams the
+    chunks into a staged file, so the card, the CPU and the destination disk
+    are all kept busy. Files are claimed on the calling thread in the order
+    the camera file getter produced them, which keeps file names and
+    ``HashStore`` contents identical to a serial run. The rename, fsync or
+    upload of each claimed file then runs on a pool of committer workers.
+    """
+    camera_transfer: "CameraTransfer"
+    jobs: int
+    max_in_flight_bytes: int
+
+    def __post_init__(self) -> None:
+        self._in_flight: deque[InFlight] = deque()
+        self._in_flight_bytes = 0
+        self._committing: deque[Future[None]] = deque()
+        self._write_pool: Optional[ThreadPoolExecutor] = None
+        self._commit_pool: Optional[ThreadPoolExecutor] = None
+
+    def copy_camera_file(self, camera_file: CameraFile, staged_file: "StagedFile") -> None:
+        write_pool = self._write_pool
+        assert write_pool is not None
+        # Double buffering: the next chunk is read and hashed while the
+        # previous one is still being written.
+        pending_write: Optional[Future[None]] = None
+
+        def write(chunk: bytes) -> None:
+            nonlocal pending_write
+            if pending_write is not None:
+                pending_write.result()
+            pending_write = write_pool.submit(staged_file.write, chunk)
+
+        try:
+            self.camera_transfer.fill_staged_file(camera_file, staged_file, write)
+        finally:
+            if pending_write is not None:
+                pending_write.result()
+
+    def prepare_camera_file(self, camera_file: CameraFile) -> Optional["StagedFile"]:
+        """Everything that reads the file, run on a reader worker."""
+        if self.camera_transfer.known_duplicate(camera_file):
+            return None
+        staged_file = self.camera_transfer.staging_area(camera_file)
+        try:
+            self.copy_camera_file(camera_file, staged_file)
+            self.camera_transfer.check_written(camera_file, staged_file)
+        except BaseException:
+            self.camera_transfer.abandon_staged_file(staged_file)
+            raise
+        return staged_file
+
+    def finish_commit(self, camera_file: CameraFile, staged_file: "StagedFile", new_file_name: str) -> None:
+        try:
+            self.camera_transfer.finish_commit(camera_file, staged_file, new_file_name)
+        except Exception:
+            self.camera_transfer.metrics.done("failed", camera_file.file_size, camera_file)
+            raise
+
+    def wait_for_oldest_commit(self) -> None:
+        self._committing.popleft().result()
+
+    def commit_oldest(self) -> None:
+        item = self._in_flight.popleft()
+        try:
+            try:
+                staged_file = item.prepared.result()
+                if staged_file is None:
+                    return
+                new_file_name = self.camera_transfer.claim_commit(item.camera_file, staged_file)
+            except Exception:
+                self.camera_transfer.metrics.done("failed", item.camera_file.file_size, item.camera_file)
+                raise
+        finally:
+            self._in_flight_bytes -= item.reserved_bytes
+        if new_file_name is None:
+            return
+        commit_pool = self._commit_pool
+        assert commit_pool is not None
+        while len(self._committing) >= self.jobs:
+            self.wait_for_oldest_commit()
+        self._committing.append(commit_pool.submit(self.finish_commit, item.camera_file, staged_file, new_file_name))
+
+    def discard_in_flight(self) -> None:
+        while self._in_flight:
+            item = self._in_flight.popleft()
+            if item.prepared.cancel():
+                continue
+            # Let the worker stop touching the file before removing it.
+            if item.prepared.exception() is None:
+                staged_file = item.prepared.result()
+                if staged_file is not None:
+                    self.camera_transfer.abandon_staged_file(staged_file)
+        self._in_flight_bytes = 0
+        # Commits clean up after themselves; they only need to finish.
+        while self._committing:
+            self._committing.popleft().exception()
+
+    def run(self) -> None:
+        logger.debug("Running Camera Transfer with %d jobs", self.jobs)
+        with ThreadPoolExecutor(self.jobs, thread_name_prefix="ct-read") as read_pool, \
+             ThreadPoolExecutor(self.jobs, thread_name_prefix="ct-write") as write_pool, \
+             ThreadPoolExecutor(self.jobs, thread_name_prefix="ct-commit") as commit_pool:
+            self._write_pool = write_pool
+            self._commit_pool = commit_pool
+            try:
+                for camera_file in self.camera_transfer.camera_files():
+                    logger.debug("Processing camera file %s", camera_file.file_name)
+                    # Only the directory entry is needed for this; anything that
+                    # reads the file is left to the reader workers.
+                    if self.camera_transfer.already_imported(camera_file):
+                        continue
+                    # A file bigger than the whole budget is still allowed
+                    # through, but only once everything before it is committed.
+                    reserved_bytes = min(camera_file.file_size, self.max_in_flight_bytes)
+                    while self._in_flight and (
+                        len(self._in_flight) >= 2 * self.jobs
+                        or self._in_flight_bytes + reserved_bytes > self.max_in_flight_bytes
+                    ):
+                        self.commit_oldest()
+
+                    self._in_flight_bytes += reserved_bytes
+                    self._in_flight.append(InFlight(
+                        camera_file,
+                        read_pool.submit(self.prepare_camera_file, camera_file),
+                        reserved_bytes,
+                    ))
+
+                while self._in_flight:
+                    self.commit_oldest()
+                while self._committing:
+                    self.wait_for_oldest_commit()
+            finally:
+                self.discard_in_flight()
+                self._write_pool = None
+                self._commit_pool = None
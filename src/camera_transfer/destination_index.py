@@ -0,0 +1,60 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+from pathlib import PurePosixPath
+from typing import Callable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+def free_name(file_name: str, taken: Callable[[str], bool]) -> str:
+    """``file_name``, or the first of name-1.ext, name-2.ext and so on that is not ``taken``."""
+    if not taken(file_name):
+        return file_name
+    path = PurePosixPath(file_name)
+    number = 1
+    while taken(candidate := f"{path.stem}-{number}{path.suffix}"):
+        number += 1
+    return candidate
+
+
+@dataclass
+class DestinationIndex:
+    """The names in each destination folder, listed once and kept up to date as files are written.
+
+    ``list_folder`` returns the names in a folder, or nothing when it does
+    not exist yet. It is called the first time a folder is asked about and
+    never again, so a run costs one listing per folder however many files go
+    into it. Names are compared without case, as they would be on the
+    filesystems cards are usually formatted with and on macOS and Windows.
+    """
+    list_folder: Callable[[str], Iterable[str]]
+    _names: dict[str, set[str]] = field(default_factory=dict, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+
+    def _folder_names(self, folder: str) -> set[str]:
+        names = self._names.get(folder)
+        if names is None:
+            names = {name.casefold() for name in self.list_folder(folder)}
+            logger.debug("Listed %d names in %s", len(names), folder)
+            self._names[folder] = names
+        return names
+
+    def contains(self, folder: str, file_name: str) -> bool:
+        with self._lock:
+            return file_name.casefold() in self._folder_names(folder)
+
+    def claim(self, folder: str, file_name: str) -> str:
+        """Reserve a name in ``folder`` that nothing has, or is about to be written, under.
+
+        Returns ``file_name`` when it is free and otherwise numbers it, so
+        files that would get the same name, such as burst shots taken in the
+        same second, are all kept.
+        """
+        with self._lock:
+            names = self._folder_names(folder)
+            claimed = free_name(file_name, lambda name: name.casefold() in names)
+            names.add(claimed.casefold())
+        if claimed != file_name:
+            logger.info("%s is taken in %s, using %s", file_name, folder, claimed)
+        return claimed
@@ -0,0 +1,115 @@
+import logging
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# EXIF lives in a single APP1 segment, which is at most 64 KB long and comes
+# straight after the start of the JPEG, so this much is almost always enough.
+HEADER_SIZE = 64 * 1024
+
+SOI = b"\xff\xd8"
+APP1 = 0xE1
+SOS = 0xDA
+EXIF_SIGNATURE = b"Exif\x00\x00"
+
+ASCII = 2
+LONG = 4
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_DATETIME_ORIGINAL = 0x9003
+
+
+@dataclass(frozen=True)
+class ExifTags:
+    model: Optional[str]
+    datetime: Optional[str]
+    datetime_original: Optional[str] = None
+
+
+def _find_tiff(data: bytes) -> Optional[bytes]:
+    if not data.startswith(SOI):
+        return None
+    position = len(SOI)
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+        marker = data[position + 1]
+        if marker == 0xFF:
+            # Fill byte before the real marker.
+            position += 1
+            continue
+        if marker == SOS:
+            return None
+        (length,) = struct.unpack_from(">H", data, position + 2)
+        if position + 2 + length > len(data):
+            return None
+        segment = data[position + 4:position + 2 + length]
+        if marker == APP1 and segment.startswith(EXIF_SIGNATURE):
+            return segment[len(EXIF_SIGNATURE):]
+        position += 2 + length
+    return None
+
+
+def _read_ifd(tiff: bytes, byte_order: str, offset: int) -> dict[int, tuple[int, int, bytes]]:
+    """Map each tag in the IFD at ``offset`` to (type, count, raw value field)."""
+    (entry_count,) = struct.unpack_from(f"{byte_order}H", tiff, offset)
+    entries = {}
+    for index in range(entry_count):
+        entry = offset + 2 + index * 12
+        tag, value_type, count = struct.unpack_from(f"{byte_order}HHI", tiff, entry)
+        entries[tag] = (value_type, count, tiff[entry + 8:entry + 12])
+    return entries
+
+
+def _ascii_value(tiff: bytes, byte_order: str, value_type: int, count: int, field: bytes) -> Optional[str]:
+    if value_type != ASCII:
+        return None
+    if count <= 4:
+        raw = field[:count]
+    else:
+        (offset,) = struct.unpack(f"{byte_order}I", field)
+        raw = tiff[offset:offset + count]
+        if len(raw) < count:
+            raise struct.error("ASCII value runs past the end of the header")
+    return raw.split(b"\x00", 1)[0].decode("ascii", errors="replace")
+
+
+def parse_exif_header(data: bytes) -> Optional[ExifTags]:
+    """Read the camera model and capture time from the start of a JPEG.
+
+    Returns None when ``data`` is not a JPEG with an EXIF segment or the
+    segment is cut off, so the caller can fall back to a full parse.
+    """
+    tiff = _find_tiff(data)
+    if tiff is None or len(tiff) < 8:
+        return None
+
+    byte_order = {b"II": "<", b"MM": ">"}.get(tiff[:2])
+    if byte_order is None:
+        return None
+
+    try:
+        magic, ifd0_offset = struct.unpack_from(f"{byte_order}HI", tiff, 2)
+        if magic != 42:
+            return None
+        ifd0 = _read_ifd(tiff, byte_order, ifd0_offset)
+        tags = {tag: _ascii_value(tiff, byte_order, *ifd0[tag]) for tag in (TAG_MODEL, TAG_DATETIME) if tag in ifd0}
+
+        datetime_original = None
+        if TAG_EXIF_IFD in ifd0 and ifd0[TAG_EXIF_IFD][0] == LONG:
+            (exif_ifd_offset,) = struct.unpack(f"{byte_order}I", ifd0[TAG_EXIF_IFD][2])
+            exif_ifd = _read_ifd(tiff, byte_order, exif_ifd_offset)
+            if TAG_DATETIME_ORIGINAL in exif_ifd:
+                datetime_original = _ascii_value(tiff, byte_order, *exif_ifd[TAG_DATETIME_ORIGINAL])
+    except struct.error as e:
+        logger.debug("Could not parse EXIF header: %s", e)
+        return None
+
+    return ExifTags(
+        model=tags.get(TAG_MODEL),
+        datetime=tags.get(TAG_DATETIME),
+        datetime_original=datetime_original,
+    )
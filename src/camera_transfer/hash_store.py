@@ -1,30 +1,323 @@
+import functools
+import logging
+import os
 import sqlite3
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
 from pathlib import Path
-from typing import Optional, Iterator
+from typing import IO, Any, Callable, Concatenate, Iterable, Optional, Iterator, ParamSpec, TypeVar
 from dataclasses import dataclass, field
 from contextlib import contextmanager
 
+from camera_transfer.camera_file import DEFAULT_HASH_ALGORITHM, Fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+def _try_lock(handle: IO[bytes]) -> bool:
+    """Take an exclusive lock on ``handle`` without waiting; False when another handle holds one."""
+    try:
+        if sys.platform == "win32":
+            import msvcrt
+
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _table_exists(connection: sqlite3.Connection, table: str) -> bool:
+    cursor = connection.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,))
+    return cursor.fetchone() is not None
+
+
+def _migrate_to_v1(connection: sqlite3.Connection) -> None:
+    # Version 0 stored digests in a TEXT column with a separate unique index.
+    legacy_tables = [table for table in ("hash_store", "fingerprints") if _table_exists(connection, table)]
+    for table in legacy_tables:
+        connection.execute(f"ALTER TABLE {table} RENAME TO {table}_v0")
+
+    connection.execute(
+        "CREATE TABLE hash_store (hash BLOB PRIMARY KEY, image_file TEXT) WITHOUT ROWID"
+    )
+    connection.execute(
+        "CREATE TABLE fingerprints ("
+        "path TEXT, size INTEGER, mtime REAL, inode INTEGER, hash BLOB, "
+        "PRIMARY KEY (path, size, mtime, inode)) WITHOUT ROWID"
+    )
+
+    if "hash_store" in legacy_tables:
+        connection.execute(
+            "INSERT OR REPLACE INTO hash_store SELECT CAST(hash AS BLOB), image_file FROM hash_store_v0"
+        )
+        connection.execute("DROP TABLE hash_store_v0")
+    if "fingerprints" in legacy_tables:
+        connection.execute(
+            "INSERT OR REPLACE INTO fingerprints "
+            "SELECT path, size, mtime, inode, CAST(hash AS BLOB) FROM fingerprints_v0"
+        )
+        connection.execute("DROP TABLE fingerprints_v0")
+
+
+def _migrate_to_v2(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        "CREATE TABLE journal ("
+        "temp_location TEXT PRIMARY KEY, source TEXT, state TEXT, destination TEXT, size INTEGER, "
+        "hash BLOB, image_file TEXT, fp_path TEXT, fp_size INTEGER, fp_mtime REAL, fp_inode INTEGER)"
+    )
+
+
+def _migrate_to_v3(connection: sqlite3.Connection) -> None:
+    # Files imported before this version have no row here, so they are only
+    # caught by the full hash once they have been copied.
+    connection.execute(
+        "CREATE TABLE partial_hashes ("
+        "size INTEGER, partial_hash BLOB, hash BLOB, "
+        "PRIMARY KEY (size, partial_hash, hash)) WITHOUT ROWID"
+    )
+
+
+def _migrate_to_v4(connection: sqlite3.Connection) -> None:
+    # Every hash stored so far was a SHA-256.
+    connection.execute("ALTER TABLE hash_store ADD COLUMN algorithm TEXT NOT NULL DEFAULT 'sha256'")
+    connection.execute("ALTER TABLE journal ADD COLUMN algorithm TEXT")
+
+
+def _migrate_to_v5(connection: sqlite3.Connection) -> None:
+    connection.execute(
+        "CREATE TABLE library_files ("
+        "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash BLOB, algorithm TEXT) WITHOUT ROWID"
+    )
+
+
+def _migrate_to_v6(connection: sqlite3.Connection) -> None:
+    connection.execute("ALTER TABLE library_files ADD COLUMN verified_at REAL")
+    connection.execute("CREATE INDEX library_files_verified_at ON library_files (verified_at)")
+
+
+def _migrate_to_v7(connection: sqlite3.Connection) -> None:
+    # Files recorded by seed have no camera model, capture time or source.
+    for column in ("category TEXT", "camera_model TEXT", "captured_at TEXT", "source TEXT", "import_run INTEGER"):
+        connection.execute(f"ALTER TABLE library_files ADD COLUMN {column}")
+    connection.execute("CREATE TABLE import_runs (id INTEGER PRIMARY KEY, started_at REAL, source TEXT)")
+    connection.execute("CREATE INDEX library_files_captured_at ON library_files (captured_at)")
+    connection.execute("CREATE INDEX library_files_camera_model ON library_files (camera_model, captured_at)")
+    connection.execute("CREATE INDEX library_files_hash ON library_files (hash)")
+
+
+def _migrate_to_v8(connection: sqlite3.Connection) -> None:
+    # verified_at only moves on a successful check, so the time of the last
+    # check of any outcome is kept separately to order the verify queue.
+    connection.execute("ALTER TABLE library_files ADD COLUMN checked_at REAL")
+    connection.execute("ALTER TABLE library_files ADD COLUMN check_result TEXT")
+    connection.execute(
+        "UPDATE library_files SET checked_at=verified_at, check_result='ok' WHERE verified_at IS NOT NULL"
+    )
+    connection.execute("CREATE INDEX library_files_checked_at ON library_files (checked_at)")
+
+
+def _migrate_to_v9(connection: sqlite3.Connection) -> None:
+    # Entries from older versions have no owner and are recovered by the next run.
+    for column in (
+        "owner TEXT", "library_path TEXT", "mtime REAL", "partial_hash BLOB", "category TEXT",
+        "camera_model TEXT", "captured_at TEXT", "import_run INTEGER",
+    ):
+        connection.execute(f"ALTER TABLE journal ADD COLUMN {column}")
+
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def _locked(method: Callable[Concatenate["HashStore", P], R]) -> Callable[Concatenate["HashStore", P], R]:
+    """Serialise access to the connection and the pending batch."""
+    @functools.wraps(method)
+    def _(self: "HashStore", *args: P.args, **kwargs: P.kwargs) -> R:
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return _
+
+
+# Library files on the local disk, leaving out objects uploaded to a bucket,
+# which are recorded by their s3:// URL.
+LOCAL_LIBRARY_FILES = "path NOT LIKE '%://%'"
+
+# MIGRATIONS[n] upgrades a database from schema version n to n + 1.
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _migrate_to_v1,
+    _migrate_to_v2,
+    _migrate_to_v3,
+    _migrate_to_v4,
+    _migrate_to_v5,
+    _migrate_to_v6,
+    _migrate_to_v7,
+    _migrate_to_v8,
+    _migrate_to_v9,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+@dataclass
+class JournalEntry:
+    """A file that was being copied when the journal entry was written.
+
+    ``state`` is "staging" while the content is streamed into
+    ``temp_location`` and "committing" once the hash is known and the file is
+    about to be renamed to ``destination``. A committing entry also holds
+    the partial hash and the catalog row, so a file whose rename finished
+    can be recorded in full. ``owner`` is the ``HashStore`` that wrote it.
+    """
+    temp_location: str
+    source: str
+    state: str
+    destination: Optional[str] = None
+    size: Optional[int] = None
+    hash: Optional[bytes] = None
+    image_file: Optional[str] = None
+    fingerprint: Optional[Fingerprint] = None
+    algorithm: str = DEFAULT_HASH_ALGORITHM
+    owner: Optional[str] = None
+    partial_hash: Optional[bytes] = None
+    library_file: Optional["LibraryFile"] = None
+
+
+@dataclass
+class LibraryFile:
+    """A file in the library, as it was when it was last hashed.
+
+    ``verified_at`` is when its content was last found to match ``hash``,
+    or None if it never has been. ``checked_at`` is when it was last checked
+    at all, with the outcome in ``check_result`` ("ok", "corrupt", "missing"
+    or "modified"). The catalog fields are filled in for files
+    copied by an import and left as None for files found by seed.
+    """
+    path: str
+    size: int
+    mtime: float
+    hash: bytes
+    algorithm: str
+    verified_at: Optional[float] = None
+    checked_at: Optional[float] = None
+    check_result: Optional[str] = None
+    category: Optional[str] = None
+    camera_model: Optional[str] = None
+    captured_at: Optional[datetime] = None
+    source: Optional[str] = None
+    import_run: Optional[int] = None
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "LibraryFile":
+        return cls(
+            path=row["path"],
+            size=row["size"],
+            mtime=row["mtime"],
+            hash=row["hash"],
+            algorithm=row["algorithm"],
+            verified_at=row["verified_at"],
+            checked_at=row["checked_at"],
+            check_result=row["check_result"],
+            category=row["category"],
+            camera_model=row["camera_model"],
+            captured_at=datetime.fromisoformat(row["captured_at"]) if row["captured_at"] else None,
+            source=row["source"],
+            import_run=row["import_run"],
+        )
+
+
+def _catalog_time(value: datetime) -> str:
+    # Stored as text that sorts in time order, so ranges can use the index.
+    return value.isoformat(sep="T", timespec="seconds")
+
 
 @dataclass
 class HashStore:
+    """Hashes of every file imported so far, kept in SQLite.
+
+    Writes are collected in memory and inserted in one transaction once
+    ``batch_size`` rows are pending or ``flush_interval`` seconds have passed
+    since the last flush, and whenever ``flush`` or ``close`` is called. The
+    database runs in WAL mode, so a crash loses at most the pending batch.
+
+    The journal records every file while it is being copied. Journal updates
+    that a restart depends on are committed straight away, and in WAL mode
+    with ``synchronous=NORMAL`` those commits do not wait for an fsync.
+    ``before_flush`` is called before each batch is committed, so that the
+    files the batch records as imported can be made durable first.
+
+    Journal entries are tagged with ``owner``, a token for this store. While
+    the store is open it holds a lock on ``<owner>.lock`` in a folder next to
+    the database, which the operating system drops when the process dies.
+    ``abandoned_journal_entries`` only returns entries whose owner's lock is
+    free, so several processes can import into one library at once without
+    recovering each other's copies.
+
+    Each hash is stored with the algorithm that produced it. New hashes use
+    ``algorithm``; ones made with another algorithm are still found by
+    lookups and can be replaced with ``rehash``.
+
+    A single store can be shared between threads.
+    """
     database_file: Optional[Path] = None
     dry_run: bool = False
+    algorithm: str = DEFAULT_HASH_ALGORITHM
+    batch_size: int = 1
+    flush_interval: float = 5.0
+    before_flush: Optional[Callable[[], None]] = None
     connection: sqlite3.Connection = field(init=False)
+    owner: str = field(init=False, default_factory=lambda: uuid.uuid4().hex)
 
     def __post_init__(self) -> None:
         db_file_name = str(self.database_file) if self.database_file else ":memory:"
         if self.database_file:
             self.database_file.parent.mkdir(parents=True, exist_ok=True)
 
-        self.connection = sqlite3.connect(db_file_name)
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(db_file_name, check_same_thread=False)
         self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
         self._initialize_table()
 
+        self._pending_hashes: dict[bytes, tuple[str, str]] = {}
+        self._pending_fingerprints: dict[Fingerprint, bytes] = {}
+        self._pending_partial_hashes: set[tuple[int, bytes, bytes]] = set()
+        self._pending_library_files: dict[str, tuple[Any, ...]] = {}
+        self._pending_checked: dict[str, tuple[float, str]] = {}
+        self._pending_journal_removals: set[str] = set()
+        self._last_flush = time.monotonic()
+        self._owner_lock: Optional[IO[bytes]] = None
+        if self.database_file and not self.dry_run:
+            self.owners_folder.mkdir(exist_ok=True)
+            self._owner_lock = open(self.owners_folder / f"{self.owner}.lock", "a+b")
+            _try_lock(self._owner_lock)
+
+    @property
+    def owners_folder(self) -> Path:
+        assert self.database_file is not None
+        return self.database_file.with_name(f"{self.database_file.name}-owners")
+
     def _initialize_table(self) -> None:
-        with self.connection:
-            self.connection.execute(
-                "CREATE TABLE IF NOT EXISTS hash_store (hash TEXT UNIQUE, image_file TEXT)"
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(
+                f"Hash store {self.database_file} has schema version {version}, "
+                f"newer than the supported version {SCHEMA_VERSION}"
             )
+        while version < SCHEMA_VERSION:
+            logger.info("Migrating hash store from schema version %d to %d", version, version + 1)
+            with self.transaction():
+                self.connection.execute("BEGIN IMMEDIATE")
+                MIGRATIONS[version](self.connection)
+                version += 1
+                self.connection.execute(f"PRAGMA user_version = {version}")
 
     @contextmanager
     def transaction(self) -> Iterator[sqlite3.Connection]:
@@ -35,25 +328,432 @@ class HashStore:
             self.connection.rollback()
             raise
 
-    def __setitem__(self, hash_value: str, image_file: str) -> None:
-        if not self.dry_run:
+    def _maybe_flush(self) -> None:
+        pending = (
+            len(self._pending_hashes)
+            + len(self._pending_fingerprints)
+            + len(self._pending_partial_hashes)
+            + len(self._pending_library_files)
+            + len(self._pending_checked)
+            + len(self._pending_journal_removals)
+        )
+        if pending >= self.batch_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    @_locked
+    def flush(self) -> None:
+        """Write every pending row to the database in a single transaction."""
+        if (
+            self._pending_hashes
+            or self._pending_fingerprints
+            or self._pending_partial_hashes
+            or self._pending_library_files
+            or self._pending_checked
+            or self._pending_journal_removals
+        ):
+            if self.before_flush is not None:
+                self.before_flush()
             with self.transaction():
-                self.connection.execute("INSERT OR REPLACE INTO hash_store VALUES (?, ?)", (hash_value, image_file))
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO hash_store (hash, image_file, algorithm) VALUES (?, ?, ?)",
+                    (
+                        (hash_value, image_file, algorithm)
+                        for hash_value, (image_file, algorithm) in self._pending_hashes.items()
+                    ),
+                )
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (fingerprint.path, fingerprint.size, fingerprint.mtime, fingerprint.inode, hash_value)
+                        for fingerprint, hash_value in self._pending_fingerprints.items()
+                    ),
+                )
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO partial_hashes VALUES (?, ?, ?)", self._pending_partial_hashes
+                )
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO library_files (path, size, mtime, hash, algorithm, verified_at, "
+                    "category, camera_model, captured_at, source, import_run, checked_at, check_result) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        # A file hashed as it was written has just been checked.
+                        (path, *values, values[4], "ok" if values[4] is not None else None)
+                        for path, values in self._pending_library_files.items()
+                    ),
+                )
+                self.connection.executemany(
+                    "UPDATE library_files SET checked_at=?, check_result=?, "
+                    "verified_at=CASE WHEN ?='ok' THEN ? ELSE verified_at END WHERE path=?",
+                    (
+                        (checked_at, result, result, checked_at, path)
+                        for path, (checked_at, result) in self._pending_checked.items()
+                    ),
+                )
+                self.connection.executemany(
+                    "DELETE FROM journal WHERE temp_location=?",
+                    ((temp_location,) for temp_location in self._pending_journal_removals),
+                )
+            self._pending_hashes.clear()
+            self._pending_fingerprints.clear()
+            self._pending_partial_hashes.clear()
+            self._pending_library_files.clear()
+            self._pending_checked.clear()
+            self._pending_journal_removals.clear()
+        self._last_flush = time.monotonic()
+
+    def __setitem__(self, hash_value: bytes, image_file: str) -> None:
+        self.add_hash(hash_value, image_file, self.algorithm)
+
+    @_locked
+    def add_hash(self, hash_value: bytes, image_file: str, algorithm: str) -> None:
+        if not self.dry_run:
+            self._pending_hashes[hash_value] = (image_file, algorithm)
+            self._maybe_flush()
 
-    def __contains__(self, hash_value: str) -> bool:
+    @_locked
+    def __contains__(self, hash_value: bytes) -> bool:
+        if hash_value in self._pending_hashes:
+            return True
         cursor = self.connection.execute("SELECT 1 FROM hash_store WHERE hash=?", (hash_value,))
         return cursor.fetchone() is not None
 
-    def __getitem__(self, hash_value: str) -> Optional[str]:
+    @_locked
+    def __getitem__(self, hash_value: bytes) -> Optional[str]:
+        if hash_value in self._pending_hashes:
+            return self._pending_hashes[hash_value][0]
         cursor = self.connection.execute("SELECT image_file FROM hash_store WHERE hash=?", (hash_value,))
         row = cursor.fetchone()
         return row["image_file"] if row else None
 
+    @_locked
+    def algorithms(self) -> tuple[str, ...]:
+        """``algorithm`` followed by any other algorithms found in the store."""
+        cursor = self.connection.execute("SELECT DISTINCT algorithm FROM hash_store")
+        found = {row["algorithm"] for row in cursor} | {algorithm for _, algorithm in self._pending_hashes.values()}
+        return (self.algorithm, *sorted(found - {self.algorithm}))
+
+    @_locked
+    def legacy_hashes(self) -> list[tuple[bytes, str, str]]:
+        """(hash, image file, algorithm) for every hash not made with ``algorithm``."""
+        self.flush()
+        cursor = self.connection.execute(
+            "SELECT hash, image_file, algorithm FROM hash_store WHERE algorithm != ?", (self.algorithm,)
+        )
+        return [(row["hash"], row["image_file"], row["algorithm"]) for row in cursor]
+
+    @_locked
+    def rehash(self, old_hash: bytes, new_hash: bytes) -> None:
+        """Replace ``old_hash`` with ``new_hash``, made with ``algorithm``, keeping what refers to it."""
+        if self.dry_run:
+            return
+        self.flush()
+        with self.transaction():
+            self.connection.execute(
+                "INSERT OR REPLACE INTO hash_store (hash, image_file, algorithm) "
+                "SELECT ?, image_file, ? FROM hash_store WHERE hash=?",
+                (new_hash, self.algorithm, old_hash),
+            )
+            self.connection.execute("UPDATE fingerprints SET hash=? WHERE hash=?", (new_hash, old_hash))
+            self.connection.execute("UPDATE OR REPLACE partial_hashes SET hash=? WHERE hash=?", (new_hash, old_hash))
+            self.connection.execute(
+                "UPDATE library_files SET hash=?, algorithm=? WHERE hash=?", (new_hash, self.algorithm, old_hash)
+            )
+            self.connection.execute("DELETE FROM hash_store WHERE hash=?", (old_hash,))
+
+    @_locked
+    def add_fingerprint(self, fingerprint: Fingerprint, hash_value: bytes) -> None:
+        if not self.dry_run:
+            self._pending_fingerprints[fingerprint] = hash_value
+            self._maybe_flush()
+
+    @_locked
+    def has_fingerprint(self, fingerprint: Fingerprint) -> bool:
+        """True when a file with this fingerprint has already been imported."""
+        if fingerprint in self._pending_fingerprints:
+            return self._pending_fingerprints[fingerprint] in self
+        cursor = self.connection.execute(
+            "SELECT 1 FROM fingerprints JOIN hash_store USING (hash) "
+            "WHERE path=? AND size=? AND mtime=? AND inode=?",
+            (fingerprint.path, fingerprint.size, fingerprint.mtime, fingerprint.inode),
+        )
+        return cursor.fetchone() is not None
+
+    @_locked
+    def add_partial_hash(self, file_size: int, partial_hash: bytes, hash_value: bytes) -> None:
+        if not self.dry_run:
+            self._pending_partial_hashes.add((file_size, partial_hash, hash_value))
+            self._maybe_flush()
+
+    @_locked
+    def has_size(self, file_size: int) -> bool:
+        """True when a file of exactly this size has been imported."""
+        if any(size == file_size for size, _, _ in self._pending_partial_hashes):
+            return True
+        cursor = self.connection.execute("SELECT 1 FROM partial_hashes WHERE size=? LIMIT 1", (file_size,))
+        return cursor.fetchone() is not None
+
+    @_locked
+    def has_partial_hash(self, file_size: int, partial_hash: bytes) -> bool:
+        if any(key[:2] == (file_size, partial_hash) for key in self._pending_partial_hashes):
+            return True
+        cursor = self.connection.execute(
+            "SELECT 1 FROM partial_hashes WHERE size=? AND partial_hash=? LIMIT 1", (file_size, partial_hash)
+        )
+        return cursor.fetchone() is not None
+
+    @_locked
+    def add_library_file(
+        self,
+        path: str,
+        size: int,
+        mtime: float,
+        hash_value: bytes,
+        verified_at: Optional[float] = None,
+        category: Optional[str] = None,
+        camera_model: Optional[str] = None,
+        captured_at: Optional[datetime] = None,
+        source: Optional[str] = None,
+        import_run: Optional[int] = None,
+    ) -> None:
+        """Record where a file with this content is in the library, and what is known about it."""
+        if not self.dry_run:
+            self._pending_library_files[path] = (
+                size, mtime, hash_value, self.algorithm, verified_at,
+                category, camera_model, _catalog_time(captured_at) if captured_at else None, source, import_run,
+            )
+            self._maybe_flush()
+
+    @_locked
+    def start_import_run(self, source: str) -> Optional[int]:
+        """Record that an import from ``source`` has started and return its id."""
+        if self.dry_run:
+            return None
+        with self.transaction():
+            cursor = self.connection.execute(
+                "INSERT INTO import_runs (started_at, source) VALUES (?, ?)", (time.time(), source)
+            )
+        return cursor.lastrowid
+
+    @_locked
+    def query_library(
+        self,
+        captured_from: Optional[datetime] = None,
+        captured_before: Optional[datetime] = None,
+        camera_models: Optional[Iterable[str]] = None,
+        category: Optional[str] = None,
+        hash_value: Optional[bytes] = None,
+        duplicates: bool = False,
+    ) -> list[LibraryFile]:
+        """Library files matching every condition given, in capture time order.
+
+        ``duplicates`` keeps only files whose content is in the library more
+        than once, ordered so that copies of the same content are together.
+        """
+        self.flush()
+        conditions: list[str] = []
+        parameters: list[Any] = []
+        if captured_from is not None:
+            conditions.append("captured_at >= ?")
+            parameters.append(_catalog_time(captured_from))
+        if captured_before is not None:
+            conditions.append("captured_at < ?")
+            parameters.append(_catalog_time(captured_before))
+        if camera_models is not None:
+            models = list(camera_models)
+            conditions.append(f"camera_model IN ({', '.join('?' * len(models))})")
+            parameters.extend(models)
+        if category is not None:
+            conditions.append("category = ?")
+            parameters.append(category)
+        if hash_value is not None:
+            conditions.append("hash = ?")
+            parameters.append(hash_value)
+        if duplicates:
+            conditions.append("hash IN (SELECT hash FROM library_files GROUP BY hash HAVING COUNT(*) > 1)")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "hash, path" if duplicates else "captured_at, path"
+        cursor = self.connection.execute(f"SELECT * FROM library_files {where} ORDER BY {order}", parameters)
+        return [LibraryFile.from_row(row) for row in cursor]
+
+    @_locked
+    def library_totals(self) -> tuple[int, int]:
+        """Number and total size of the recorded library files on the local disk."""
+        self.flush()
+        row = self.connection.execute(f"SELECT COUNT(*), TOTAL(size) FROM library_files WHERE {LOCAL_LIBRARY_FILES}").fetchone()
+        return row[0], int(row[1])
+
+    @_locked
+    def least_recently_verified(self, max_bytes: int) -> list[LibraryFile]:
+        """Local library files never checked, then the longest ago, up to ``max_bytes`` in total.
+
+        Files are ordered by their last check whatever its outcome, so a
+        missing or damaged file waits its turn like the rest instead of
+        taking up every run. At least one file is returned when there are
+        any, however big it is.
+        """
+        self.flush()
+        cursor = self.connection.execute(
+            # NULLs sort first, so files never checked come before the rest.
+            f"SELECT * FROM library_files WHERE {LOCAL_LIBRARY_FILES} ORDER BY checked_at"
+        )
+        library_files: list[LibraryFile] = []
+        total = 0
+        for row in cursor:
+            if library_files and total + row["size"] > max_bytes:
+                break
+            library_files.append(LibraryFile.from_row(row))
+            total += row["size"]
+        cursor.close()
+        return library_files
+
+    @_locked
+    def mark_checked(self, path: str, checked_at: float, result: str) -> None:
+        """Record a check of a library file; ``verified_at`` only moves when ``result`` is "ok"."""
+        if not self.dry_run:
+            self._pending_checked[path] = (checked_at, result)
+            self._maybe_flush()
+
+    @_locked
+    def library_file_stats(self, folder: Path) -> dict[str, tuple[int, float]]:
+        """Size and modification time of every recorded library file below ``folder``."""
+        self.flush()
+        prefix = str(folder.resolve()).rstrip(os.sep) + os.sep
+        # Every path that starts with the prefix sorts between these two.
+        cursor = self.connection.execute(
+            "SELECT path, size, mtime FROM library_files WHERE path >= ? AND path < ?",
+            (prefix, prefix[:-1] + chr(ord(os.sep) + 1)),
+        )
+        return {row["path"]: (row["size"], row["mtime"]) for row in cursor}
+
+    @_locked
+    def remove_library_files(self, paths: Iterable[str]) -> None:
+        if not self.dry_run:
+            self.flush()
+            with self.transaction():
+                self.connection.executemany("DELETE FROM library_files WHERE path=?", ((path,) for path in paths))
+
+    @_locked
+    def journal_staging(self, temp_location: str, source: str) -> None:
+        if not self.dry_run:
+            with self.transaction():
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO journal (temp_location, source, state, owner) VALUES (?, ?, 'staging', ?)",
+                    (temp_location, source, self.owner),
+                )
+
+    @_locked
+    def journal_committing(
+        self,
+        temp_location: str,
+        destination: str,
+        image_file: str,
+        fingerprint: Optional[Fingerprint],
+        partial_hash: bytes,
+        library_file: LibraryFile,
+    ) -> None:
+        """Record everything needed to finish recording ``library_file`` if the run stops after the rename."""
+        if not self.dry_run:
+            fingerprint_values = (
+                (fingerprint.path, fingerprint.size, fingerprint.mtime, fingerprint.inode)
+                if fingerprint else (None, None, None, None)
+            )
+            captured_at = _catalog_time(library_file.captured_at) if library_file.captured_at else None
+            with self.transaction():
+                self.connection.execute(
+                    "UPDATE journal SET state='committing', destination=?, size=?, hash=?, image_file=?, "
+                    "fp_path=?, fp_size=?, fp_mtime=?, fp_inode=?, algorithm=?, library_path=?, mtime=?, "
+                    "partial_hash=?, category=?, camera_model=?, captured_at=?, import_run=? WHERE temp_location=?",
+                    (
+                        destination, library_file.size, library_file.hash, image_file, *fingerprint_values,
+                        library_file.algorithm, library_file.path, library_file.mtime, partial_hash,
+                        library_file.category, library_file.camera_model, captured_at, library_file.import_run,
+                        temp_location,
+                    ),
+                )
+
+    @_locked
+    def journal_finished(self, temp_location: str) -> None:
+        """Drop the journal entry with the next batch, together with the hash it recorded."""
+        if not self.dry_run:
+            self._pending_journal_removals.add(temp_location)
+            self._maybe_flush()
+
+    @_locked
+    def journal_entries(self) -> list[JournalEntry]:
+        cursor = self.connection.execute("SELECT * FROM journal")
+        return [
+            JournalEntry(
+                temp_location=row["temp_location"],
+                source=row["source"],
+                state=row["state"],
+                destination=row["destination"],
+                size=row["size"],
+                hash=row["hash"],
+                image_file=row["image_file"],
+                fingerprint=(
+                    Fingerprint(row["fp_path"], row["fp_size"], row["fp_mtime"], row["fp_inode"])
+                    if row["fp_path"] is not None else None
+                ),
+                algorithm=row["algorithm"] or DEFAULT_HASH_ALGORITHM,
+                owner=row["owner"],
+                partial_hash=row["partial_hash"],
+                library_file=LibraryFile(
+                    path=row["library_path"],
+                    size=row["size"],
+                    mtime=row["mtime"],
+                    hash=row["hash"],
+                    algorithm=row["algorithm"],
+                    category=row["category"],
+                    camera_model=row["camera_model"],
+                    captured_at=datetime.fromisoformat(row["captured_at"]) if row["captured_at"] else None,
+                    source=row["source"],
+                    import_run=row["import_run"],
+                ) if row["library_path"] is not None else None,
+            )
+            for row in cursor
+            if row["temp_location"] not in self._pending_journal_removals
+        ]
+
+    def live_owners(self) -> set[str]:
+        """This store's owner and those of other stores on the same database that are still open.
+
+        The lock files of owners that have gone are removed on the way.
+        """
+        live = {self.owner}
+        if self.database_file is None:
+            return live
+        for lock_file in self.owners_folder.glob("*.lock"):
+            if lock_file.stem == self.owner:
+                continue
+            try:
+                handle = open(lock_file, "r+b")
+            except FileNotFoundError:
+                continue
+            with handle:
+                alive = not _try_lock(handle)
+            if alive:
+                live.add(lock_file.stem)
+            else:
+                lock_file.unlink(missing_ok=True)
+        return live
+
+    @_locked
+    def abandoned_journal_entries(self) -> list[JournalEntry]:
+        """Journal entries left by stores that are no longer open, such as a run that was killed."""
+        live = self.live_owners()
+        return [entry for entry in self.journal_entries() if entry.owner not in live]
+
+    @_locked
     def close(self) -> None:
+        self.flush()
         self.connection.close()
+        if self._owner_lock is not None:
+            self._owner_lock.close()
+            self._owner_lock = None
+            (self.owners_folder / f"{self.owner}.lock").unlink(missing_ok=True)
 
     def __enter__(self) -> "HashStore":
         return self
 
     def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback: Optional[object]) -> None:
-        self.close()
\ No newline at end of file
+        self.close()
@@ -0,0 +1,75 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Protocol
+
+from camera_transfer.camera_file import file_digests
+from camera_transfer.os_file_getter import binary_opener
+
+logger = logging.getLogger(__name__)
+
+
+class HashStore(Protocol):
+    algorithm: str
+
+    def legacy_hashes(self) -> list[tuple[bytes, str, str]]:
+        ...
+
+    def rehash(self, old_hash: bytes, new_hash: bytes) -> None:
+        ...
+
+
+@dataclass
+class LibraryRehash:
+    """Rehashes files already in the library with the hash store's algorithm.
+
+    Every hash made with another algorithm is looked up by file name in the
+    library folders. When a file there still has that hash, the stored hash
+    is replaced with the new one. Hashes whose file has gone from the library
+    are kept as they are, so duplicates of it are still recognised. A file
+    that cannot be read is skipped. Setting ``stop`` ends the run after the
+    current file; the hashes left are picked up by the next run.
+    """
+    hash_store: HashStore
+    library_folders: list[Path]
+    stop: threading.Event = field(default_factory=threading.Event)
+
+    def library_files(self) -> dict[str, list[Path]]:
+        files: dict[str, list[Path]] = {}
+        for library_folder in dict.fromkeys(self.library_folders):
+            for folder, _, file_names in os.walk(library_folder):
+                for file_name in file_names:
+                    if not file_name.startswith(".camera-transfer-"):
+                        files.setdefault(file_name, []).append(Path(folder, file_name))
+        return files
+
+    def run(self) -> int:
+        """Rehash what can be found and return how many hashes were replaced."""
+        legacy_hashes = self.hash_store.legacy_hashes()
+        if not legacy_hashes:
+            return 0
+        logger.info("Rehashing %d library files with %s", len(legacy_hashes), self.hash_store.algorithm)
+        files = self.library_files()
+        rehashed = 0
+        for old_hash, image_file, algorithm in legacy_hashes:
+            if self.stop.is_set():
+                break
+            for path in files.get(image_file, []):
+                try:
+                    digests = file_digests(binary_opener(path), (algorithm, self.hash_store.algorithm))
+                except OSError as error:
+                    logger.warning("Could not rehash %s: %s", path, error)
+                    continue
+                if digests[algorithm] == old_hash:
+                    self.hash_store.rehash(old_hash, digests[self.hash_store.algorithm])
+                    rehashed += 1
+                    break
+            else:
+                logger.debug("Keeping the %s hash of %s, which is not in the library", algorithm, image_file)
+        if self.stop.is_set():
+            logger.info("Stopped after rehashing %d of %d library files; the rest are rehashed next time", rehashed, len(legacy_hashes))
+        else:
+            logger.info("Rehashed %d of %d library files", rehashed, len(legacy_hashes))
+        return rehashed
@@ -0,0 +1,158 @@
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterator, Optional, Protocol, Union
+
+from camera_transfer.camera_file import ContentHasher, read_chunks
+from camera_transfer.os_file_getter import binary_opener
+
+logger = logging.getLogger(__name__)
+
+# Files handed to a worker at a time, so small files do not cost one round
+# trip to the pool each.
+SEED_CHUNK_SIZE = 64
+
+LibraryFile = tuple[str, os.stat_result]
+# A file's full and partial hash, or why it could not be read.
+HashResult = Union[tuple[bytes, bytes], str]
+
+
+class HashStore(Protocol):
+    algorithm: str
+
+    def __setitem__(self, hash: bytes, file_item: str) -> None:
+        ...
+
+    def add_partial_hash(self, file_size: int, partial_hash: bytes, hash: bytes) -> None:
+        ...
+
+    def add_library_file(self, path: str, size: int, mtime: float, hash: bytes, verified_at: Optional[float] = None) -> None:
+        ...
+
+    def library_file_stats(self, folder: Path) -> dict[str, tuple[int, float]]:
+        ...
+
+    def remove_library_files(self, paths: list[str]) -> None:
+        ...
+
+    def flush(self) -> None:
+        ...
+
+
+def hash_library_files(paths: list[str], algorithm: str) -> list[HashResult]:
+    """Full and partial hash of each library file. Runs in a worker process."""
+    results: list[HashResult] = []
+    for path in paths:
+        hasher = ContentHasher((algorithm,))
+        try:
+            for chunk in read_chunks(binary_opener(Path(path))):
+                hasher.update(chunk)
+        except OSError as error:
+            results.append(str(error))
+            continue
+        results.append((hasher.digests()[algorithm], hasher.partial_digest()))
+    return results
+
+
+@dataclass
+class SeedCounts:
+    hashed: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    failed: int = 0
+
+
+@dataclass
+class LibrarySeed:
+    """Fills the hash store from files that are already in the library.
+
+    Files are hashed by a pool of ``jobs`` processes. Each file is recorded
+    with its path, size and modification time in the hash store's next batch
+    after it is hashed, so an interrupted seed picks up close to where it
+    stopped, and running it again only
+    hashes files that are new or have changed. Records of files that have
+    gone from the library are dropped. A library folder inside another one,
+    such as a videos folder below the photos folder, is only walked as part
+    of the outer one.
+    """
+    hash_store: HashStore
+    library_folders: list[Path]
+    file_extensions: set[str]
+    jobs: Optional[int] = None
+    counts: SeedCounts = field(default_factory=SeedCounts)
+
+    def __post_init__(self) -> None:
+        self._suffixes = {extension.lower() for extension in self.file_extensions}
+
+    def library_files(self, library_folder: Path) -> Iterator[LibraryFile]:
+        for folder, folder_names, file_names in os.walk(library_folder.resolve()):
+            folder_names[:] = [name for name in folder_names if not name.startswith(".")]
+            for file_name in file_names:
+                if file_name.startswith(".") or os.path.splitext(file_name)[1].lower() not in self._suffixes:
+                    continue
+                path = os.path.join(folder, file_name)
+                try:
+                    yield path, os.stat(path)
+                except FileNotFoundError:
+                    logger.debug("%s went away while seeding", path)
+
+    def seed_folders(self) -> list[Path]:
+        """The resolved library folders, leaving out any that another one already contains."""
+        folders = list(dict.fromkeys(folder.resolve() for folder in self.library_folders))
+        return [
+            folder for folder in folders
+            if not any(other != folder and folder.is_relative_to(other) for other in folders)
+        ]
+
+    def changed_files(self) -> Iterator[LibraryFile]:
+        for library_folder in self.seed_folders():
+            known = self.hash_store.library_file_stats(library_folder)
+            for path, stat in self.library_files(library_folder):
+                known_stat = known.pop(path, None)
+                # Modification times can come back through a float with a
+                # rounding error, so allow for that.
+                if known_stat is not None and known_stat[0] == stat.st_size and abs(known_stat[1] - stat.st_mtime) < 1e-6:
+                    self.counts.unchanged += 1
+                else:
+                    yield path, stat
+            if known:
+                self.hash_store.remove_library_files(list(known))
+                self.counts.removed += len(known)
+
+    def run(self) -> SeedCounts:
+        algorithm = self.hash_store.algorithm
+        workers = self.jobs or os.cpu_count() or 1
+        in_flight: deque[tuple[tuple[LibraryFile, ...], Future[list[HashResult]]]] = deque()
+        with ProcessPoolExecutor(workers) as pool:
+            for chunk in itertools.batched(self.changed_files(), SEED_CHUNK_SIZE):
+                # Two chunks per worker keep every process busy without
+                # reading far ahead of what has been stored.
+                if len(in_flight) >= 2 * workers:
+                    self.store_results(*in_flight.popleft())
+                in_flight.append((chunk, pool.submit(hash_library_files, [path for path, _ in chunk], algorithm)))
+            while in_flight:
+                self.store_results(*in_flight.popleft())
+        self.hash_store.flush()
+        logger.info(
+            "Seeded hash store: %d hashed, %d unchanged, %d removed, %d failed",
+            self.counts.hashed, self.counts.unchanged, self.counts.removed, self.counts.failed,
+        )
+        return self.counts
+
+    def store_results(self, chunk: tuple[LibraryFile, ...], future: "Future[list[HashResult]]") -> None:
+        for (path, stat), result in zip(chunk, future.result()):
+            if isinstance(result, str):
+                logger.warning("Could not hash %s: %s", path, result)
+                self.counts.failed += 1
+                continue
+            file_hash, partial_hash = result
+            self.hash_store[file_hash] = os.path.basename(path)
+            self.hash_store.add_partial_hash(stat.st_size, partial_hash, file_hash)
+            # Hashing the file just now counts as verifying it.
+            self.hash_store.add_library_file(path, stat.st_size, stat.st_mtime, file_hash, verified_at=time.time())
+            self.counts.hashed += 1
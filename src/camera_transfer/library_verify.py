@@ -0,0 +1,129 @@
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Literal, Optional, Protocol
+
+from camera_transfer.camera_file import read_chunks
+from camera_transfer.hash_store import LibraryFile
+from camera_transfer.os_file_getter import binary_opener
+
+logger = logging.getLogger(__name__)
+
+VerifyResult = Literal["ok", "corrupt", "missing", "modified"]
+
+
+class HashStore(Protocol):
+    def library_totals(self) -> tuple[int, int]:
+        ...
+
+    def least_recently_verified(self, max_bytes: int) -> list[LibraryFile]:
+        ...
+
+    def mark_checked(self, path: str, checked_at: float, result: str) -> None:
+        ...
+
+    def flush(self) -> None:
+        ...
+
+
+@dataclass
+class Throttle:
+    """Keeps the combined read rate of several threads under ``bytes_per_second``."""
+    bytes_per_second: Optional[float] = None
+
+    def __post_init__(self) -> None:
+        self._lock = threading.Lock()
+        self._next_read = time.monotonic()
+
+    def consume(self, n: int) -> None:
+        if not self.bytes_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next_read, now)
+            self._next_read = start + n / self.bytes_per_second
+        if start > now:
+            time.sleep(start - now)
+
+
+@dataclass
+class VerifyReport:
+    verified: int = 0
+    bytes_verified: int = 0
+    corrupt: list[str] = field(default_factory=list)
+    missing: list[str] = field(default_factory=list)
+    modified: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.corrupt and not self.missing
+
+
+@dataclass
+class LibraryVerify:
+    """Checks library files against the hashes recorded when they were written.
+
+    Each run checks the files that have gone longest without a check, about
+    1/``cycle_days`` of the library by size, so a daily run covers all of it
+    every ``cycle_days`` days. A file that failed its last check waits its
+    turn like the others, so it cannot hold the rest back. Files are read by ``jobs`` threads (hashlib
+    releases the GIL on large updates), no faster than
+    ``max_bytes_per_second`` in total.
+
+    A file whose size or modification time has changed since it was hashed
+    was edited rather than damaged, so it is reported as modified and left
+    for ``seed`` to pick up. Files uploaded to a bucket are not checked.
+    """
+    hash_store: HashStore
+    cycle_days: float = 7
+    max_bytes_per_second: Optional[float] = None
+    jobs: int = 1
+
+    def __post_init__(self) -> None:
+        self._throttle = Throttle(self.max_bytes_per_second)
+
+    def due_files(self) -> list[LibraryFile]:
+        _, total_bytes = self.hash_store.library_totals()
+        return self.hash_store.least_recently_verified(math.ceil(total_bytes / self.cycle_days))
+
+    def verify_file(self, library_file: LibraryFile) -> VerifyResult:
+        try:
+            stat = os.stat(library_file.path)
+        except FileNotFoundError:
+            return "missing"
+        if stat.st_size != library_file.size or abs(stat.st_mtime - library_file.mtime) >= 1e-6:
+            return "modified"
+        hasher = hashlib.new(library_file.algorithm)
+        try:
+            for chunk in read_chunks(binary_opener(Path(library_file.path))):
+                self._throttle.consume(len(chunk))
+                hasher.update(chunk)
+        except FileNotFoundError:
+            return "missing"
+        except OSError as error:
+            # A read error on a file that exists is what a damaged disk looks like.
+            logger.error("Could not read %s: %s", library_file.path, error)
+            return "corrupt"
+        return "ok" if hasher.digest() == library_file.hash else "corrupt"
+
+    def run(self) -> VerifyReport:
+        due_files = self.due_files()
+        logger.info("Verifying %d library files", len(due_files))
+        report = VerifyReport()
+        with ThreadPoolExecutor(self.jobs, thread_name_prefix="ct-verify") as pool:
+            for library_file, result in zip(due_files, pool.map(self.verify_file, due_files)):
+                self.hash_store.mark_checked(library_file.path, time.time(), result)
+                if result == "ok":
+                    report.verified += 1
+                    report.bytes_verified += library_file.size
+                else:
+                    logger.warning("%s: %s", result.capitalize(), library_file.path)
+                    getattr(report, result).append(library_file.path)
+        self.hash_store.flush()
+        return report
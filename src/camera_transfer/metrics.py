@@ -0,0 +1,144 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, ContextManager, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets in seconds: 100 µs doubling up to ~52 s.
+BUCKET_BOUNDS = tuple(0.0001 * 2 ** i for i in range(20))
+
+STAGES = ("scan", "lookup", "read+hash", "exif", "write", "insert")
+COUNTERS = (
+    "copied", "duplicate", "previously_imported", "failed", "bytes_read", "bytes_written",
+    # Files handed out by the scanner and files dealt with, for progress.
+    "files_found", "bytes_found", "bytes_done",
+)
+# Every file ends up counted under one of these.
+OUTCOMES = ("copied", "duplicate", "previously_imported", "failed")
+
+
+@dataclass
+class Histogram:
+    counts: list[int] = field(default_factory=lambda: [0] * (len(BUCKET_BOUNDS) + 1))
+    count: int = 0
+    total: float = 0.0
+    maximum: float = 0.0
+
+    def record(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile."""
+        target = q * self.count
+        seen = 0
+        for bound, bucket_count in zip(BUCKET_BOUNDS, self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(bound, self.maximum)
+        return self.maximum
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "max_seconds": self.maximum,
+            "p50_seconds": self.quantile(0.5),
+            "p95_seconds": self.quantile(0.95),
+            "buckets": {f"le_{bound:g}": n for bound, n in zip(BUCKET_BOUNDS, self.counts)} | {"inf": self.counts[-1]},
+        }
+
+
+@dataclass
+class TransferMetrics:
+    """Counters and per-stage latency histograms for a transfer.
+
+    Counters are always kept because they are needed for the end-of-run
+    summary. Stage timings are only recorded when ``timings`` is set;
+    otherwise ``stage`` hands back a shared no-op context manager.
+    """
+    timings: bool = False
+    counters: dict[str, int] = field(default_factory=lambda: dict.fromkeys(COUNTERS, 0))
+    stages: dict[str, Histogram] = field(default_factory=dict)
+
+    def __post_init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._finished: float | None = None
+        self._noop: ContextManager[None] = nullcontext()
+        # Bytes already counted as done for files still being copied, by id.
+        self._partial: dict[int, int] = {}
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def found(self, file_size: int) -> None:
+        with self._lock:
+            self.counters["files_found"] += 1
+            self.counters["bytes_found"] += file_size
+
+    def advance(self, camera_file: object, n: int) -> None:
+        """Count ``n`` bytes of ``camera_file`` as done while it is still being copied."""
+        with self._lock:
+            self.counters["bytes_done"] += n
+            self._partial[id(camera_file)] = self._partial.get(id(camera_file), 0) + n
+
+    def done(self, outcome: str, file_size: int, camera_file: object = None) -> None:
+        """Count a file as ``outcome`` (one of ``OUTCOMES``) along with its size.
+
+        Only the part of ``file_size`` not already counted by ``advance`` is
+        added to ``bytes_done``.
+        """
+        with self._lock:
+            self.counters[outcome] += 1
+            self.counters["bytes_done"] += file_size - self._partial.pop(id(camera_file), 0)
+
+    @property
+    def files_done(self) -> int:
+        return sum(self.counters[outcome] for outcome in OUTCOMES)
+
+    def stage(self, name: str) -> ContextManager[None]:
+        if not self.timings:
+            return self._noop
+        return self._timed(name)
+
+    @contextmanager
+    def _timed(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name: str, seconds: float) -> None:
+        if self.timings:
+            with self._lock:
+                self.stages.setdefault(name, Histogram()).record(seconds)
+
+    def finish(self) -> None:
+        self._finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self._finished or time.perf_counter()) - self._started
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "elapsed_seconds": self.elapsed,
+            "counters": dict(self.counters),
+            "stages": {name: histogram.to_dict() for name, histogram in self.stages.items()},
+        }
+
+    def write_json(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(self.to_dict(), indent=2))
+        logger.info("Wrote metrics to %s", path)
@@ -0,0 +1,59 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from camera_transfer.camera_transfer import CameraTransfer, HashStore, OutputFileWriter
+from camera_transfer.metrics import TransferMetrics
+
+logger = logging.getLogger(__name__)
+
+
+def group_by_device(camera_folders: list[Path]) -> list[list[Path]]:
+    """Group folders that live on the same physical device, keeping their order."""
+    groups: dict[int, list[Path]] = {}
+    for camera_folder in camera_folders:
+        groups.setdefault(os.stat(camera_folder).st_dev, []).append(camera_folder)
+    return list(groups.values())
+
+
+@dataclass
+class MultiCameraTransfer:
+    """Imports several cards at the same time into one library.
+
+    Each inner list holds the transfers for the folders on one device. Every
+    device gets its own thread, so a slow card does not hold up the others,
+    while folders on the same device are read one after another. The
+    transfers share one hash store, one output file writer and one commit
+    lock, so a file found on two cards is only copied once. Which card's copy
+    wins depends on which finishes reading it first. The lock is only held to
+    check for a duplicate and to record a new file, so one card's rename,
+    fsync or upload does not hold up commits from the others.
+    """
+    device_transfers: list[list[CameraTransfer]]
+
+    @property
+    def metrics(self) -> TransferMetrics:
+        return self.device_transfers[0][0].metrics
+
+    @property
+    def hash_store(self) -> HashStore:
+        return self.device_transfers[0][0].hash_store
+
+    @property
+    def output_file_writer(self) -> OutputFileWriter:
+        return self.device_transfers[0][0].output_file_writer
+
+    def transfer_device(self, camera_transfers: list[CameraTransfer]) -> None:
+        for camera_transfer in camera_transfers:
+            camera_transfer.transfer()
+
+    def run(self) -> None:
+        # Recovery must finish before any transfer starts staging files.
+        self.device_transfers[0][0].recover()
+        logger.info("Importing from %d devices", len(self.device_transfers))
+        with ThreadPoolExecutor(len(self.device_transfers), thread_name_prefix="ct-device") as pool:
+            futures = [pool.submit(self.transfer_device, camera_transfers) for camera_transfers in self.device_transfers]
+        for future in futures:
+            future.result()
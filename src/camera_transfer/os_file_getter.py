@@ -1,29 +1,110 @@
 from pathlib import Path
-from camera_transfer.camera_file import CameraFile
+from camera_transfer.camera_file import CameraFile, Fingerprint
 from camera_transfer.camera_file_getter import File
-from typing import Iterator
+from typing import BinaryIO, Callable, Iterator, Literal
 from datetime import datetime
 import logging
-from dataclasses import dataclass
+import os
+from dataclasses import dataclass, field
 
 logger = logging.getLogger(__name__)
 
+# Folders that cameras and desktop operating systems leave on cards which
+# never hold anything worth importing.
+JUNK_FOLDERS = frozenset({
+    ".trashes",
+    ".spotlight-v100",
+    ".fseventsd",
+    ".thumbnails",
+    "misc",
+    "thumbnails",
+    "system volume information",
+})
+
+ReadOrder = Literal["scan", "name", "inode"]
+
+
+def binary_opener(path: Path) -> Callable[[], BinaryIO]:
+    def _() -> BinaryIO:
+        return path.open("rb")
+
+    return _
+
+
+@dataclass
+class ScannedFile:
+    path: Path
+    stat: os.stat_result
+
+
 @dataclass
 class OSFileGetter:
+    """Walks a camera folder with ``os.scandir``.
+
+    The stat data of each directory entry is reused, junk folders are pruned
+    and extensions are matched regardless of case. ``read_order`` decides the
+    order files are handed out in: "scan" keeps the order the directories
+    list them in, "name" sorts each directory by name and "inode" sorts the
+    whole card by inode number, which on FAT cards follows the position on
+    the card and keeps reads sequential.
+    """
     location: Path
     file_extensions: set[str]
+    fingerprint_inode: bool = False
+    read_order: ReadOrder = "name"
+    junk_folders: frozenset[str] = field(default=JUNK_FOLDERS)
 
-    def list_files(self) -> Iterator[Path]:
+    def __post_init__(self) -> None:
+        self._suffixes = {suffix.lower() for suffix in self.file_extensions}
+        self._junk_folders = {folder.lower() for folder in self.junk_folders}
+
+    def _scan_folder(self, folder: str) -> Iterator[ScannedFile]:
+        with os.scandir(folder) as it:
+            entries = list(it)
+        if self.read_order == "name":
+            entries.sort(key=lambda entry: entry.name)
+
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if entry.name.lower() in self._junk_folders:
+                    logger.debug("Skipping folder %s", entry.path)
+                    continue
+                yield from self._scan_folder(entry.path)
+            elif (
+                os.path.splitext(entry.name)[1].lower() in self._suffixes
+                # AppleDouble files that macOS writes next to every file
+                and not entry.name.startswith("._")
+                and entry.is_file()
+            ):
+                yield ScannedFile(Path(entry.path), entry.stat())
+
+    def scan(self) -> Iterator[ScannedFile]:
         logger.info("Listing files in location: %s", self.location)
-        return (p.resolve() for p in self.location.glob("**/*") if p.suffix in self.file_extensions)
+        scanned_files = self._scan_folder(str(self.location.resolve()))
+        if self.read_order == "inode":
+            return iter(sorted(scanned_files, key=lambda scanned_file: scanned_file.stat.st_ino))
+        return scanned_files
+
+    def list_files(self) -> Iterator[Path]:
+        return (scanned_file.path for scanned_file in self.scan())
 
     def get_next_file(self) -> Iterator[File]:
-        for file in self.list_files():
-            logger.debug("in list_files loop with file: %s", file.relative_to(self.location))
+        location = self.location.resolve()
+        for scanned_file in self.scan():
+            file, stat = scanned_file.path, scanned_file.stat
+            relative_path = file.relative_to(location)
+            logger.debug("in list_files loop with file: %s", relative_path)
+            file_last_modified = datetime.fromtimestamp(stat.st_mtime)
             yield File(
-                file.name, 
-                file.read_bytes(),
-                datetime.fromtimestamp(file.stat().st_mtime)
+                file.name,
+                stat.st_size,
+                file_last_modified,
+                binary_opener(file),
+                Fingerprint(
+                    path=relative_path.as_posix(),
+                    size=stat.st_size,
+                    mtime=file_last_modified.timestamp(),
+                    inode=stat.st_ino if self.fingerprint_inode else 0,
+                ),
+                file,
             )
-
-  
@@ -1,32 +1,337 @@
+import errno
 import logging
+import sys
+import tempfile
+import threading
 from datetime import datetime
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import IO, BinaryIO, Callable, Iterable, Literal, Optional
 import os
 
+from camera_transfer.destination_index import DestinationIndex, free_name
+
 logger = logging.getLogger(__name__)
 
+Durability = Literal["none", "file", "directory"]
+CopyStrategy = Literal["stream", "copy_file_range", "reflink", "hardlink"]
+
+# From linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+
+def _reflink(source_fd: int, destination_fd: int, size: int) -> None:
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "reflink is only supported on Linux")
+    import fcntl
+    fcntl.ioctl(destination_fd, FICLONE, source_fd)
+
+
+def _copy_file_range(source_fd: int, destination_fd: int, size: int) -> None:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(source_fd, destination_fd, size - copied)
+        if n == 0:
+            raise OSError(errno.EIO, f"copy_file_range stopped after {copied} of {size} bytes")
+        copied += n
+
+
+def _sendfile(source_fd: int, destination_fd: int, size: int) -> None:
+    copied = 0
+    while copied < size:
+        n = os.sendfile(destination_fd, source_fd, copied, size - copied)
+        if n == 0:
+            raise OSError(errno.EIO, f"sendfile stopped after {copied} of {size} bytes")
+        copied += n
+
+
+KERNEL_COPIERS: dict[str, Callable[[int, int, int], None]] = {
+    "reflink": _reflink,
+    "copy_file_range": _copy_file_range,
+    "sendfile": _sendfile,
+}
+
+# What to try for each strategy, in order. Streaming through Python is the
+# last resort for all of them and is handled by the caller.
+COPY_FALLBACKS: dict[CopyStrategy, tuple[str, ...]] = {
+    "stream": (),
+    "copy_file_range": ("copy_file_range", "sendfile"),
+    "reflink": ("reflink", "copy_file_range", "sendfile"),
+    "hardlink": ("hardlink", "reflink", "copy_file_range", "sendfile"),
+}
+
+
+def fsync_path(path: Path) -> None:
+    # Directories cannot be opened for fsync on Windows, where the rename is
+    # already durable once it returns.
+    if os.name == "nt" and path.is_dir():
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def list_folder_names(folder: str) -> list[str]:
+    try:
+        with os.scandir(folder) as entries:
+            return [entry.name for entry in entries]
+    except FileNotFoundError:
+        return []
+
+
+@dataclass
+class OSStagedFile:
+    """A file being streamed into a temporary file in its destination folder.
+
+    Nothing appears under the final name until ``commit`` is called, so a
+    duplicate can be thrown away after the hash is known without leaving
+    anything behind. Leaving the ``with`` block discards an uncommitted file.
+    """
+    folder: Path
+    dry_run: bool = False
+    writer: Optional["OSOutputFileWriter"] = None
+
+    def __post_init__(self) -> None:
+        self.temp_file: Optional[Path] = None
+        self._handle: Optional[IO[bytes]] = None
+        self._committed = False
+        self._written = 0
+        self._preallocated = False
+        if not self.dry_run:
+            if self.writer is None:
+                self.folder.mkdir(parents=True, exist_ok=True)
+            self._handle = tempfile.NamedTemporaryFile(
+                dir=self.folder, prefix=".camera-transfer-", suffix=".part", delete=False
+            )
+            self.temp_file = Path(self._handle.name)
+
+    @property
+    def temp_location(self) -> Optional[str]:
+        return str(self.temp_file) if self.temp_file else None
+
+    def destination(self, file_name: str) -> str:
+        return str(self.folder / file_name)
+
+    def library_path(self, file_name: str) -> str:
+        """Where the committed file is, as recorded in the catalog."""
+        return str((self.folder / file_name).resolve())
+
+    def claim_name(self, file_name: str) -> str:
+        """A name in the folder for this file that does not clash with another, based on ``file_name``."""
+        if self.writer is None:
+            return free_name(file_name, lambda name: os.path.lexists(self.folder / name))
+        return self.writer.destination_index.claim(str(self.folder), file_name)
+
+    def write(self, chunk: bytes) -> None:
+        if self._handle is not None:
+            self._handle.write(chunk)
+            self._written += len(chunk)
+
+    def preallocate(self, size: int) -> None:
+        """Reserve space for a big file up front so it is laid out in one piece."""
+        minimum = self.writer.preallocate_min_size if self.writer else 0
+        if self._handle is None or not minimum or size < minimum or not hasattr(os, "posix_fallocate"):
+            return
+        try:
+            os.posix_fallocate(self._handle.fileno(), 0, size)
+            self._preallocated = True
+        except OSError as error:
+            logger.debug("Could not preallocate %d bytes for %s: %s", size, self.temp_file, error)
+
+    def copy_from(self, source: Path, size: int) -> bool:
+        """Fill the empty file from ``source`` without passing the data through Python.
+
+        Tries each method allowed by the writer's copy strategy in turn and
+        returns False when none of them worked, in which case the caller
+        should stream the content with ``write`` instead.
+        """
+        if self._handle is None or self.writer is None:
+            return False
+        for method in COPY_FALLBACKS[self.writer.copy_strategy]:
+            try:
+                if method == "hardlink":
+                    self._hardlink(source)
+                else:
+                    with open(source, "rb") as source_handle:
+                        KERNEL_COPIERS[method](source_handle.fileno(), self._handle.fileno(), size)
+            except OSError as error:
+                logger.debug("Could not %s %s: %s", method, source, error)
+                self._reset()
+                continue
+            logger.debug("Copied %s with %s", source, method)
+            return True
+        return False
+
+    def open_written(self) -> BinaryIO:
+        """Open what has been written for reading, from the disk rather than the page cache where possible."""
+        assert self._handle is not None and self.temp_file is not None
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(self._handle.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+        return open(self.temp_file, "rb")
+
+    def _hardlink(self, source: Path) -> None:
+        assert self._handle is not None and self.temp_file is not None
+        self._handle.close()
+        self.temp_file.unlink()
+        try:
+            os.link(source, self.temp_file)
+        finally:
+            # Keep a handle open so the rest of the staged file works as usual.
+            self._handle = open(self.temp_file, "ab")
+
+    def _reset(self) -> None:
+        assert self._handle is not None
+        self._handle.seek(0)
+        self._handle.truncate()
+
+    def commit(self, file_name: str, file_last_modified: datetime) -> None:
+        fq_file_name = self.folder / file_name
+        if self.dry_run:
+            logger.debug(f"Would write to file: {fq_file_name}")
+            return
+
+        assert self._handle is not None and self.temp_file is not None
+        logger.debug(f"Writing to file: {fq_file_name}")
+        if self._preallocated:
+            # posix_fallocate extends the file, so drop anything not written.
+            self._handle.flush()
+            self._handle.truncate(self._written)
+        durability = self.writer.durability if self.writer else "none"
+        if durability == "file":
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+        self._handle.close()
+        if fq_file_name.exists():
+            raise FileExistsError(f"File exists: '{fq_file_name}'")
+
+        os.utime(self.temp_file, (file_last_modified.timestamp(), file_last_modified.timestamp()))
+        os.replace(self.temp_file, fq_file_name)
+        self._committed = True
+        if durability == "file":
+            fsync_path(self.folder)
+        elif self.writer is not None:
+            self.writer.committed(fq_file_name)
+
+    def discard(self) -> None:
+        if self._handle is not None and not self._committed:
+            self._handle.close()
+            assert self.temp_file is not None
+            self.temp_file.unlink(missing_ok=True)
+
+    def __enter__(self) -> "OSStagedFile":
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback: Optional[object]) -> None:
+        self.discard()
+
+
 @dataclass
 class OSOutputFileWriter:
+    """Writes files below the photos and videos folders.
+
+    ``durability`` decides when written files are forced to disk: "none"
+    leaves it to the operating system, "file" fsyncs every file and its
+    folder as it is committed, and "directory" fsyncs the files committed
+    since the last ``flush`` and then each of their folders once, every
+    ``fsync_batch_size`` files and at the end of the run.
+
+    ``copy_strategy`` lets files that are already on a local disk be copied
+    by the kernel: "copy_file_range" copies inside the kernel (falling back to
+    sendfile), "reflink" shares the data blocks on btrfs and XFS, and
+    "hardlink" links the source into the library when both are on the same
+    filesystem. Each falls back to the next cheaper method and finally to
+    streaming, which is all "stream" ever does.
+
+    Folders are created once per run and remembered, and streamed files of
+    at least ``preallocate_min_size`` bytes have their space reserved with
+    posix_fallocate before they are written (0 turns this off).
+
+    Each destination folder is listed once, the first time a file is named
+    for it, and files whose names clash with a file already there or one
+    written earlier in the run are numbered rather than refused.
+    """
     base_image_location: Path
     base_video_location: Path
     dry_run: bool = False
+    durability: Durability = "none"
+    fsync_batch_size: int = 100
+    copy_strategy: CopyStrategy = "stream"
+    preallocate_min_size: int = 64 * 1024 * 1024
+    _unsynced_files: list[Path] = field(default_factory=list, init=False, repr=False)
+    _folders: set[Path] = field(default_factory=set, init=False, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False)
+    destination_index: DestinationIndex = field(init=False, repr=False)
 
-    def write_file(self, file_name: str, file_last_modified: datetime, file_content: bytes, file_category: str, sub_folder: Path) -> None:
-        logger.debug(f"file_name: {file_name}")
-        logger.debug(f"file_last_modified: {file_last_modified}")
+    def __post_init__(self) -> None:
+        self.destination_index = DestinationIndex(list_folder_names)
+
+    def folder_for(self, file_category: str, sub_folder: Path) -> Path:
         if file_category == "image":
-            fq_file_name = self.base_image_location.joinpath(sub_folder, file_name)
+            return self.base_image_location.joinpath(sub_folder)
         elif file_category == "video":
-            fq_file_name = self.base_video_location.joinpath(sub_folder, file_name)
-        
-        if self.dry_run:
-            logger.debug(f"Would write to file: {fq_file_name}")
-            return
+            return self.base_video_location.joinpath(sub_folder)
+        raise ValueError(f"Unknown file category: {file_category}")
 
-        logger.debug(f"Writing to file: {fq_file_name}")
-        fq_file_name.parent.mkdir(parents=True, exist_ok=True)
-        fq_file_name.touch(exist_ok=False)
-        fq_file_name.write_bytes(file_content)
+    def make_folder(self, folder: Path) -> None:
+        # Nearly every file goes into a folder made earlier in the run.
+        if folder not in self._folders:
+            folder.mkdir(parents=True, exist_ok=True)
+            self._folders.add(folder)
+
+    def destination(self, file_category: str, sub_folder: Path, file_name: str) -> str:
+        return str(self.folder_for(file_category, sub_folder) / file_name)
+
+    def destination_exists(self, destination: str) -> bool:
+        path = Path(destination)
+        return self.destination_index.contains(str(path.parent), path.name)
 
-        os.utime(fq_file_name, (file_last_modified.timestamp(), file_last_modified.timestamp()))
\ No newline at end of file
+    def stage_file(self, file_category: str, sub_folder: Path) -> OSStagedFile:
+        folder = self.folder_for(file_category, sub_folder)
+        if not self.dry_run:
+            self.make_folder(folder)
+        return OSStagedFile(folder, dry_run=self.dry_run, writer=self)
+
+    def committed(self, file: Path) -> None:
+        if self.durability == "directory":
+            with self._lock:
+                self._unsynced_files.append(file)
+                batch_full = len(self._unsynced_files) >= self.fsync_batch_size
+            if batch_full:
+                self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            files, self._unsynced_files = self._unsynced_files, []
+        for file in files:
+            fsync_path(file)
+        for folder in {file.parent for file in files}:
+            fsync_path(folder)
+
+    def close(self) -> None:
+        self.flush()
+
+    def recover_staged(self, temp_location: str, destination: Optional[str], size: Optional[int]) -> bool:
+        """Clean up after a file that was being written when a run was interrupted.
+
+        Removes the temporary file if it is still there and returns True when
+        the file was already renamed to ``destination`` in full.
+        """
+        Path(temp_location).unlink(missing_ok=True)
+        if destination is None:
+            return False
+        destination_path = Path(destination)
+        return destination_path.exists() and (size is None or destination_path.stat().st_size == size)
+
+    def write_file(self, file_name: str, file_last_modified: datetime, file_content: Iterable[bytes], file_category: str, sub_folder: Path) -> None:
+        logger.debug(f"file_name: {file_name}")
+        logger.debug(f"file_last_modified: {file_last_modified}")
+        with self.stage_file(file_category, sub_folder) as staged_file:
+            for chunk in file_content:
+                staged_file.write(chunk)
+            staged_file.commit(staged_file.claim_name(file_name), file_last_modified)
@@ -0,0 +1,113 @@
+import logging
+import sys
+import threading
+from dataclasses import dataclass, field
+from types import TracebackType
+from typing import Any, Optional
+
+from rich.console import Console
+from rich.progress import (
+    BarColumn,
+    DownloadColumn,
+    Progress,
+    TaskID,
+    TextColumn,
+    TimeRemainingColumn,
+    TransferSpeedColumn,
+)
+
+from camera_transfer.metrics import TransferMetrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TransferProgress:
+    """A live view of a running transfer, drawn from its metrics.
+
+    The transfer only bumps the counters it keeps anyway. A background thread
+    reads them ``refresh_per_second`` times a second and redraws, so however
+    many files go past, the display costs the transfer nothing. The MB/s and
+    time left are worked out by rich from the bytes dealt with over the last
+    ``speed_window`` seconds, against the bytes the scanner has found.
+
+    Log lines written while the display is up are printed above it.
+    """
+    metrics: TransferMetrics
+    refresh_per_second: float = 4
+    speed_window: float = 30
+    console: Console = field(default_factory=lambda: Console(stderr=True))
+
+    def __post_init__(self) -> None:
+        self._progress = Progress(
+            TextColumn("[progress.description]{task.description}"),
+            BarColumn(),
+            DownloadColumn(),
+            TransferSpeedColumn(),
+            TextColumn("{task.fields[files]}"),
+            TimeRemainingColumn(),
+            console=self.console,
+            auto_refresh=False,
+            speed_estimate_period=self.speed_window,
+        )
+        self._task: Optional[TaskID] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._handler_streams: list[tuple[logging.StreamHandler[Any], Any]] = []
+
+    def files_text(self) -> str:
+        counters = self.metrics.counters
+        files_done = self.metrics.files_done
+        files_per_second = files_done / max(self.metrics.elapsed, 1e-9)
+        return (
+            f"{files_done}/{counters['files_found']} files, {files_per_second:.1f} files/s, "
+            f"{counters['duplicate'] + counters['previously_imported']} skipped, {counters['failed']} failed"
+        )
+
+    def update(self) -> None:
+        assert self._task is not None
+        counters = self.metrics.counters
+        self._progress.update(
+            self._task,
+            total=counters["bytes_found"],
+            completed=counters["bytes_done"],
+            files=self.files_text(),
+        )
+        self._progress.refresh()
+
+    def _run(self) -> None:
+        while not self._stop.wait(1 / self.refresh_per_second):
+            self.update()
+
+    def _redirect_logging(self, stderr: Any) -> None:
+        # Handlers keep the stream they were created with, so point the ones
+        # writing to the terminal at rich's stand-in for it.
+        if sys.stderr is stderr:
+            return
+        for handler in logging.getLogger().handlers:
+            if isinstance(handler, logging.StreamHandler) and handler.stream is stderr:
+                self._handler_streams.append((handler, handler.setStream(sys.stderr)))
+
+    def __enter__(self) -> "TransferProgress":
+        self._task = self._progress.add_task("Importing", total=None, files="")
+        stderr = sys.stderr
+        self._progress.start()
+        self._redirect_logging(stderr)
+        self._thread = threading.Thread(target=self._run, name="ct-progress", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.update()
+        for handler, stream in self._handler_streams:
+            handler.setStream(stream)
+        self._handler_streams.clear()
+        self._progress.stop()
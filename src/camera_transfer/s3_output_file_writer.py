@@ -0,0 +1,226 @@
+import logging
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, BinaryIO, Iterable, Iterator, Optional
+
+from camera_transfer.destination_index import DestinationIndex
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Object metadata keys are sent as x-amz-meta-<key>.
+LAST_MODIFIED_METADATA = "file-last-modified"
+
+
+@dataclass
+class S3StagedFile:
+    """A file being spooled to local disk before it is uploaded.
+
+    Multipart uploads need to seek back to retry a part and to read several
+    parts at once, so the content is written to a temporary file first and
+    uploaded by ``commit`` once the name is known. Nothing appears in the
+    bucket until then.
+    """
+    key_prefix: str
+    writer: "S3OutputFileWriter"
+
+    def __post_init__(self) -> None:
+        self._handle: Optional[IO[bytes]] = None
+        self.temp_file: Optional[Path] = None
+        if not self.writer.dry_run:
+            self._handle = tempfile.NamedTemporaryFile(
+                dir=self.writer.spool_folder, prefix=".camera-transfer-", suffix=".part", delete=False
+            )
+            self.temp_file = Path(self._handle.name)
+
+    @property
+    def temp_location(self) -> Optional[str]:
+        return str(self.temp_file) if self.temp_file else None
+
+    def key(self, file_name: str) -> str:
+        return f"{self.key_prefix}{file_name}"
+
+    def destination(self, file_name: str) -> str:
+        return self.writer.url(self.key(file_name))
+
+    def library_path(self, file_name: str) -> str:
+        """The s3:// URL of the uploaded object, as recorded in the catalog."""
+        return self.destination(file_name)
+
+    def claim_name(self, file_name: str) -> str:
+        """A name under the key prefix that does not clash with another object, based on ``file_name``."""
+        return self.writer.destination_index.claim(self.key_prefix, file_name)
+
+    def write(self, chunk: bytes) -> None:
+        if self._handle is not None:
+            self._handle.write(chunk)
+
+    def copy_from(self, source: Path, size: int) -> bool:
+        return False
+
+    def preallocate(self, size: int) -> None:
+        pass
+
+    def open_written(self) -> BinaryIO:
+        """Open the spooled content, which is what will be uploaded."""
+        assert self._handle is not None and self.temp_file is not None
+        self._handle.flush()
+        return open(self.temp_file, "rb")
+
+    def commit(self, file_name: str, file_last_modified: datetime) -> None:
+        key = self.key(file_name)
+        if self.writer.dry_run:
+            logger.debug("Would upload to %s", self.writer.url(key))
+            return
+
+        assert self._handle is not None and self.temp_file is not None
+        self._handle.close()
+        if self.writer.exists(key):
+            raise FileExistsError(f"Object exists: '{self.writer.url(key)}'")
+        logger.debug("Uploading to %s", self.writer.url(key))
+        self.writer.transfer_manager.upload(
+            str(self.temp_file),
+            self.writer.bucket,
+            key,
+            extra_args={"Metadata": {LAST_MODIFIED_METADATA: file_last_modified.isoformat()}},
+        ).result()
+        self.discard()
+
+    def discard(self) -> None:
+        if self._handle is not None:
+            self._handle.close()
+            assert self.temp_file is not None
+            self.temp_file.unlink(missing_ok=True)
+
+    def __enter__(self) -> "S3StagedFile":
+        return self
+
+    def __exit__(self, exc_type: Optional[type], exc_value: Optional[BaseException], traceback: Optional[object]) -> None:
+        self.discard()
+
+
+@dataclass
+class S3OutputFileWriter:
+    """Uploads files to an S3 compatible bucket.
+
+    Keys follow the same layout as the folders written by
+    ``OSOutputFileWriter``: ``image_prefix`` or ``video_prefix``, then the
+    sub folder, then the file name. The original modification time is kept
+    in the object metadata under ``file-last-modified``.
+
+    One client, and so one connection pool, and one transfer manager are
+    shared by every upload, however many files are committed at once. Files
+    of at least ``multipart_threshold`` bytes are uploaded in
+    ``multipart_chunksize`` parts. ``max_concurrency`` requests are sent at a
+    time across all uploads, and ``max_bandwidth`` (bytes per second) caps
+    their total rate. Set ``endpoint_url`` to use a service other than AWS,
+    such as MinIO. ``close`` waits for the manager's threads to stop.
+
+    Each key prefix is listed once, the first time a file is named for it,
+    and files whose names clash with an object already there or one
+    uploaded earlier in the run are numbered rather than refused.
+
+    Needs boto3, which is installed with the ``s3`` extra.
+    """
+    bucket: str
+    image_prefix: str = "photos/"
+    video_prefix: str = "videos/"
+    dry_run: bool = False
+    endpoint_url: Optional[str] = None
+    max_concurrency: int = 10
+    max_bandwidth: Optional[int] = None
+    multipart_threshold: int = 16 * MB
+    multipart_chunksize: int = 16 * MB
+    spool_folder: Optional[Path] = None
+    client: Any = None
+    transfer_config: Any = field(init=False, repr=False)
+    transfer_manager: Any = field(init=False, repr=False)
+    destination_index: DestinationIndex = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        import boto3  # type: ignore
+        from boto3.s3.transfer import TransferConfig  # type: ignore
+        from botocore.config import Config  # type: ignore
+        from s3transfer.manager import TransferManager  # type: ignore
+
+        if self.client is None:
+            self.client = boto3.client(
+                "s3",
+                endpoint_url=self.endpoint_url,
+                # Every part being uploaded at once needs its own connection.
+                config=Config(max_pool_connections=self.max_concurrency),
+            )
+        self.transfer_config = TransferConfig(
+            multipart_threshold=self.multipart_threshold,
+            multipart_chunksize=self.multipart_chunksize,
+            max_concurrency=self.max_concurrency,
+            max_bandwidth=self.max_bandwidth,
+        )
+        self.transfer_manager = TransferManager(self.client, self.transfer_config)
+        self.destination_index = DestinationIndex(self.list_names)
+
+    def url(self, key: str) -> str:
+        return f"s3://{self.bucket}/{key}"
+
+    def key_prefix_for(self, file_category: str, sub_folder: Path) -> str:
+        if file_category == "image":
+            prefix = self.image_prefix
+        elif file_category == "video":
+            prefix = self.video_prefix
+        else:
+            raise ValueError(f"Unknown file category: {file_category}")
+        return f"{prefix}{sub_folder.as_posix()}/"
+
+    def list_names(self, key_prefix: str) -> Iterator[str]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=key_prefix, Delimiter="/"):
+            for content in page.get("Contents", []):
+                yield content["Key"][len(key_prefix):]
+
+    def exists(self, key: str) -> bool:
+        return self.object_size(key) is not None
+
+    def object_size(self, key: str) -> Optional[int]:
+        from botocore.exceptions import ClientError  # type: ignore
+
+        try:
+            response = self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as error:
+            if error.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return int(response["ContentLength"])
+
+    def destination(self, file_category: str, sub_folder: Path, file_name: str) -> str:
+        return self.url(f"{self.key_prefix_for(file_category, sub_folder)}{file_name}")
+
+    def destination_exists(self, destination: str) -> bool:
+        key_prefix, _, file_name = destination.removeprefix(self.url("")).rpartition("/")
+        return self.destination_index.contains(f"{key_prefix}/", file_name)
+
+    def stage_file(self, file_category: str, sub_folder: Path) -> S3StagedFile:
+        return S3StagedFile(self.key_prefix_for(file_category, sub_folder), writer=self)
+
+    def flush(self) -> None:
+        # An upload is durable once its transfer has finished.
+        pass
+
+    def close(self) -> None:
+        self.transfer_manager.shutdown()
+
+    def recover_staged(self, temp_location: str, destination: Optional[str], size: Optional[int]) -> bool:
+        """Remove a spooled file left by an interrupted run and report whether its upload finished."""
+        Path(temp_location).unlink(missing_ok=True)
+        if destination is None:
+            return False
+        key = destination.removeprefix(self.url(""))
+        object_size = self.object_size(key)
+        return object_size is not None and (size is None or object_size == size)
+
+    def write_file(self, file_name: str, file_last_modified: datetime, file_content: Iterable[bytes], file_category: str, sub_folder: Path) -> None:
+        with self.stage_file(file_category, sub_folder) as staged_file:
+            for chunk in file_content:
+                staged_file.write(chunk)
+            staged_file.commit(staged_file.claim_name(file_name), file_last_modified)
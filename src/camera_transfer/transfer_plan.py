@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator, Literal, Optional, Protocol
+
+from camera_transfer.archive_file_getter import ArchiveFileGetter, is_archive
+from camera_transfer.camera_file import CameraFile, Fingerprint
+from camera_transfer.camera_file_getter import File
+from camera_transfer.camera_transfer import CameraFileGetter, import_sub_folder
+from camera_transfer.os_file_getter import binary_opener
+
+logger = logging.getLogger(__name__)
+
+PLAN_VERSION = 1
+
+PlanAction = Literal["copy", "previously_imported", "error"]
+
+
+class HashStore(Protocol):
+    def has_fingerprint(self, fingerprint: Fingerprint) -> bool:
+        ...
+
+    def has_size(self, file_size: int) -> bool:
+        ...
+
+
+class OutputFileWriter(Protocol):
+    def destination(self, file_category: str, sub_folder: Path, file_name: str) -> str:
+        ...
+
+    def destination_exists(self, destination: str) -> bool:
+        ...
+
+
+@dataclass
+class PlannedFile:
+    """What a transfer is expected to do with one file from a card.
+
+    ``possible_duplicate`` means a file of the same size has been imported
+    before or is copied earlier in the plan; only the hash taken when the
+    plan is executed can tell. A file
+    ``collides`` when its destination already exists or an earlier file in
+    the plan is going to the same place; it is numbered when the plan is
+    executed.
+    """
+    card: str
+    member: str
+    file_name: str
+    file_size: int
+    file_last_modified: str
+    category: str
+    action: PlanAction
+    file_path: Optional[str] = None
+    new_file_name: Optional[str] = None
+    destination: Optional[str] = None
+    possible_duplicate: bool = False
+    collides: bool = False
+    error: Optional[str] = None
+
+
+@dataclass
+class TransferPlan:
+    sub_folder: str
+    files: list[PlannedFile] = field(default_factory=list)
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat(timespec="seconds"))
+    version: int = PLAN_VERSION
+
+    @property
+    def cards(self) -> list[str]:
+        return list(dict.fromkeys(planned_file.card for planned_file in self.files))
+
+    def counts(self) -> Counter[str]:
+        counts: Counter[str] = Counter(planned_file.action for planned_file in self.files)
+        counts["possible_duplicate"] = sum(planned_file.possible_duplicate for planned_file in self.files)
+        counts["collides"] = sum(planned_file.collides for planned_file in self.files)
+        return counts
+
+    def mark_possible_duplicates(self) -> None:
+        """Mark files the same size as a file copied earlier in the plan."""
+        sizes: set[int] = set()
+        for planned_file in self.files:
+            if planned_file.action == "copy":
+                planned_file.possible_duplicate = planned_file.possible_duplicate or planned_file.file_size in sizes
+                sizes.add(planned_file.file_size)
+
+    def mark_collisions(self) -> None:
+        """Mark files going to the same destination as an earlier file in the plan."""
+        destinations: set[str] = set()
+        for planned_file in self.files:
+            if planned_file.destination is not None:
+                planned_file.collides = planned_file.collides or planned_file.destination in destinations
+                destinations.add(planned_file.destination)
+
+    def write(self, plan_file: Path) -> None:
+        temp_file = plan_file.with_name(f".{plan_file.name}.tmp")
+        temp_file.write_text(json.dumps(asdict(self), indent=2))
+        os.replace(temp_file, plan_file)
+
+    @classmethod
+    def read(cls, plan_file: Path) -> "TransferPlan":
+        data: dict[str, Any] = json.loads(plan_file.read_text())
+        if data.get("version") != PLAN_VERSION:
+            raise ValueError(f"{plan_file} is a version {data.get('version')} plan, expected version {PLAN_VERSION}")
+        files = [PlannedFile(**planned_file) for planned_file in data.pop("files")]
+        return cls(files=files, **data)
+
+
+@dataclass
+class TransferPlanner:
+    """Works out what a transfer would do without reading whole files.
+
+    Only directory entries, the hash store and the start of each image (for
+    the EXIF tags in its name) are looked at, so planning a card takes about
+    as long as listing it. ``jobs`` files are looked at at once, and the card
+    is listed no further than ``2 * jobs`` files ahead of them, so a
+    compressed tar only has that many members spooled at a time.
+    """
+    camera_file_getter: CameraFileGetter
+    output_file_writer: OutputFileWriter
+    hash_store: HashStore
+    card: str
+    sub_folder: Path = field(default_factory=import_sub_folder)
+    jobs: int = 1
+
+    def plan_file(self, camera_file: CameraFile) -> PlannedFile:
+        planned_file = PlannedFile(
+            card=self.card,
+            member=camera_file.fingerprint.path if camera_file.fingerprint else camera_file.file_name,
+            file_name=camera_file.file_name,
+            file_size=camera_file.file_size,
+            file_last_modified=camera_file.file_last_modified.isoformat(),
+            category=camera_file.file_category,
+            action="copy",
+            file_path=str(camera_file.file_path) if camera_file.file_path else None,
+        )
+        if camera_file.fingerprint is not None and self.hash_store.has_fingerprint(camera_file.fingerprint):
+            planned_file.action = "previously_imported"
+            return planned_file
+        try:
+            planned_file.new_file_name = camera_file.generate_new_file_name()
+        except (KeyError, ValueError, OSError) as error:
+            planned_file.action = "error"
+            planned_file.error = str(error)
+            return planned_file
+        planned_file.destination = self.output_file_writer.destination(
+            camera_file.file_category, self.sub_folder, planned_file.new_file_name
+        )
+        planned_file.possible_duplicate = self.hash_store.has_size(camera_file.file_size)
+        planned_file.collides = self.output_file_writer.destination_exists(planned_file.destination)
+        return planned_file
+
+    def plan(self) -> TransferPlan:
+        logger.info("Planning transfer from %s", self.card)
+        plan = TransferPlan(sub_folder=self.sub_folder.as_posix())
+        pending: deque[Future[PlannedFile]] = deque()
+        with ThreadPoolExecutor(self.jobs, thread_name_prefix="ct-plan") as pool:
+            for camera_file in self.camera_file_getter.get_next_file():
+                while len(pending) >= 2 * self.jobs:
+                    plan.files.append(pending.popleft().result())
+                pending.append(pool.submit(self.plan_file, camera_file))
+            plan.files.extend(future.result() for future in pending)
+        plan.mark_possible_duplicates()
+        plan.mark_collisions()
+        return plan
+
+
+@dataclass
+class PlanFileGetter:
+    """Hands out the files a plan copies from ``card``, without scanning it again.
+
+    Files on disk are opened by the path in the plan. Members of an archive
+    are found by reading its index once more. A file that has changed since
+    it was planned is still imported, with its current size and time.
+    Members of a compressed tar are spooled to ``spool_folder``.
+    """
+    plan: TransferPlan
+    card: str
+    fingerprint_inode: bool = False
+    spool_folder: Optional[Path] = None
+
+    def planned_files(self) -> list[PlannedFile]:
+        return [
+            planned_file for planned_file in self.plan.files
+            if planned_file.card == self.card and planned_file.action == "copy"
+        ]
+
+    def get_next_file(self) -> Iterator[File]:
+        planned_files = self.planned_files()
+        card = Path(self.card)
+        if is_archive(card):
+            members = {planned_file.member for planned_file in planned_files}
+            extensions = {Path(member).suffix for member in members}
+            for file in ArchiveFileGetter(
+                location=card, file_extensions=extensions, spool_folder=self.spool_folder
+            ).get_next_file():
+                if file.fingerprint is not None and file.fingerprint.path in members:
+                    yield file
+            return
+
+        for planned_file in planned_files:
+            assert planned_file.file_path is not None
+            path = Path(planned_file.file_path)
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                logger.warning("%s has gone since it was planned", path)
+                continue
+            file_last_modified = datetime.fromtimestamp(stat.st_mtime)
+            if stat.st_size != planned_file.file_size or file_last_modified.isoformat() != planned_file.file_last_modified:
+                logger.warning("%s has changed since it was planned", path)
+            yield File(
+                path.name,
+                stat.st_size,
+                file_last_modified,
+                binary_opener(path),
+                Fingerprint(
+                    path=planned_file.member,
+                    size=stat.st_size,
+                    mtime=file_last_modified.timestamp(),
+                    inode=stat.st_ino if self.fingerprint_inode else 0,
+                ),
+                path,
+            )
@@ -0,0 +1,196 @@
+import logging
+import struct
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import BinaryIO, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# mvhd times count seconds from the start of 1904, in UTC.
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=timezone.utc)
+# Boxes holding metadata are small; anything bigger is not what it claims to be.
+MAX_METADATA_BOX = 1024 * 1024
+# Boxes inside these hold the tags read here. Everything else, including
+# mdat and the sample tables of each trak, is skipped over with a seek.
+CONTAINERS = {b"moov", b"udta", b"meta", b"ilst"}
+
+# In order of preference.
+MAKE_KEYS = ("com.apple.quicktime.make", "\xa9mak")
+MODEL_KEYS = ("com.apple.quicktime.model", "\xa9mod")
+CREATION_DATE_KEYS = ("com.apple.quicktime.creationdate", "\xa9day")
+
+
+@dataclass(frozen=True)
+class VideoTags:
+    creation_time: Optional[datetime]
+    make: Optional[str] = None
+    model: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class Box:
+    type: bytes
+    # Where the content starts, after the header, and where the box ends.
+    start: int
+    end: int
+
+
+def _boxes(handle: BinaryIO, start: int, end: int) -> Iterator[Box]:
+    """The boxes between ``start`` and ``end``, reading only their headers.
+
+    A box that claims to run past ``end`` or is too short to be a box ends
+    the walk, so a truncated file or junk after the last box is ignored.
+    """
+    position = start
+    while position + 8 <= end:
+        handle.seek(position)
+        header = handle.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            large_size = handle.read(8)
+            if len(large_size) < 8:
+                return
+            (size,) = struct.unpack(">Q", large_size)
+            header_size = 16
+        elif size == 0:
+            size = end - position
+        if size < header_size or position + size > end:
+            logger.debug("Stopping at malformed %r box at %d", box_type, position)
+            return
+        yield Box(box_type, position + header_size, position + size)
+        position += size
+
+
+def _read(handle: BinaryIO, box: Box) -> bytes:
+    handle.seek(box.start)
+    return handle.read(min(box.end - box.start, MAX_METADATA_BOX))
+
+
+def _mvhd_creation_time(content: bytes) -> Optional[datetime]:
+    if len(content) < 8:
+        return None
+    version = content[0]
+    if version == 1 and len(content) >= 12:
+        (seconds,) = struct.unpack_from(">Q", content, 4)
+    else:
+        (seconds,) = struct.unpack_from(">I", content, 4)
+    if seconds == 0:
+        return None
+    try:
+        # Shown in local time, the same as the clock that named the images.
+        return (MP4_EPOCH + timedelta(seconds=seconds)).astimezone().replace(tzinfo=None)
+    except (OverflowError, OSError):
+        # A corrupt 64 bit time can be far past the year 9999.
+        logger.debug("Ignoring mvhd creation time %d seconds after 1904", seconds)
+        return None
+
+
+def _parse_date(text: str) -> Optional[datetime]:
+    """A QuickTime date like 2024-01-25T17:00:03+0100, as the wall clock time it shows."""
+    try:
+        return datetime.fromisoformat(text.strip().replace("Z", "+00:00")).replace(tzinfo=None)
+    except ValueError:
+        return None
+
+
+def _user_data_text(content: bytes) -> Optional[str]:
+    # QuickTime user data text: a 16 bit length and a language code, then the text.
+    if len(content) < 4:
+        return None
+    (length,) = struct.unpack_from(">H", content)
+    return content[4:4 + length].decode("utf-8", "replace").rstrip("\x00").strip() or None
+
+
+def _data_value(handle: BinaryIO, item: Box) -> Optional[str]:
+    for data in _boxes(handle, item.start, item.end):
+        if data.type == b"data":
+            content = _read(handle, data)
+            # Type indicator and locale come before the value.
+            return content[8:].decode("utf-8", "replace").rstrip("\x00").strip() or None
+    return None
+
+
+def _keys(content: bytes) -> list[str]:
+    if len(content) < 8:
+        return []
+    (count,) = struct.unpack_from(">I", content, 4)
+    keys = []
+    position = 8
+    for _ in range(count):
+        if position + 8 > len(content):
+            break
+        (size,) = struct.unpack_from(">I", content, position)
+        if size < 8:
+            break
+        keys.append(content[position + 8:position + size].decode("utf-8", "replace"))
+        position += size
+    return keys
+
+
+@dataclass
+class _TagReader:
+    handle: BinaryIO
+    tags: dict[str, str]
+    creation_time: Optional[datetime] = None
+
+    def walk(self, box: Box) -> None:
+        start = box.start
+        if box.type == b"meta":
+            # An ISO meta box starts with a version and flags; a QuickTime
+            # one goes straight to its hdlr box.
+            self.handle.seek(start + 4)
+            if self.handle.read(4) != b"hdlr":
+                start += 4
+        keys: list[str] = []
+        for child in _boxes(self.handle, start, box.end):
+            if child.type == b"mvhd":
+                self.creation_time = _mvhd_creation_time(_read(self.handle, child))
+            elif child.type == b"keys":
+                keys = _keys(_read(self.handle, child))
+            elif child.type == b"ilst":
+                self.read_items(child, keys)
+            elif child.type in CONTAINERS:
+                self.walk(child)
+            elif box.type == b"udta" and child.type.startswith(b"\xa9"):
+                value = _user_data_text(_read(self.handle, child))
+                if value is not None:
+                    self.tags.setdefault(child.type.decode("latin-1"), value)
+
+    def read_items(self, ilst: Box, keys: list[str]) -> None:
+        for item in _boxes(self.handle, ilst.start, ilst.end):
+            # Items are named by their index in the keys box, or by a four
+            # character code in iTunes style metadata.
+            (index,) = struct.unpack(">I", item.type)
+            key = keys[index - 1] if 0 < index <= len(keys) else item.type.decode("latin-1")
+            value = _data_value(self.handle, item)
+            if value is not None:
+                self.tags.setdefault(key, value)
+
+
+def read_video_tags(handle: BinaryIO, file_size: int) -> Optional[VideoTags]:
+    """Creation time, make and model from the moov box of an MP4 or QuickTime file.
+
+    The top level boxes are walked by their headers alone, so only a few KB
+    are read wherever moov is in the file. The QuickTime creation date is
+    preferred, as it is the local time on the camera's clock, then the
+    mvhd creation time. A creation time of 0 means the camera did not set
+    one. Returns None when the file has no moov box.
+    """
+    for box in _boxes(handle, 0, file_size):
+        if box.type == b"moov":
+            reader = _TagReader(handle, {})
+            reader.walk(box)
+            tags = reader.tags
+            creation_time = next(
+                (date for key in CREATION_DATE_KEYS if key in tags and (date := _parse_date(tags[key])) is not None),
+                reader.creation_time,
+            )
+            return VideoTags(
+                creation_time=creation_time,
+                make=next((tags[key] for key in MAKE_KEYS if key in tags), None),
+                model=next((tags[key] for key in MODEL_KEYS if key in tags), None),
+            )
+    return None
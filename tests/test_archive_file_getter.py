@@ -0,0 +1,70 @@
+import gc
+import io
+import tarfile
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from camera_transfer.archive_file_getter import ArchiveFileGetter
+
+MEMBERS = {
+    "DCIM/100NIKON/DSCN0002.JPG": b"second image" * 1000,
+    "DCIM/100NIKON/dscn0001.jpg": b"first image",
+    "DCIM/100NIKON/._DSCN0002.JPG": b"apple double",
+    "DCIM/100NIKON/DSCN0003.NEF": b"raw",
+    "DCIM/101NIKON/DSCN0004.Mp4": b"video",
+    ".Trashes/501/DSCN0009.JPG": b"deleted",
+}
+MODIFIED = datetime(2022, 7, 14, 10, 30, 0)
+WANTED = ["DCIM/100NIKON/DSCN0002.JPG", "DCIM/100NIKON/dscn0001.jpg", "DCIM/101NIKON/DSCN0004.Mp4"]
+
+
+def make_zip(path: Path) -> Path:
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, content in MEMBERS.items():
+            archive.writestr(zipfile.ZipInfo(name, MODIFIED.timetuple()[:6]), content, zipfile.ZIP_DEFLATED)
+    return path
+
+
+def make_tar(path: Path) -> Path:
+    with tarfile.open(path, "w:gz" if path.suffix == ".gz" else "w") as archive:
+        for name, content in MEMBERS.items():
+            info = tarfile.TarInfo(f"./{name}")
+            info.size = len(content)
+            info.mtime = int(MODIFIED.timestamp())
+            archive.addfile(info, io.BytesIO(content))
+    return path
+
+
+@pytest.fixture(params=["card.zip", "card.tar", "card.tar.gz"])
+def archive(request: pytest.FixtureRequest, tmp_path: Path) -> Path:
+    name: str = request.param
+    if name.endswith(".zip"):
+        return make_zip(tmp_path / name)
+    return make_tar(tmp_path / name)
+
+
+def test_members_are_filtered_and_read_in_place(archive: Path, tmp_path: Path) -> None:
+    spool_folder = tmp_path / "spool"
+    spool_folder.mkdir()
+    file_getter = ArchiveFileGetter(location=archive, file_extensions={".JPG", ".MP4"}, spool_folder=spool_folder)
+
+    files = list(file_getter.get_next_file())
+    assert [file.fingerprint.path for file in files if file.fingerprint] == WANTED
+    for file, name in zip(files, WANTED):
+        assert file.file_name == Path(name).name
+        assert file.file_size == len(MEMBERS[name])
+        assert file.file_last_modified == MODIFIED
+        assert file.file_path is None
+        with file.open_file() as content:
+            content.seek(-5, io.SEEK_END)
+            assert content.read() == MEMBERS[name][-5:]
+            content.seek(0)
+            assert content.read() == MEMBERS[name]
+
+    del files, file
+    gc.collect()
+    assert list(spool_folder.iterdir()) == []
+
@@ -1,14 +1,32 @@
+import errno
+import io
+import json
 import logging
 import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import tarfile
+import zipfile
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 import platformdirs
 
 import pytest
-from typing import Any
+from typing import Any, BinaryIO, Iterator
 
 from camera_transfer import app
+from camera_transfer.archive_file_getter import ArchiveFileGetter
+from camera_transfer.camera_file import PARTIAL_HASH_SIZE, CameraFile
 from camera_transfer.camera_settings import CameraSettings
+from camera_transfer.camera_transfer import CameraTransfer
+from camera_transfer import camera_settings, library_rehash, os_output_file_writer
+from camera_transfer.hash_store import HashStore
+from camera_transfer.os_output_file_writer import OSStagedFile
+from camera_transfer.transfer_plan import PlanFileGetter, PlannedFile, TransferPlan, TransferPlanner
 
 logger = logging.getLogger(__name__)
 
@@ -77,6 +95,24 @@ def test_new_settings_file(tmp_path: Path) -> None:
     assert app.load_settings_from_file(tmp_path / "settings.env")
 
 
+def test_settings_snapshot(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    settings_file = tmp_path / "settings.env"
+    settings_file.write_text((Path(__file__).parent / "test.env").read_text())
+    snapshot_file = tmp_path / "cache" / "settings.json"
+    settings = app.load_settings_from_file(settings_file, snapshot_file)
+    assert snapshot_file.exists()
+
+    def not_expected(settings_file: Path) -> CameraSettings:
+        raise AssertionError("settings.env was read again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(camera_settings, "read_settings_file", not_expected)
+        assert app.load_settings_from_file(settings_file, snapshot_file).model_dump() == settings.model_dump()
+
+    settings_file.write_text(settings_file.read_text().replace('CT_LOG_LEVEL="DEBUG"', 'CT_LOG_LEVEL="INFO"'))
+    assert app.load_settings_from_file(settings_file, snapshot_file).log_level == "INFO"
+
+
 
 def test_camera_transfer(single_image_test_settings: CameraSettings) -> None:
     camera_transfer = app.get_camera_transfer_operation(single_image_test_settings)
@@ -189,6 +225,21 @@ def test_all_files_transfer(all_files_test_settings: CameraSettings) -> None:
     assert len(list(all_files_test_settings.main_videos_folder.glob("**/*.mp4"))) == 1
 
 
+def test_transfer_fills_catalog(all_files_test_settings: CameraSettings) -> None:
+    app.get_camera_transfer_operation(all_files_test_settings).run()
+
+    [image] = app.query_library(all_files_test_settings, camera_model="S9700")
+    assert image.category == "image"
+    assert image.camera_model == "COOLPIX S9700"
+    assert image.captured_at is not None
+    assert image.source is not None and image.source.endswith(".JPG")
+    assert image.import_run is not None
+    [video] = app.query_library(all_files_test_settings, category="video")
+    assert video.camera_model is None
+    assert app.query_library(all_files_test_settings, hash_hex=image.hash.hex()) == [image]
+    year = image.captured_at.strftime("%Y")
+    assert image in app.query_library(all_files_test_settings, captured_from=app.date_range(year), captured_to=app.date_range(year))
+
 def test_all_files_transfer_dry_run(all_files_test_settings: CameraSettings) -> None:
     all_files_test_settings.dry_run = True
     camera_transfer = app.get_camera_transfer_operation(all_files_test_settings)
@@ -214,3 +265,559 @@ def test_user_friendly_invalid_camera_folder(tmp_path: Path) -> None:
     assert "The folder /invalid/folder/path does not exist. Please check that the SD card is properly inserted." in str(excinfo.value)
 
 
+
+def test_duplicate_leaves_no_partial_files(duplicate_image_test_settings: CameraSettings) -> None:
+    camera_transfer = app.get_camera_transfer_operation(duplicate_image_test_settings)
+    camera_transfer.run()
+
+    output_folder = (
+        Path(duplicate_image_test_settings.main_photos_folder)
+        / datetime.now().strftime("%Y")
+        / datetime.now().strftime("%m - %B")
+    )
+    assert [p.name for p in output_folder.iterdir()] == ["2022-07-27T115409_S9700_6228.JPG"]
+
+
+@pytest.mark.parametrize("max_in_flight_bytes", [1, 1024 * 1024 * 1024])
+def test_concurrent_transfer_matches_serial(all_files_test_settings: CameraSettings, max_in_flight_bytes: int) -> None:
+    all_files_test_settings.jobs = 4
+    camera_transfer = app.get_camera_transfer_operation(all_files_test_settings)
+    camera_transfer.max_in_flight_bytes = max_in_flight_bytes
+    camera_transfer.run()
+
+    assert [p.name for p in all_files_test_settings.main_photos_folder.glob("**/*.JPG")] == [
+        "2022-07-27T115409_S9700_6228.JPG"
+    ]
+    assert len(list(all_files_test_settings.main_videos_folder.glob("**/*.mp4"))) == 1
+    assert len(list(all_files_test_settings.main_photos_folder.glob("**/*.part"))) == 0
+
+
+def test_reimport_skips_reading_known_files(all_files_test_settings: CameraSettings) -> None:
+    app.get_camera_transfer_operation(all_files_test_settings).run()
+
+    def unreadable() -> BinaryIO:
+        raise AssertionError("a previously imported file was read again")
+
+    camera_transfer = app.get_camera_transfer_operation(all_files_test_settings)
+    camera_files = list(camera_transfer.camera_file_getter.get_next_file())
+    assert len(camera_files) == 6
+    for camera_file in camera_files:
+        camera_file.open_file = unreadable
+        camera_transfer.process_camera_file(camera_file)
+
+
+def test_camera_file_is_read_once(single_image_test_settings: CameraSettings) -> None:
+    camera_transfer = app.get_camera_transfer_operation(single_image_test_settings)
+    [camera_file] = camera_transfer.camera_file_getter.get_next_file()
+    assert not hasattr(camera_file, "__dict__")
+    assert camera_file.file_path == Path(single_image_test_settings.camera_folder, "DSCN6228.JPG").resolve()
+
+    opened = []
+    open_file = camera_file.open_file
+
+    def counting_open_file() -> BinaryIO:
+        opened.append(1)
+        return open_file()
+
+    camera_file.open_file = counting_open_file
+    camera_transfer.process_camera_file(camera_file)
+    assert camera_file.generate_new_file_name() == "2022-07-27T115409_S9700_6228.JPG"
+    assert camera_file.file_hash() == camera_file.file_hash()
+    assert len(opened) == 1
+
+
+def test_metrics_summary(duplicate_image_test_settings: CameraSettings, tmp_path: Path) -> None:
+    duplicate_image_test_settings.metrics_json = tmp_path / "metrics.json"
+    camera_transfer = app.get_camera_transfer_operation(duplicate_image_test_settings)
+    camera_transfer.run()
+    camera_transfer.metrics.write_json(tmp_path / "metrics.json")
+
+    metrics = json.loads((tmp_path / "metrics.json").read_text())
+    assert metrics["counters"]["copied"] == 1
+    assert metrics["counters"]["duplicate"] == 1
+    # The duplicate is caught by the prefilter: both ends, then the whole file.
+    assert metrics["counters"]["bytes_read"] == 2 * 3560217 + 2 * PARTIAL_HASH_SIZE
+    assert metrics["stages"]["read+hash"]["count"] == 3
+    assert metrics["stages"]["insert"]["count"] == 2
+    app.print_summary(camera_transfer.metrics)
+
+
+def test_metrics_timings_are_off_by_default(single_image_test_settings: CameraSettings) -> None:
+    camera_transfer = app.get_camera_transfer_operation(single_image_test_settings)
+    camera_transfer.run()
+    assert camera_transfer.metrics.counters["copied"] == 1
+    assert camera_transfer.metrics.stages == {}
+
+
+INTERRUPTED_RUN = """
+import os, sys
+from camera_transfer import app
+from camera_transfer.camera_settings import CameraSettings
+
+interrupted = app.get_camera_transfer_operation(CameraSettings.model_validate_json(sys.argv[1]))
+camera_files = list(interrupted.camera_file_getter.get_next_file())
+interrupted.process_camera_file(camera_files[0])
+partial = interrupted.staging_area(camera_files[1])
+partial.write(b"partial")
+print(camera_files[0].file_path)
+print(partial.temp_location, flush=True)
+# Killed: nothing pending in the hash store is flushed.
+os._exit(0)
+"""
+
+
+def test_interrupted_run_is_recovered(all_files_test_settings: CameraSettings) -> None:
+    # Copy one file and leave another half way through in a process that
+    # then dies, so the first file is only known from its journal entry.
+    all_files_test_settings.hash_store_batch_size = 1000
+    all_files_test_settings.hash_store_flush_seconds = 3600
+    completed = subprocess.run(
+        [sys.executable, "-c", INTERRUPTED_RUN, all_files_test_settings.model_dump_json()],
+        check=True, capture_output=True, text=True,
+    )
+    copied_path, temp_location = completed.stdout.splitlines()
+    assert Path(temp_location).exists()
+
+    def unreadable() -> BinaryIO:
+        raise AssertionError("a recovered file was read again")
+
+    resumed = app.get_camera_transfer_operation(all_files_test_settings)
+    resumed.recover()
+    assert not Path(temp_location).exists()
+
+    [recovered_file] = [
+        camera_file for camera_file in resumed.camera_file_getter.get_next_file()
+        if str(camera_file.file_path) == copied_path
+    ]
+    assert resumed.hash_store.has_partial_hash(recovered_file.file_size, recovered_file.partial_hash())
+    [library_file] = app.query_library(all_files_test_settings)
+    assert library_file.size == recovered_file.file_size and library_file.source == copied_path
+    recovered_file.open_file = unreadable
+    resumed.process_camera_file(recovered_file)
+    assert resumed.metrics.counters["previously_imported"] == 1
+
+
+def test_recover_leaves_copies_of_a_running_import(all_files_test_settings: CameraSettings, tmp_path: Path) -> None:
+    temp_file = tmp_path / ".camera-transfer-running.part"
+    temp_file.write_bytes(b"in flight")
+    running = app.hash_store(all_files_test_settings)
+    running.journal_staging(str(temp_file), "card")
+
+    app.get_camera_transfer_operation(all_files_test_settings).recover()
+    assert temp_file.exists()
+
+    running.close()
+    app.get_camera_transfer_operation(all_files_test_settings).recover()
+    assert not temp_file.exists()
+
+
+@pytest.mark.parametrize("durability", ["none", "file", "directory"])
+def test_durability_policies(all_files_test_settings: CameraSettings, durability: str) -> None:
+    all_files_test_settings.durability = durability  # type: ignore[assignment]
+    camera_transfer = app.get_camera_transfer_operation(all_files_test_settings)
+    camera_transfer.run()
+    assert camera_transfer.metrics.counters["copied"] == 2
+
+
+def test_files_reach_the_disk_before_the_hash_store_records_them(
+    single_image_test_settings: CameraSettings, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    single_image_test_settings.durability = "directory"
+    single_image_test_settings.hash_store_batch_size = 1
+    single_image_test_settings.sqlite_database = tmp_path / "test.db"
+    events: list[str] = []
+    monkeypatch.setattr(os_output_file_writer, "fsync_path", lambda path: events.append(f"fsync {Path(path).name}"))
+    transaction = HashStore.transaction
+
+    @contextmanager
+    def recording_transaction(self: HashStore) -> Iterator[Any]:
+        # Migrations run in a transaction before there is anything pending.
+        if getattr(self, "_pending_hashes", None):
+            events.append("commit hash")
+        with transaction(self) as connection:
+            yield connection
+
+    monkeypatch.setattr(HashStore, "transaction", recording_transaction)
+    camera_transfer = app.get_camera_transfer_operation(single_image_test_settings)
+    camera_transfer.run()
+
+    assert events.index("fsync 2022-07-27T115409_S9700_6228.JPG") < events.index("commit hash")
+
+
+def test_commits_run_alongside_each_other(base_test_settings: CameraSettings, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    card = tmp_path / "card"
+    card.mkdir()
+    dcim = Path(__file__).parent / "DCIM"
+    shutil.copy2(dcim / "single_image/DSCN6228.JPG", card)
+    shutil.copy2(dcim / "single_video/blank_video.mp4", card)
+    (tmp_path / "library").mkdir()
+    base_test_settings.camera_folder = card
+    base_test_settings.main_photos_folder = tmp_path / "library"
+    base_test_settings.jobs = 2
+    # Each commit waits for the other, so this only finishes if they overlap.
+    both_committing = threading.Barrier(2, timeout=10)
+    commit = OSStagedFile.commit
+
+    def waiting_commit(self: OSStagedFile, file_name: str, file_last_modified: datetime) -> None:
+        both_committing.wait()
+        commit(self, file_name, file_last_modified)
+
+    monkeypatch.setattr(OSStagedFile, "commit", waiting_commit)
+    checked_on: list[str] = []
+    known_duplicate = CameraTransfer.known_duplicate
+
+    def recording_known_duplicate(self: CameraTransfer, camera_file: CameraFile) -> bool:
+        checked_on.append(threading.current_thread().name)
+        return known_duplicate(self, camera_file)
+
+    monkeypatch.setattr(CameraTransfer, "known_duplicate", recording_known_duplicate)
+    camera_transfer = app.get_camera_transfer_operation(base_test_settings)
+    camera_transfer.run()
+
+    assert camera_transfer.metrics.counters["copied"] == 2
+    # Files are checked for duplicates, which can mean hashing them, by the readers.
+    assert len(checked_on) == 2 and all(name.startswith("ct-read") for name in checked_on)
+
+
+def test_multiple_cards_share_one_library(all_files_test_settings: CameraSettings) -> None:
+    dcim = Path(__file__).parent / "DCIM"
+    all_files_test_settings.camera_folders = [dcim / "single_image", dcim / "duplicate_image", dcim / "single_video"]
+    all_files_test_settings.jobs = 2
+    multi_transfer = app.get_multi_camera_transfer_operation(all_files_test_settings)
+    # The test cards share a device; give each its own thread as if they were separate readers.
+    multi_transfer.device_transfers = [[t] for transfers in multi_transfer.device_transfers for t in transfers]
+    multi_transfer.run()
+
+    assert [p.name for p in all_files_test_settings.main_photos_folder.glob("**/*.JPG")] == [
+        "2022-07-27T115409_S9700_6228.JPG"
+    ]
+    assert len(list(all_files_test_settings.main_videos_folder.glob("**/*.mp4"))) == 1
+    assert len(list(all_files_test_settings.main_photos_folder.glob("**/*.part"))) == 0
+    assert multi_transfer.metrics.counters["copied"] == 2
+    assert multi_transfer.metrics.counters["duplicate"] == 2
+
+
+def test_cards_commit_alongside_each_other(all_files_test_settings: CameraSettings, monkeypatch: pytest.MonkeyPatch) -> None:
+    dcim = Path(__file__).parent / "DCIM"
+    all_files_test_settings.camera_folders = [dcim / "single_image", dcim / "single_video"]
+    # Each card's commit waits for the other's, so this only finishes if they overlap.
+    both_committing = threading.Barrier(2, timeout=10)
+    commit = OSStagedFile.commit
+
+    def waiting_commit(self: OSStagedFile, file_name: str, file_last_modified: datetime) -> None:
+        both_committing.wait()
+        commit(self, file_name, file_last_modified)
+
+    monkeypatch.setattr(OSStagedFile, "commit", waiting_commit)
+    multi_transfer = app.get_multi_camera_transfer_operation(all_files_test_settings)
+    multi_transfer.device_transfers = [[t] for transfers in multi_transfer.device_transfers for t in transfers]
+    multi_transfer.run()
+
+    assert multi_transfer.metrics.counters["copied"] == 2
+
+
+def test_partial_hash_prefilter(base_test_settings: CameraSettings, tmp_path: Path) -> None:
+    card = tmp_path / "card"
+    card.mkdir()
+    content = os.urandom(4 * PARTIAL_HASH_SIZE)
+    # Same size and ends as the original but a different middle.
+    lookalike = content[:2 * PARTIAL_HASH_SIZE] + bytes(PARTIAL_HASH_SIZE) + content[3 * PARTIAL_HASH_SIZE:]
+    for name, data, mtime in [("a.mp4", content, 1_600_000_000), ("b.mp4", content, 1_600_000_100), ("c.mp4", lookalike, 1_600_000_200)]:
+        (card / name).write_bytes(data)
+        os.utime(card / name, (mtime, mtime))
+    base_test_settings.camera_folder = card
+    (tmp_path / "library").mkdir()
+    base_test_settings.main_photos_folder = tmp_path / "library"
+
+    camera_transfer = app.get_camera_transfer_operation(base_test_settings)
+    staged = []
+    stage_file = camera_transfer.output_file_writer.stage_file
+    def tracking_stage_file(*args: Any) -> Any:
+        staged.append(args)
+        return stage_file(*args)
+    camera_transfer.output_file_writer.stage_file = tracking_stage_file  # type: ignore[method-assign,assignment]
+    camera_transfer.run()
+
+    assert camera_transfer.metrics.counters["copied"] == 2
+    assert camera_transfer.metrics.counters["duplicate"] == 1
+    # The duplicate was recognised without being written anywhere.
+    assert len(staged) == 2
+    assert len(list((tmp_path / "library").glob("**/*.mp4"))) == 2
+
+
+@pytest.mark.parametrize("copy_strategy", ["stream", "copy_file_range", "reflink", "hardlink"])
+def test_copy_strategies(base_test_settings: CameraSettings, tmp_path: Path, copy_strategy: str) -> None:
+    # A card dump on the same filesystem as the library.
+    card = tmp_path / "card"
+    card.mkdir()
+    for source in [Path(__file__).parent / "DCIM/single_image/DSCN6228.JPG", Path(__file__).parent / "DCIM/single_video/blank_video.mp4"]:
+        (card / source.name).write_bytes(source.read_bytes())
+        os.utime(card / source.name, (1_600_000_000.5, 1_600_000_000.5))
+    (tmp_path / "library").mkdir()
+    base_test_settings.camera_folder = card
+    base_test_settings.main_photos_folder = tmp_path / "library"
+    base_test_settings.copy_strategy = copy_strategy  # type: ignore[assignment]
+
+    camera_transfer = app.get_camera_transfer_operation(base_test_settings)
+    camera_transfer.run()
+
+    assert camera_transfer.metrics.counters["copied"] == 2
+    copies = {p.suffix: p for p in (tmp_path / "library").glob("**/*.*")}
+    for source, copy in [(card / "DSCN6228.JPG", copies[".JPG"]), (card / "blank_video.mp4", copies[".mp4"])]:
+        assert copy.read_bytes() == source.read_bytes()
+        assert copy.stat().st_mtime == 1_600_000_000.5
+        assert copy.samefile(source) == (copy_strategy == "hardlink")
+    assert len(list((tmp_path / "library").glob("**/*.part"))) == 0
+
+
+def test_copy_strategy_falls_back_to_streaming(all_files_test_settings: CameraSettings, monkeypatch: pytest.MonkeyPatch) -> None:
+    def unsupported(*args: Any) -> int:
+        raise OSError(errno.EXDEV, "cross-device copy")
+
+    monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+    monkeypatch.setattr(os, "sendfile", unsupported)
+    monkeypatch.setattr(os, "link", unsupported)
+    all_files_test_settings.copy_strategy = "hardlink"
+    camera_transfer = app.get_camera_transfer_operation(all_files_test_settings)
+    camera_transfer.run()
+
+    [image] = all_files_test_settings.main_photos_folder.glob("**/*.JPG")
+    assert image.read_bytes() == (Path(__file__).parent / "DCIM/single_image/DSCN6228.JPG").read_bytes()
+    assert len(list(all_files_test_settings.main_photos_folder.glob("**/*.part"))) == 0
+
+
+def test_rehash_skips_unreadable_files_and_stops(all_files_test_settings: CameraSettings, monkeypatch: pytest.MonkeyPatch) -> None:
+    app.get_camera_transfer_operation(all_files_test_settings).run()
+    all_files_test_settings.hash_algorithm = "blake2b"
+    store = app.hash_store(all_files_test_settings)
+
+    rehash = app.library_rehash(all_files_test_settings, store)
+    rehash.stop.set()
+    assert rehash.run() == 0
+
+    def unreadable(*args: Any) -> dict[str, bytes]:
+        raise PermissionError(errno.EACCES, "Permission denied")
+
+    monkeypatch.setattr(library_rehash, "file_digests", unreadable)
+    assert app.library_rehash(all_files_test_settings, store).run() == 0
+    assert store.algorithms() == ("blake2b", "sha256")
+    monkeypatch.undo()
+    assert app.library_rehash(all_files_test_settings, store).run() == 2
+    assert store.algorithms() == ("blake2b",)
+
+
+def test_hash_algorithm_change_keeps_history(all_files_test_settings: CameraSettings) -> None:
+    app.get_camera_transfer_operation(all_files_test_settings).run()
+
+    # A copy of an imported photo on another card is still a duplicate after
+    # switching algorithm, and its stored hash moves to the new algorithm.
+    all_files_test_settings.hash_algorithm = "blake2b"
+    all_files_test_settings.camera_folder = Path(__file__).parent / "DCIM/duplicate_image"
+    camera_transfer = app.get_camera_transfer_operation(all_files_test_settings)
+    assert camera_transfer.hash_store.algorithms() == ("blake2b", "sha256")
+    camera_transfer.run()
+    assert camera_transfer.metrics.counters["copied"] == 0
+    assert camera_transfer.metrics.counters["duplicate"] == 2
+
+    # The video is only in the library, so the background rehash picks it up.
+    rehash = app.library_rehash(all_files_test_settings, camera_transfer.hash_store)
+    assert rehash.run() == 1
+    assert camera_transfer.hash_store.algorithms() == ("blake2b",)
+
+    all_files_test_settings.camera_folder = Path(__file__).parent / "DCIM"
+    camera_transfer = app.get_camera_transfer_operation(all_files_test_settings)
+    camera_transfer.run()
+    assert camera_transfer.metrics.counters["copied"] == 0
+
+
+def test_seed_library(all_files_test_settings: CameraSettings, tmp_path: Path) -> None:
+    library = tmp_path / "library"
+    (library / "2020" / "01 - January").mkdir(parents=True)
+    for source in [Path(__file__).parent / "DCIM/single_image/DSCN6228.JPG", Path(__file__).parent / "DCIM/single_video/blank_video.mp4"]:
+        (library / "2020" / "01 - January" / source.name).write_bytes(source.read_bytes())
+    (library / "notes.txt").write_text("not a photo")
+    all_files_test_settings.main_photos_folder = library
+    all_files_test_settings.main_videos_folder = library
+
+    counts = app.seed_library(all_files_test_settings, processes=2)
+    assert (counts.hashed, counts.unchanged) == (2, 0)
+
+    camera_transfer = app.get_camera_transfer_operation(all_files_test_settings)
+    camera_transfer.run()
+    assert camera_transfer.metrics.counters["copied"] == 0
+
+    # Only what changed since the last seed is hashed again.
+    (library / "2020" / "01 - January" / "DSCN6228.JPG").unlink()
+    with open(library / "2020" / "01 - January" / "blank_video.mp4", "ab") as video:
+        video.write(b"edited")
+    counts = app.seed_library(all_files_test_settings, processes=2)
+    assert (counts.hashed, counts.unchanged, counts.removed) == (1, 0, 1)
+    counts = app.seed_library(all_files_test_settings, processes=2)
+    assert (counts.hashed, counts.unchanged, counts.removed) == (0, 1, 0)
+
+
+def test_seed_walks_a_nested_library_folder_once(all_files_test_settings: CameraSettings, tmp_path: Path) -> None:
+    library = tmp_path / "library"
+    (library / "videos").mkdir(parents=True)
+    shutil.copy2(Path(__file__).parent / "DCIM/single_image/DSCN6228.JPG", library)
+    shutil.copy2(Path(__file__).parent / "DCIM/single_video/blank_video.mp4", library / "videos")
+    all_files_test_settings.main_photos_folder = library
+    all_files_test_settings.main_videos_folder = library / "videos"
+
+    counts = app.seed_library(all_files_test_settings, processes=1)
+    assert (counts.hashed, counts.unchanged) == (2, 0)
+    counts = app.seed_library(all_files_test_settings, processes=1)
+    assert (counts.hashed, counts.unchanged, counts.removed) == (0, 2, 0)
+
+
+def test_verify_library(all_files_test_settings: CameraSettings) -> None:
+    all_files_test_settings.verify_after_write = True
+    app.get_camera_transfer_operation(all_files_test_settings).run()
+    [image] = all_files_test_settings.main_photos_folder.glob("**/*.JPG")
+    [video] = all_files_test_settings.main_photos_folder.glob("**/*.mp4")
+
+    # A tiny slice still checks one file per run, least recently verified first.
+    all_files_test_settings.verify_cycle_days = 1_000_000
+    first = app.verify_library(all_files_test_settings)
+    second = app.verify_library(all_files_test_settings)
+    assert first.verified == second.verified == 1
+    assert first.bytes_verified != second.bytes_verified
+
+    # Flip a byte without changing the size or the modification time.
+    stat = image.stat()
+    content = bytearray(image.read_bytes())
+    content[len(content) // 2] ^= 0xFF
+    image.write_bytes(content)
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    video.unlink()
+
+    all_files_test_settings.verify_cycle_days = 1
+    report = app.verify_library(all_files_test_settings)
+    assert report.corrupt == [str(image.resolve())]
+    assert report.missing == [str(video.resolve())]
+    assert not report.ok
+
+
+def test_verify_moves_past_a_missing_file(all_files_test_settings: CameraSettings) -> None:
+    app.get_camera_transfer_operation(all_files_test_settings).run()
+    [video] = all_files_test_settings.main_photos_folder.glob("**/*.mp4")
+    video.unlink()
+
+    # A budget of one file a run.
+    all_files_test_settings.verify_cycle_days = 1_000_000
+    reports = [app.verify_library(all_files_test_settings) for _ in range(3)]
+    missing_run = next(run for run, report in enumerate(reports) if report.missing == [str(video.resolve())])
+    # The run after the one that found the file missing checks the image instead.
+    after = reports[missing_run + 1]
+    assert after.missing == [] and after.verified == 1
+
+
+def test_read_back_mismatch_is_not_committed(single_image_test_settings: CameraSettings, monkeypatch: pytest.MonkeyPatch) -> None:
+    single_image_test_settings.verify_after_write = True
+    monkeypatch.setattr(OSStagedFile, "open_written", lambda self: io.BytesIO(b"damaged on the way"))
+    camera_transfer = app.get_camera_transfer_operation(single_image_test_settings)
+    with pytest.raises(IOError, match="when read back"):
+        camera_transfer.run()
+    assert list(single_image_test_settings.main_photos_folder.glob("**/*.*")) == []
+    assert camera_transfer.metrics.counters["failed"] == 1
+
+
+def test_clashing_name_is_numbered(single_image_test_settings: CameraSettings) -> None:
+    camera_transfer = app.get_camera_transfer_operation(single_image_test_settings)
+    folder = single_image_test_settings.main_photos_folder / camera_transfer.sub_folder
+    folder.mkdir(parents=True)
+    (folder / "2022-07-27T115409_S9700_6228.JPG").write_bytes(b"another camera's photo")
+
+    camera_transfer.run()
+
+    assert (folder / "2022-07-27T115409_S9700_6228.JPG").read_bytes() == b"another camera's photo"
+    assert (folder / "2022-07-27T115409_S9700_6228-1.JPG").stat().st_size == 3560217
+    assert camera_transfer.metrics.counters["copied"] == 1
+
+
+def test_transfer_from_zip(base_test_settings: CameraSettings, tmp_path: Path) -> None:
+    card = tmp_path / "card.zip"
+    with zipfile.ZipFile(card, "w") as archive:
+        for source in (Path(__file__).parent / "DCIM/duplicate_image").iterdir():
+            archive.write(source, f"DCIM/100NIKON/{source.name}")
+    (tmp_path / "library").mkdir()
+    base_test_settings.main_photos_folder = tmp_path / "library"
+
+    camera_transfer = app.get_camera_transfer_operation(base_test_settings, card)
+    camera_transfer.run()
+
+    assert camera_transfer.metrics.counters["copied"] == 1
+    assert camera_transfer.metrics.counters["duplicate"] == 1
+
+
+def test_compressed_tar_is_spooled_next_to_the_library(base_test_settings: CameraSettings, tmp_path: Path) -> None:
+    card = tmp_path / "card.tar.gz"
+    with tarfile.open(card, "w:gz") as archive:
+        archive.add(Path(__file__).parent / "DCIM/single_image/DSCN6228.JPG", "DCIM/100NIKON/DSCN6228.JPG")
+    (tmp_path / "library").mkdir()
+    base_test_settings.main_photos_folder = tmp_path / "library"
+
+    file_getter = app.file_getter(base_test_settings, card)
+    assert isinstance(file_getter, ArchiveFileGetter)
+    assert file_getter.spool_folder == tmp_path / "library"
+    camera_transfer = app.get_camera_transfer_operation(base_test_settings, card)
+    camera_transfer.run()
+    assert camera_transfer.metrics.counters["copied"] == 1
+
+
+def test_plan_of_a_compressed_tar_is_spooled_next_to_the_library(base_test_settings: CameraSettings, tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    card = tmp_path / "card.tar.gz"
+    with tarfile.open(card, "w:gz") as archive:
+        for number in range(10):
+            archive.add(Path(__file__).parent / "DCIM/single_image/DSCN6228.JPG", f"DCIM/100NIKON/DSCN{number:04}.JPG")
+    library = tmp_path / "library"
+    library.mkdir()
+    base_test_settings.main_photos_folder = library
+    base_test_settings.camera_folders = [card]
+    spooled: list[int] = []
+    plan_file = TransferPlanner.plan_file
+
+    def slow_plan_file(self: TransferPlanner, camera_file: CameraFile) -> PlannedFile:
+        time.sleep(0.05)
+        spooled.append(len(list(library.glob(".camera-transfer-*.spool"))))
+        return plan_file(self, camera_file)
+
+    with monkeypatch.context() as patch:
+        patch.setattr(TransferPlanner, "plan_file", slow_plan_file)
+        plan = app.plan_transfer(base_test_settings)
+    # Listed no more than 2 * jobs files ahead of the one being planned.
+    assert len(plan.files) == 10 and 0 < max(spooled) <= 3
+
+    file_getter = app.camera_file_getter(base_test_settings, card, plan=plan).file_getter
+    assert isinstance(file_getter, PlanFileGetter)
+    assert file_getter.spool_folder == library
+
+
+def test_plan_and_execute(duplicate_image_test_settings: CameraSettings, tmp_path: Path) -> None:
+    settings = duplicate_image_test_settings
+    (tmp_path / "library").mkdir()
+    settings.main_photos_folder = tmp_path / "library"
+    settings.sqlite_database = tmp_path / "test.db"
+
+    plan = app.plan_transfer(settings)
+    assert [planned_file.action for planned_file in plan.files] == ["copy", "copy"]
+    assert [planned_file.collides for planned_file in plan.files] == [False, False]
+    # The two files are copies of each other, so the second is the same size as the first.
+    assert [planned_file.possible_duplicate for planned_file in plan.files] == [False, True]
+    destination = plan.files[0].destination
+    assert destination is not None and not Path(destination).exists()
+    Path(destination).parent.mkdir(parents=True)
+    Path(destination).touch()
+    assert [planned_file.collides for planned_file in app.plan_transfer(settings).files] == [True, False]
+    Path(destination).unlink()
+
+    plan.write(tmp_path / "plan.json")
+    replayed = TransferPlan.read(tmp_path / "plan.json")
+    assert replayed == plan
+    camera_transfer = app.get_camera_transfer_operation(settings, Path(replayed.cards[0]), replayed)
+    camera_transfer.run()
+
+    assert Path(destination).exists()
+    assert camera_transfer.metrics.counters["copied"] == 1
+    assert camera_transfer.metrics.counters["duplicate"] == 1
+    assert [planned_file.action for planned_file in app.plan_transfer(settings).files] == ["previously_imported"] * 2
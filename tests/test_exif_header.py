@@ -0,0 +1,37 @@
+import struct
+from pathlib import Path
+
+from camera_transfer.exif_header import HEADER_SIZE, ExifTags, parse_exif_header
+
+IMAGE_FILE = Path(__file__).parent / "DCIM/single_image/DSCN6228.JPG"
+
+
+def little_endian_jpeg(model: bytes, datetime: bytes) -> bytes:
+    data_offset = 8 + 2 + 2 * 12 + 4
+    entries = [(0x0110, 2, len(model), data_offset), (0x0132, 2, len(datetime), data_offset + len(model))]
+    ifd = struct.pack("<H", len(entries))
+    ifd += b"".join(struct.pack("<HHII", *entry) for entry in entries)
+    ifd += struct.pack("<I", 0)
+    tiff = b"II" + struct.pack("<HI", 42, 8) + ifd + model + datetime
+    app1 = b"Exif\x00\x00" + tiff
+    return b"\xff\xd8\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1 + b"\xff\xda"
+
+
+def test_parse_camera_image_header() -> None:
+    tags = parse_exif_header(IMAGE_FILE.read_bytes()[:HEADER_SIZE])
+    assert tags == ExifTags(
+        model="COOLPIX S9700  ",
+        datetime="2022:07:27 11:54:09",
+        datetime_original="2022:07:27 11:54:09",
+    )
+
+
+def test_parse_little_endian_header() -> None:
+    tags = parse_exif_header(little_endian_jpeg(b"TFY-LX1\x00", b"2023:01:02 03:04:05\x00"))
+    assert tags == ExifTags(model="TFY-LX1", datetime="2023:01:02 03:04:05")
+
+
+def test_truncated_or_foreign_data_is_rejected() -> None:
+    assert parse_exif_header(IMAGE_FILE.read_bytes()[:1000]) is None
+    assert parse_exif_header(b"\x89PNG\r\n\x1a\n") is None
+    assert parse_exif_header(b"") is None
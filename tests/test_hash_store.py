@@ -0,0 +1,94 @@
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+from camera_transfer.camera_file import Fingerprint
+from camera_transfer.hash_store import SCHEMA_VERSION, HashStore
+
+
+def stored_rows(database_file: Path) -> list[tuple[bytes, str]]:
+    with sqlite3.connect(database_file) as connection:
+        return connection.execute("SELECT hash, image_file FROM hash_store").fetchall()
+
+
+def test_batched_writes_are_visible_before_flush(tmp_path: Path) -> None:
+    database_file = tmp_path / "test.db"
+    with HashStore(database_file=database_file, batch_size=3, flush_interval=3600) as hash_store:
+        hash_store[b"\x01" * 32] = "one.jpg"
+        hash_store[b"\x02" * 32] = "two.jpg"
+        assert b"\x01" * 32 in hash_store
+        assert hash_store[b"\x02" * 32] == "two.jpg"
+        assert stored_rows(database_file) == []
+
+        hash_store[b"\x03" * 32] = "three.jpg"
+        assert len(stored_rows(database_file)) == 3
+
+        hash_store[b"\x04" * 32] = "four.jpg"
+    assert len(stored_rows(database_file)) == 4
+
+
+def test_pending_fingerprint_is_recognised(tmp_path: Path) -> None:
+    fingerprint = Fingerprint(path="DCIM/100NIKON/DSCN0001.JPG", size=10, mtime=1.0)
+    with HashStore(database_file=tmp_path / "test.db", batch_size=100, flush_interval=3600) as hash_store:
+        hash_store[b"\x01" * 32] = "one.jpg"
+        hash_store.add_fingerprint(fingerprint, b"\x01" * 32)
+        assert hash_store.has_fingerprint(fingerprint)
+
+
+def test_legacy_database_is_migrated(tmp_path: Path) -> None:
+    database_file = tmp_path / "legacy.db"
+    with sqlite3.connect(database_file) as connection:
+        connection.execute("CREATE TABLE hash_store (hash TEXT UNIQUE, image_file TEXT)")
+        connection.execute("INSERT INTO hash_store VALUES (?, ?)", (b"\xaa" * 32, "old.jpg"))
+    connection.close()
+
+    with HashStore(database_file=database_file) as hash_store:
+        assert b"\xaa" * 32 in hash_store
+        assert hash_store[b"\xaa" * 32] == "old.jpg"
+
+    with sqlite3.connect(database_file) as connection:
+        assert connection.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert connection.execute("SELECT typeof(hash) FROM hash_store").fetchone()[0] == "blob"
+    connection.close()
+
+
+def test_rehash_keeps_references(tmp_path: Path) -> None:
+    fingerprint = Fingerprint(path="DCIM/100NIKON/DSCN0001.JPG", size=10, mtime=1.0)
+    database_file = tmp_path / "test.db"
+    with HashStore(database_file=database_file) as hash_store:
+        hash_store[b"\x01" * 32] = "one.jpg"
+        hash_store.add_fingerprint(fingerprint, b"\x01" * 32)
+
+    with HashStore(database_file=database_file, algorithm="blake2b") as hash_store:
+        assert hash_store.algorithms() == ("blake2b", "sha256")
+        assert hash_store.legacy_hashes() == [(b"\x01" * 32, "one.jpg", "sha256")]
+        hash_store.rehash(b"\x01" * 32, b"\x02" * 64)
+        assert hash_store[b"\x02" * 64] == "one.jpg"
+        assert b"\x01" * 32 not in hash_store
+        assert hash_store.has_fingerprint(fingerprint)
+        assert hash_store.algorithms() == ("blake2b",)
+
+
+def test_query_library_by_date_model_and_content() -> None:
+    with HashStore() as hash_store:
+        run = hash_store.start_import_run("/media/card")
+        hash_store.add_library_file(
+            "/photos/a.jpg", 10, 1.0, b"\x01" * 32,
+            category="image", camera_model="COOLPIX S9700", captured_at=datetime(2022, 7, 14, 10, 30), import_run=run,
+        )
+        hash_store.add_library_file(
+            "/photos/b.jpg", 10, 1.0, b"\x01" * 32,
+            category="image", camera_model="TFY-LX1", captured_at=datetime(2022, 8, 1), import_run=run,
+        )
+        hash_store.add_library_file("/photos/c.mp4", 20, 1.0, b"\x02" * 32, category="video", captured_at=datetime(2022, 7, 1))
+        hash_store.add_library_file("/photos/seeded.jpg", 30, 1.0, b"\x03" * 32)
+
+        july = hash_store.query_library(captured_from=datetime(2022, 7, 1), captured_before=datetime(2022, 8, 1))
+        assert [library_file.path for library_file in july] == ["/photos/c.mp4", "/photos/a.jpg"]
+        [s9700] = hash_store.query_library(camera_models=["COOLPIX S9700"])
+        assert s9700.captured_at == datetime(2022, 7, 14, 10, 30)
+        assert s9700.import_run == run
+        assert [f.path for f in hash_store.query_library(duplicates=True)] == ["/photos/a.jpg", "/photos/b.jpg"]
+        assert [f.path for f in hash_store.query_library(hash_value=b"\x03" * 32)] == ["/photos/seeded.jpg"]
+        assert [f.path for f in hash_store.query_library(category="video")] == ["/photos/c.mp4"]
@@ -0,0 +1,52 @@
+from pathlib import Path
+
+from camera_transfer.os_file_getter import OSFileGetter
+
+
+def make_card(tmp_path: Path) -> Path:
+    card = tmp_path / "card"
+    for relative_path in [
+        "DCIM/100NIKON/DSCN0002.JPG",
+        "DCIM/100NIKON/dscn0001.jpg",
+        "DCIM/100NIKON/._DSCN0002.JPG",
+        "DCIM/100NIKON/DSCN0003.NEF",
+        "DCIM/101NIKON/DSCN0004.Mp4",
+        ".Trashes/501/DSCN0009.JPG",
+        "MISC/DSCN0010.JPG",
+    ]:
+        (card / relative_path).parent.mkdir(parents=True, exist_ok=True)
+        (card / relative_path).write_bytes(relative_path.encode())
+    return card
+
+
+def test_scan_skips_junk_and_ignores_case(tmp_path: Path) -> None:
+    card = make_card(tmp_path)
+    file_getter = OSFileGetter(location=card, file_extensions={".JPG", ".MP4"})
+
+    assert [path.relative_to(card.resolve()).as_posix() for path in file_getter.list_files()] == [
+        "DCIM/100NIKON/DSCN0002.JPG",
+        "DCIM/100NIKON/dscn0001.jpg",
+        "DCIM/101NIKON/DSCN0004.Mp4",
+    ]
+
+
+def test_scan_in_inode_order(tmp_path: Path) -> None:
+    card = make_card(tmp_path)
+    file_getter = OSFileGetter(location=card, file_extensions={".jpg", ".mp4"}, read_order="inode")
+
+    inodes = [path.stat().st_ino for path in file_getter.list_files()]
+    assert len(inodes) == 3
+    assert inodes == sorted(inodes)
+
+
+def test_files_carry_stat_data(tmp_path: Path) -> None:
+    card = make_card(tmp_path)
+    file_getter = OSFileGetter(location=card, file_extensions={".mp4"})
+
+    [file] = file_getter.get_next_file()
+    assert file.file_name == "DSCN0004.Mp4"
+    assert file.file_size == len(b"DCIM/101NIKON/DSCN0004.Mp4")
+    assert file.fingerprint is not None
+    assert file.fingerprint.path == "DCIM/101NIKON/DSCN0004.Mp4"
+    with file.open_file() as handle:
+        assert handle.read() == b"DCIM/101NIKON/DSCN0004.Mp4"
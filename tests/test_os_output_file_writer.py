@@ -0,0 +1,63 @@
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from camera_transfer.os_output_file_writer import OSOutputFileWriter
+
+
+def test_folders_are_created_once(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    writer = OSOutputFileWriter(base_image_location=tmp_path, base_video_location=tmp_path)
+    made = []
+    mkdir = Path.mkdir
+
+    def counting_mkdir(self: Path, *args: object, **kwargs: object) -> None:
+        made.append(self)
+        mkdir(self, *args, **kwargs)  # type: ignore[arg-type]
+
+    monkeypatch.setattr(Path, "mkdir", counting_mkdir)
+    writer.write_file("one.jpg", datetime(2024, 1, 1), [b"content"], "image", Path("2024/01 - January"))
+    assert made
+    made.clear()
+    writer.write_file("two.jpg", datetime(2024, 1, 1), [b"content"], "image", Path("2024/01 - January"))
+    assert made == []
+    assert sorted(p.name for p in (tmp_path / "2024/01 - January").iterdir()) == ["one.jpg", "two.jpg"]
+
+
+@pytest.mark.skipif(not hasattr(__import__("os"), "posix_fallocate"), reason="needs posix_fallocate")
+def test_preallocated_file_keeps_its_written_size(tmp_path: Path) -> None:
+    writer = OSOutputFileWriter(base_image_location=tmp_path, base_video_location=tmp_path, preallocate_min_size=1)
+    with writer.stage_file("video", Path("2024")) as staged_file:
+        staged_file.preallocate(1024 * 1024)
+        staged_file.write(b"shorter than expected")
+        staged_file.commit("video.mp4", datetime(2024, 1, 1))
+    assert (tmp_path / "2024/video.mp4").read_bytes() == b"shorter than expected"
+
+
+def test_clashing_names_are_numbered_after_one_listing(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    folder = tmp_path / "2024"
+    folder.mkdir()
+    (folder / "burst.jpg").write_bytes(b"already there")
+    writer = OSOutputFileWriter(base_image_location=tmp_path, base_video_location=tmp_path)
+    listed = []
+    scandir = os.scandir
+
+    def counting_scandir(path: str) -> Any:
+        listed.append(path)
+        return scandir(path)
+
+    monkeypatch.setattr(os, "scandir", counting_scandir)
+    for content in (b"first", b"second"):
+        writer.write_file("burst.jpg", datetime(2024, 1, 1), [content], "image", Path("2024"))
+    writer.write_file("BURST-1.JPG", datetime(2024, 1, 1), [b"third"], "image", Path("2024"))
+
+    assert listed == [str(folder)]
+    assert (folder / "burst.jpg").read_bytes() == b"already there"
+    assert (folder / "burst-1.jpg").read_bytes() == b"first"
+    assert (folder / "burst-2.jpg").read_bytes() == b"second"
+    # Compared without case, as on the filesystems most libraries live on.
+    assert (folder / "BURST-1-1.JPG").read_bytes() == b"third"
+    assert writer.destination_exists(str(folder / "burst-2.jpg"))
+    assert not writer.destination_exists(str(folder / "burst-3.jpg"))
@@ -0,0 +1,61 @@
+import io
+import os
+from pathlib import Path
+
+from rich.console import Console
+
+from camera_transfer import app
+from camera_transfer.camera_file import CHUNK_SIZE
+from camera_transfer.camera_settings import CameraSettings
+from camera_transfer.progress import TransferProgress
+
+
+def test_progress_follows_the_transfer(tmp_path: Path) -> None:
+    settings = CameraSettings(
+        camera_folder=Path(__file__).parent / "DCIM/duplicate_image",
+        main_photos_folder=tmp_path,
+        main_videos_folder=tmp_path,
+        sqlite_database=None,
+        camera_model_short_names={"COOLPIX S9700": "S9700"},
+        dry_run=False,
+        log_level="DEBUG",
+    )
+    camera_transfer = app.get_camera_transfer_operation(settings)
+    camera_transfer.scan_ahead = True
+    output = io.StringIO()
+    console = Console(file=output, width=200, force_terminal=False)
+
+    with TransferProgress(camera_transfer.metrics, refresh_per_second=100, console=console) as progress:
+        camera_transfer.run()
+
+    counters = camera_transfer.metrics.counters
+    assert counters["files_found"] == camera_transfer.metrics.files_done == 2
+    assert counters["bytes_done"] == counters["bytes_found"] > 0
+    assert progress.files_text().startswith("2/2 files, ")
+    assert progress.files_text().endswith("1 skipped, 0 failed")
+    assert "2/2 files" in output.getvalue()
+
+
+def test_progress_moves_partway_through_a_file(tmp_path: Path) -> None:
+    card = tmp_path / "card"
+    card.mkdir()
+    (card / "clip.mp4").write_bytes(os.urandom(3 * CHUNK_SIZE))
+    settings = CameraSettings(
+        camera_folder=card,
+        main_photos_folder=tmp_path,
+        main_videos_folder=tmp_path,
+        sqlite_database=None,
+        camera_model_short_names={},
+        dry_run=False,
+        log_level="DEBUG",
+    )
+    camera_transfer = app.get_camera_transfer_operation(settings)
+    metrics = camera_transfer.metrics
+    camera_file = next(iter(camera_transfer.camera_files()))
+    seen: list[int] = []
+
+    camera_transfer.copy_chunks(camera_file, lambda chunk: seen.append(metrics.counters["bytes_done"]))
+    metrics.done("copied", camera_file.file_size, camera_file)
+
+    assert seen == [0, CHUNK_SIZE, 2 * CHUNK_SIZE]
+    assert metrics.counters["bytes_done"] == metrics.counters["bytes_found"] == 3 * CHUNK_SIZE
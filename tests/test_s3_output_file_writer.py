@@ -0,0 +1,130 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+from camera_transfer import app  # noqa: E402
+from camera_transfer.camera_settings import CameraSettings  # noqa: E402
+from camera_transfer.s3_output_file_writer import MB, S3OutputFileWriter  # noqa: E402
+
+
+@pytest.fixture
+def s3_client(monkeypatch: pytest.MonkeyPatch) -> Iterator[Any]:
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with moto.mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket="photos")
+        yield client
+
+
+def test_upload_keeps_layout_and_modified_time(s3_client: Any, tmp_path: Path) -> None:
+    writer = S3OutputFileWriter(bucket="photos", client=s3_client, spool_folder=tmp_path)
+    modified = datetime(2024, 1, 2, 3, 4, 5)
+    writer.write_file("one.jpg", modified, [b"con", b"tent"], "image", Path("2024/01 - January"))
+
+    response = s3_client.get_object(Bucket="photos", Key="photos/2024/01 - January/one.jpg")
+    assert response["Body"].read() == b"content"
+    assert response["Metadata"]["file-last-modified"] == modified.isoformat()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_large_file_is_uploaded_in_parts(s3_client: Any, tmp_path: Path) -> None:
+    writer = S3OutputFileWriter(
+        bucket="photos", client=s3_client, spool_folder=tmp_path,
+        multipart_threshold=5 * MB, multipart_chunksize=5 * MB, max_concurrency=4,
+    )
+    content = os.urandom(12 * MB)
+    writer.write_file("clip.mp4", datetime(2024, 1, 1), [content], "video", Path("2024"))
+
+    key = "videos/2024/clip.mp4"
+    assert s3_client.get_object(Bucket="photos", Key=key)["Body"].read() == content
+    # Multipart uploads get an ETag of the form <md5 of part md5s>-<parts>.
+    assert s3_client.head_object(Bucket="photos", Key=key)["ETag"].strip('"').endswith("-3")
+
+
+def test_existing_object_is_not_replaced(s3_client: Any, tmp_path: Path) -> None:
+    s3_client.put_object(Bucket="photos", Key="photos/2024/one.jpg", Body=b"first")
+    writer = S3OutputFileWriter(bucket="photos", client=s3_client, spool_folder=tmp_path)
+    writer.write_file("one.jpg", datetime(2024, 1, 1), [b"second"], "image", Path("2024"))
+    writer.write_file("one.jpg", datetime(2024, 1, 1), [b"third"], "image", Path("2024"))
+    assert s3_client.get_object(Bucket="photos", Key="photos/2024/one.jpg")["Body"].read() == b"first"
+    assert s3_client.get_object(Bucket="photos", Key="photos/2024/one-1.jpg")["Body"].read() == b"second"
+    assert s3_client.get_object(Bucket="photos", Key="photos/2024/one-2.jpg")["Body"].read() == b"third"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_recover_staged_reports_finished_uploads(s3_client: Any, tmp_path: Path) -> None:
+    writer = S3OutputFileWriter(bucket="photos", client=s3_client, spool_folder=tmp_path)
+    writer.write_file("one.jpg", datetime(2024, 1, 1), [b"content"], "image", Path("2024"))
+    leftover = tmp_path / ".camera-transfer-left.part"
+    leftover.write_bytes(b"content")
+
+    assert writer.recover_staged(str(leftover), "s3://photos/photos/2024/one.jpg", 7)
+    assert not leftover.exists()
+    assert not writer.recover_staged(str(leftover), "s3://photos/photos/2024/two.jpg", 7)
+
+
+def test_uploads_are_cataloged_by_url_and_not_verified(s3_client: Any, tmp_path: Path) -> None:
+    settings = CameraSettings(
+        camera_folder=Path(__file__).parent / "DCIM/single_image",
+        main_photos_folder=tmp_path,
+        main_videos_folder=tmp_path,
+        sqlite_database=tmp_path / "test.db",
+        camera_model_short_names={"COOLPIX S9700": "S9700"},
+        dry_run=False,
+        log_level="DEBUG",
+        s3_bucket="photos",
+    )
+    camera_transfer = app.get_camera_transfer_operation(settings)
+    camera_transfer.run()
+    camera_transfer.hash_store.flush()
+
+    [library_file] = app.query_library(settings)
+    key = f"photos/{camera_transfer.sub_folder.as_posix()}/2022-07-27T115409_S9700_6228.JPG"
+    assert library_file.path == f"s3://photos/{key}"
+    assert s3_client.head_object(Bucket="photos", Key=key)["ContentLength"] == library_file.size
+    report = app.verify_library(settings)
+    assert report.ok and report.verified == 0 and report.missing == []
+
+
+def test_concurrent_commits_share_the_request_limit(s3_client: Any, tmp_path: Path) -> None:
+    writer = S3OutputFileWriter(bucket="photos", client=s3_client, spool_folder=tmp_path, max_concurrency=2)
+    lock = threading.Lock()
+    running = peak = 0
+
+    def started(**kwargs: Any) -> None:
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+
+    def finished(**kwargs: Any) -> None:
+        nonlocal running
+        with lock:
+            running -= 1
+
+    s3_client.meta.events.register("before-call.s3.PutObject", started)
+    s3_client.meta.events.register("after-call.s3.PutObject", finished)
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            for future in [
+                pool.submit(writer.write_file, f"{n}.jpg", datetime(2024, 1, 1), [b"content"], "image", Path("2024"))
+                for n in range(8)
+            ]:
+                future.result()
+    finally:
+        writer.close()
+
+    assert len(s3_client.list_objects_v2(Bucket="photos")["Contents"]) == 8
+    assert peak == 2
@@ -0,0 +1,26 @@
+import json
+import subprocess
+import sys
+
+# Modules that take a noticeable time to import and are only imported by the
+# command that needs them.
+DEFERRED_MODULES = [
+    "exif",
+    "pydantic",
+    "pydantic_settings",
+    "platformdirs",
+    "rich",
+    "camera_transfer.camera_settings",
+    "camera_transfer.camera_transfer",
+    "camera_transfer.library_seed",
+    "camera_transfer.transfer_plan",
+]
+
+
+def test_cli_import_defers_slow_modules() -> None:
+    code = (
+        "import json, sys, camera_transfer.app; "
+        f"print(json.dumps([m for m in {DEFERRED_MODULES!r} if m in sys.modules]))"
+    )
+    completed = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True)
+    assert json.loads(completed.stdout) == []
@@ -0,0 +1,116 @@
+import io
+import struct
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import BinaryIO
+
+from camera_transfer.camera_video import CameraVideo
+from camera_transfer.video_metadata import MP4_EPOCH, VideoTags, read_video_tags
+
+VIDEO_FILE = Path(__file__).parent / "DCIM/single_video/blank_video.mp4"
+
+
+def box(box_type: bytes, content: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(content), box_type) + content
+
+
+def mvhd(creation_time: datetime) -> bytes:
+    seconds = int((creation_time - MP4_EPOCH).total_seconds())
+    return box(b"mvhd", struct.pack(">B3xII", 0, seconds, seconds) + bytes(88))
+
+
+def quicktime_meta(items: dict[str, str]) -> bytes:
+    keys = b"".join(struct.pack(">I4s", 8 + len(key), b"mdta") + key.encode() for key in items)
+    ilst = b"".join(
+        box(struct.pack(">I", index), box(b"data", struct.pack(">II", 1, 0) + value.encode()))
+        for index, value in enumerate(items.values(), start=1)
+    )
+    hdlr = box(b"hdlr", bytes(8) + b"mdta" + bytes(13))
+    return box(b"meta", hdlr + box(b"keys", struct.pack(">II", 0, len(items)) + keys) + box(b"ilst", ilst))
+
+
+class CountingReader(io.BytesIO):
+    bytes_read = 0
+
+    def read(self, size: int | None = -1) -> bytes:
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def test_blank_video_without_creation_time() -> None:
+    # Its mvhd creation time is 0 and it ends with a box that runs past the end of the file.
+    with VIDEO_FILE.open("rb") as handle:
+        assert read_video_tags(handle, VIDEO_FILE.stat().st_size) == VideoTags(creation_time=None)
+
+
+def test_moov_at_the_end_is_found_by_seeking() -> None:
+    created = datetime(2024, 1, 25, 16, 0, 3, tzinfo=timezone.utc)
+    mdat = struct.pack(">I4sQ", 1, b"mdat", 16 + 8 * 1024 * 1024) + bytes(8 * 1024 * 1024)
+    data = box(b"ftyp", b"isom" + bytes(4)) + mdat + box(b"moov", mvhd(created))
+    handle = CountingReader(data)
+
+    tags = read_video_tags(handle, len(data))
+
+    assert tags == VideoTags(creation_time=created.astimezone().replace(tzinfo=None))
+    assert handle.bytes_read < 4096
+
+
+def test_quicktime_metadata_is_preferred() -> None:
+    moov = box(b"moov", mvhd(datetime(2024, 1, 25, 16, 0, 3, tzinfo=timezone.utc)) + quicktime_meta({
+        "com.apple.quicktime.make": "Apple",
+        "com.apple.quicktime.model": "iPhone 12",
+        "com.apple.quicktime.creationdate": "2024-01-25T17:00:03+0100",
+    }))
+    tags = read_video_tags(io.BytesIO(moov), len(moov))
+    assert tags == VideoTags(creation_time=datetime(2024, 1, 25, 17, 0, 3), make="Apple", model="iPhone 12")
+
+
+def test_user_data_model() -> None:
+    text = "COOLPIX S9700".encode()
+    udta = box(b"udta", box(b"\xa9mod", struct.pack(">HH", len(text), 0) + text))
+    moov = box(b"moov", udta)
+    assert read_video_tags(io.BytesIO(moov), len(moov)) == VideoTags(creation_time=None, model="COOLPIX S9700")
+
+
+def test_video_named_like_images_when_model_is_known() -> None:
+    moov = box(b"moov", quicktime_meta({
+        "com.apple.quicktime.model": "COOLPIX S9700",
+        "com.apple.quicktime.creationdate": "2022-07-27T11:54:09+0100",
+    }))
+    data = box(b"ftyp", b"isom" + bytes(4)) + moov
+
+    def open_file() -> BinaryIO:
+        return io.BytesIO(data)
+
+    video = CameraVideo(
+        file_name="DSCN6230.MP4",
+        file_size=len(data),
+        file_last_modified=datetime(2024, 1, 1),
+        file_category="video",
+        open_file=open_file,
+        extra_fields={"camera_model_short_names": {"COOLPIX S9700": "S9700"}},
+    )
+    assert video.generate_new_file_name() == "2022-07-27T115409_S9700_6230.MP4"
+    assert video.captured_at() == datetime(2022, 7, 27, 11, 54, 9)
+
+
+def test_corrupt_creation_time_falls_back_to_modification_time() -> None:
+    # A 64 bit creation time far past the year 9999.
+    huge = 2**63
+    moov = box(b"moov", box(b"mvhd", struct.pack(">B3xQQ", 1, huge, huge) + bytes(88)))
+    data = box(b"ftyp", b"isom" + bytes(4)) + moov
+
+    def open_file() -> BinaryIO:
+        return io.BytesIO(data)
+
+    video = CameraVideo(
+        file_name="MVI_0001.MOV",
+        file_size=len(data),
+        file_last_modified=datetime(2024, 1, 1, 12, 0, 0),
+        file_category="video",
+        open_file=open_file,
+        extra_fields={"camera_model_short_names": {}},
+    )
+    assert video.captured_at() == datetime(2024, 1, 1, 12, 0, 0)
+    assert video.generate_new_file_name() == "2024-01-01T120000_video.MOV"